@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Benchmark the storagebox importers on synthetic datasets
+
+Runs each import strategy on synthetic export files against a fresh
+database and reports rows/s, rejected rows, seconds and peak RSS per
+strategy and table.
+
+Usage:
+    python3 benchmark-import.py [--scale 10k|1M|10M|N ...] [--strategy NAME ...]
+                                [--database-url URL | --pg-bin DIR] [--pg-setting NAME=VALUE ...]
+                                [--work-dir DIR] [--output PATH] [--no-commas] [--seed N] [--keep]
+
+    Without --database-url a throwaway cluster is created with initdb in the
+    work directory and removed at the end.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import socket
+import argparse
+import logging
+import tempfile
+import subprocess
+from urllib.parse import urlparse, urlunparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from content_migration.synthetic import DEFAULT_SEED, SCALES, dataset_counts, generate_dataset, parse_scale
+from content_migration.tables import TABLES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCHEMA_GLOB = os.path.join(SCRIPTS_DIR, '..', 'prisma', 'migrations', '*', 'migration.sql')
+
+
+class Strategy(object):
+    """One importer invocation to benchmark."""
+
+    def __init__(self, name, script, args=(), splits_on_commas=False):
+        """Initialize strategy
+
+        Args:
+            name: Strategy name used on the command line and in the report
+            script: Importer script in this directory
+            args: Extra arguments; '{progress_file}' and '{storagebox}' are
+                replaced per run
+            splits_on_commas: The importer splits lines on every comma and
+                needs the dataset without commas inside values
+        """
+        self.name = name
+        self.script = script
+        self.args = tuple(args)
+        self.splits_on_commas = splits_on_commas
+
+    def command(self, progress_file, storagebox):
+        args = [arg.format(progress_file=progress_file, storagebox=storagebox) for arg in self.args]
+        return [sys.executable, os.path.join(SCRIPTS_DIR, self.script)] + args
+
+
+_STORAGEBOX_ARGS = ('--import-only', '--storagebox-path', '{storagebox}', '--progress-file', '{progress_file}')
+
+_ENGINE_ARGS = ('--source', 'files', '--storagebox-path', '{storagebox}', '--progress-file', '{progress_file}')
+
+STRATEGIES = [
+    Strategy('storagebox-savepoint', 'migrate-content-data-via-storagebox.py',
+             _STORAGEBOX_ARGS + ('--backend', 'savepoint'), splits_on_commas=True),
+    Strategy('storagebox-pipeline', 'migrate-content-data-via-storagebox.py',
+             _STORAGEBOX_ARGS + ('--backend', 'pipeline'), splits_on_commas=True),
+    Strategy('storagebox-copy', 'migrate-content-data-via-storagebox.py',
+             _STORAGEBOX_ARGS + ('--backend', 'copy'), splits_on_commas=True),
+    Strategy('simple', 'import-from-storagebox-simple.py', ('--progress-file', '{progress_file}')),
+    Strategy('simple-workers', 'import-from-storagebox-simple.py',
+             ('--progress-file', '{progress_file}', '--workers', str(max(2, os.cpu_count() or 2)))),
+    # Imports languages and grammar courses only
+    Strategy('psql', 'import-from-storagebox-psql.py', splits_on_commas=True),
+    Strategy('engine-copy', 'migrate-content.py', _ENGINE_ARGS + ('--sink', 'copy')),
+    Strategy('engine-psql', 'migrate-content.py', _ENGINE_ARGS + ('--sink', 'psql')),
+]
+
+STRATEGIES_BY_NAME = dict((strategy.name, strategy) for strategy in STRATEGIES)
+
+
+def _with_database(url, database):
+    parsed = urlparse(url)
+    return urlunparse(parsed._replace(path='/' + database))
+
+
+def run_psql(url, sql=None, path=None):
+    """Run SQL (or a file) with psql against url; returns stdout."""
+    cmd = ['psql', '-X', '-q', '-A', '-t', '-v', 'ON_ERROR_STOP=1', '-d', url]
+    if path is not None:
+        cmd += ['-f', path]
+    else:
+        cmd += ['-c', sql]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("psql failed: {}".format(result.stderr.strip()))
+    return result.stdout
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TemporaryCluster(object):
+    """A PostgreSQL cluster created with initdb for one benchmark session."""
+
+    def __init__(self, directory, pg_bin=None, settings=()):
+        self.directory = directory
+        self.data_dir = os.path.join(directory, 'pgdata')
+        self.pg_bin = pg_bin
+        self.settings = list(settings)
+        self.port = None
+
+    def _tool(self, name):
+        return os.path.join(self.pg_bin, name) if self.pg_bin else name
+
+    @property
+    def url(self):
+        return 'postgresql://postgres@127.0.0.1:{}/postgres'.format(self.port)
+
+    def start(self):
+        subprocess.run([self._tool('initdb'), '-D', self.data_dir, '-U', 'postgres', '--auth=trust',
+                        '--encoding=UTF8', '--no-locale'], check=True, stdout=subprocess.DEVNULL)
+        self.port = _free_port()
+        options = ['-p', str(self.port), '-c', 'listen_addresses=127.0.0.1', '-k', self.directory]
+        for setting in self.settings:
+            options += ['-c', setting]
+        subprocess.run([self._tool('pg_ctl'), '-D', self.data_dir, '-w', '-l',
+                        os.path.join(self.directory, 'postgres.log'), '-o', ' '.join(options), 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        logger.info("Started temporary PostgreSQL on port {} ({})".format(self.port, self.data_dir))
+        return self
+
+    def stop(self):
+        if self.port is None:
+            return
+        subprocess.run([self._tool('pg_ctl'), '-D', self.data_dir, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        self.port = None
+
+
+def create_database(admin_url, database, schema_files):
+    run_psql(admin_url, 'DROP DATABASE IF EXISTS "{}"'.format(database))
+    run_psql(admin_url, 'CREATE DATABASE "{}" ENCODING \'UTF8\' TEMPLATE template0'.format(database))
+    url = _with_database(admin_url, database)
+    for path in schema_files:
+        run_psql(url, path=path)
+    return url
+
+
+def table_counts(url):
+    sql = ' UNION ALL '.join(
+        "SELECT '{0}', count(*) FROM \"{0}\"".format(spec.target) for spec in TABLES)
+    counts = {}
+    for line in run_psql(url, sql).splitlines():
+        if '|' in line:
+            name, count = line.split('|')
+            counts[name] = int(count)
+    return counts
+
+
+def read_progress(path):
+    """Per-table figures from the table_finish records of a progress file."""
+    tables = {}
+    if not os.path.exists(path):
+        return tables
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('event') == 'table_finish':
+                tables[record['table']] = {
+                    'rows': record['rows'],
+                    'seconds': record['elapsed_seconds'],
+                    'rows_per_second': record['rows_per_second'],
+                    'rejected': record['error_count'],
+                }
+    return tables
+
+
+def run_importer(command, env, cwd, log_path):
+    """Run an importer; returns (exit code, wall seconds, peak RSS bytes)."""
+    with open(log_path, 'w', encoding='utf-8') as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 returns the rusage of this child (and its waited-for children)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return process.returncode, elapsed, peak_rss
+
+
+def prepare_dataset(work_dir, scale, words, commas, seed):
+    """Generate (or reuse) the dataset; returns the storagebox root."""
+    name = 'data-{}{}-{}'.format(scale, '' if commas else '-nocommas', seed)
+    storagebox = os.path.join(work_dir, name)
+    marker = os.path.join(storagebox, 'complete')
+    if not os.path.exists(marker):
+        logger.info("Generating {} dataset ({} words{})".format(scale, words, '' if commas else ', no commas'))
+        generate_dataset(os.path.join(storagebox, 'content-migration'), words, seed=seed, commas=commas)
+        open(marker, 'w').close()
+    return storagebox
+
+
+def benchmark(strategy, scale, words, admin_url, work_dir, schema_files, args):
+    commas = not (args.no_commas or strategy.splits_on_commas)
+    storagebox = prepare_dataset(work_dir, scale, words, commas, args.seed)
+    database = 'content_bench_{}_{}'.format(strategy.name, scale).replace('-', '_').lower()
+    run_dir = os.path.join(work_dir, 'runs', database)
+    os.makedirs(run_dir, exist_ok=True)
+    progress_file = os.path.join(run_dir, 'progress.jsonl')
+    if os.path.exists(progress_file):
+        os.remove(progress_file)
+
+    url = create_database(admin_url, database, schema_files)
+    env = os.environ.copy()
+    env.update({
+        'DATABASE_URL': url,
+        'STORAGEBOX_PATH': storagebox,
+        'MIGRATION_PROGRESS_FILE': progress_file,
+    })
+    logger.info("Running {} on {} ({} words)".format(strategy.name, scale, words))
+    code, elapsed, peak_rss = run_importer(strategy.command(progress_file, storagebox), env, run_dir,
+                                           os.path.join(run_dir, 'importer.log'))
+    result = {
+        'strategy': strategy.name,
+        'scale': scale,
+        'words': words,
+        'dataset': 'full' if commas else 'no-commas',
+        'exit_code': code,
+        'seconds': round(elapsed, 3),
+        'peak_rss_bytes': peak_rss,
+        'tables': read_progress(progress_file),
+        'database_rows': table_counts(url),
+        'log': os.path.join(run_dir, 'importer.log'),
+    }
+    if code != 0:
+        logger.error("{} failed on {} (exit {}); see {}".format(strategy.name, scale, code, result['log']))
+    if not args.keep:
+        run_psql(admin_url, 'DROP DATABASE IF EXISTS "{}"'.format(database))
+    return result
+
+
+def log_report(results):
+    logger.info("=" * 78)
+    logger.info("{:<22} {:>6} {:>10} {:>11} {:>12}".format('strategy', 'scale', 'seconds', 'peak RSS', 'status'))
+    for result in results:
+        logger.info("{:<22} {:>6} {:>10.1f} {:>8.0f} MB {:>12}".format(
+            result['strategy'], result['scale'], result['seconds'], result['peak_rss_bytes'] / 1048576.0,
+            'ok' if result['exit_code'] == 0 else 'exit {}'.format(result['exit_code'])))
+    for result in results:
+        logger.info("-" * 78)
+        logger.info("{} / {} ({} dataset)".format(result['strategy'], result['scale'], result['dataset']))
+        logger.info("  {:<22} {:>10} {:>10} {:>10} {:>9}".format('table', 'rows', 'rows/s', 'rejected', 'seconds'))
+        for spec in TABLES:
+            table = result['tables'].get(spec.key)
+            if table is None:
+                continue
+            logger.info("  {:<22} {:>10} {:>10} {:>10} {:>9.1f}".format(
+                spec.key, result['database_rows'].get(spec.target, table['rows']),
+                table['rows_per_second'] or 0, table['rejected'], table['seconds']))
+    logger.info("=" * 78)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the storagebox importers on synthetic datasets')
+    parser.add_argument('--scale', action='append',
+                        help='Words per dataset: {} or a number (repeatable, default: 10k)'.format(
+                            ', '.join(sorted(SCALES, key=SCALES.get))))
+    parser.add_argument('--strategy', action='append', choices=[strategy.name for strategy in STRATEGIES],
+                        help='Import strategy to run (repeatable, default: all)')
+    parser.add_argument('--database-url',
+                        help='Superuser URL of a disposable PostgreSQL server (default: start one with initdb)')
+    parser.add_argument('--pg-bin', help='Directory with initdb and pg_ctl (default: PATH)')
+    parser.add_argument('--pg-setting', action='append', default=[],
+                        help='NAME=VALUE server setting for the temporary cluster (repeatable)')
+    parser.add_argument('--schema', action='append',
+                        help='Schema SQL file applied to every database (default: the Prisma migrations)')
+    parser.add_argument('--work-dir', help='Directory for datasets, logs and the temporary cluster')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--no-commas', action='store_true',
+                        help='Generate every dataset without commas inside values')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Dataset random seed')
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark databases and work directory')
+    args = parser.parse_args()
+
+    scales = args.scale or ['10k']
+    strategies = [STRATEGIES_BY_NAME[name] for name in (args.strategy or [s.name for s in STRATEGIES])]
+    schema_files = args.schema or sorted(glob.glob(DEFAULT_SCHEMA_GLOB))
+    if not schema_files:
+        logger.error("No schema files found ({})".format(DEFAULT_SCHEMA_GLOB))
+        return 1
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='content-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    cluster = None
+    results = []
+    try:
+        admin_url = args.database_url
+        if admin_url is None:
+            cluster = TemporaryCluster(os.path.join(work_dir, 'cluster'), args.pg_bin, args.pg_setting).start()
+            admin_url = cluster.url
+
+        for scale in scales:
+            words = parse_scale(scale)
+            logger.info("Dataset {}: {}".format(scale, ', '.join(
+                '{} {}'.format(count, key) for key, count in sorted(dataset_counts(words).items()))))
+            for strategy in strategies:
+                results.append(benchmark(strategy, scale, words, admin_url, work_dir, schema_files, args))
+    finally:
+        if cluster is not None:
+            cluster.stop()
+        if results:
+            log_report(results)
+        if args.output and results:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            logger.info("Results written to {}".format(args.output))
+        failed = any(result['exit_code'] != 0 for result in results)
+        if not (args.keep or args.work_dir or failed):
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elif failed:
+            logger.info("Logs kept in {}".format(work_dir))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
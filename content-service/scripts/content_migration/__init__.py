@@ -0,0 +1,6 @@
+"""
+Content Migration Support Package
+
+Shared building blocks for the content data migration scripts. Copy it
+alongside the scripts when they run from another location.
+"""
@@ -0,0 +1,384 @@
+"""
+Transaction batching with savepoint-based error isolation
+
+The batchers run queued statements in batches and, when a batch fails,
+retry its rows one by one so only the bad rows are rejected.
+"""
+
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rows per savepoint / psql round trip
+DEFAULT_BATCH_SIZE = 500
+
+# Rows per COMMIT; bounds WAL held by one transaction and lock hold time
+DEFAULT_COMMIT_INTERVAL = 5000
+
+# psql's \timing output
+_TIMING_RE = re.compile(r'^Time: ([0-9.]+) ms', re.MULTILINE)
+
+
+def _throttled_flush(batch, flush):
+    """Run flush() under batch.throttle: pause first, then report the batch and resize."""
+    throttle = batch.throttle
+    rows = len(batch._pending)
+    if throttle is None or not rows:
+        flush()
+        return
+    throttle.wait()
+    start = time.perf_counter()
+    flush()
+    batch.batch_size = throttle.observe_batch(time.perf_counter() - start, rows, batch.batch_size)
+
+
+class SavepointBatch(object):
+    """Batch statements on a psycopg2 cursor with a savepoint per batch."""
+
+    def __init__(self, cursor, on_success=None, on_error=None, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, progress=None, throttle=None):
+        """Initialize batch
+
+        Args:
+            cursor: psycopg2 cursor (or TimedCursor) inside an open transaction
+            on_success: Called as on_success(key, new_id) per inserted row;
+                new_id is the first RETURNING column, or None
+            on_error: Called as on_error(key, exception) per rejected row
+            batch_size: Statements per savepoint
+            commit_interval: Commit after at least this many rows (0 leaves
+                committing to the caller)
+            progress: Optional TableProgress used to time commits
+            throttle: Optional AdaptiveThrottle setting the pace and batch size
+        """
+        self.cursor = cursor
+        self.on_success = on_success
+        self.on_error = on_error
+        self.batch_size = max(1, batch_size)
+        self.commit_interval = commit_interval
+        self.progress = progress
+        self.throttle = throttle
+        self.succeeded = 0
+        self.failed = 0
+        self.retried_batches = 0
+        self.commits = 0
+        self._pending = []
+        self._uncommitted = 0
+
+    def execute(self, sql, params=None, key=None):
+        """Queue one statement; runs the batch once it is full."""
+        self._pending.append((sql, params, key))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _run(self, sql, params):
+        self.cursor.execute(sql, params)
+        if self.cursor.description is None:
+            return None
+        return self.cursor.fetchone()[0]
+
+    def _run_batch(self, pending):
+        """Execute the statements of one batch and return their results in order."""
+        return [self._run(sql, params) for sql, params, _ in pending]
+
+    def flush(self):
+        """Run the queued statements inside one savepoint."""
+        _throttled_flush(self, self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        cursor = self.cursor
+        cursor.execute('SAVEPOINT import_batch')
+        try:
+            results = self._run_batch(pending)
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT import_batch')
+            self.retried_batches += 1
+            logger.debug("Batch of {} rows failed ({}); retrying rows individually".format(len(pending), e))
+            self._retry(pending)
+        else:
+            cursor.execute('RELEASE SAVEPOINT import_batch')
+            for (_, _, key), result in zip(pending, results):
+                self._success(key, result)
+
+        self._uncommitted += len(pending)
+        if self.commit_interval and self._uncommitted >= self.commit_interval:
+            self.commit()
+
+    def _retry(self, pending):
+        cursor = self.cursor
+        for sql, params, key in pending:
+            cursor.execute('SAVEPOINT import_row')
+            try:
+                result = self._run(sql, params)
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT import_row')
+                self.failed += 1
+                if self.on_error is not None:
+                    self.on_error(key, e)
+            else:
+                cursor.execute('RELEASE SAVEPOINT import_row')
+                self._success(key, result)
+
+    def _success(self, key, result):
+        self.succeeded += 1
+        if self.on_success is not None:
+            self.on_success(key, result)
+
+    def commit(self):
+        connection = self.cursor.connection
+        start = time.perf_counter()
+        if self.progress is not None:
+            self.progress.call(connection.commit)
+        else:
+            connection.commit()
+        if self.throttle is not None:
+            self.throttle.observe_commit(time.perf_counter() - start)
+        self.commits += 1
+        self._uncommitted = 0
+
+    def finish(self):
+        """Flush the last batch and commit it (unless commit_interval is 0)."""
+        self.flush()
+        if self.commit_interval and self._uncommitted:
+            self.commit()
+
+
+class PipelineBatch(SavepointBatch):
+    """SavepointBatch that sends each batch through libpq pipeline mode.
+
+    SavepointBatch waits for every statement's result (e.g. its RETURNING id)
+    before sending the next one, so each row costs a full round trip. In
+    pipeline mode all statements of a batch are sent back to back on the same
+    connection and the results are read afterwards, one cursor per statement,
+    so they are matched to their keys by position. Requires psycopg 3 (the
+    connection must have .pipeline()) and libpq 14 or newer.
+
+    When any statement of the pipeline fails the batch is rolled back to its
+    savepoint and retried row by row without the pipeline, as in
+    SavepointBatch.
+    """
+
+    def _run_batch(self, pending):
+        connection = self.cursor.connection
+        start = time.perf_counter()
+        try:
+            cursors = []
+            with connection.pipeline():
+                for sql, params, _ in pending:
+                    cursor = connection.cursor()
+                    cursor.execute(sql, params)
+                    cursors.append(cursor)
+            # Leaving the block syncs the pipeline and raises the first error
+            results = []
+            for cursor in cursors:
+                results.append(cursor.fetchone()[0] if cursor.description is not None else None)
+                cursor.close()
+            return results
+        finally:
+            if self.progress is not None:
+                self.progress.record_db(time.perf_counter() - start)
+
+
+_PSQL_HEADER = (
+    '\\set QUIET on\n'
+    '\\pset format unaligned\n'
+    '\\pset tuples_only on\n'
+)
+
+
+class PsqlBatch(object):
+    """Batch INSERT statements into one psql script (and transaction) per batch.
+
+    Each statement gets `RETURNING id, <position>` appended, so results can be
+    matched to rows even when some statements fail. A batch runs with
+    ON_ERROR_STOP; if it fails it is re-run once with ON_ERROR_ROLLBACK, which
+    makes psql wrap every statement in its own savepoint, so only the bad
+    rows are dropped and the rest of the batch commits.
+    """
+
+    def __init__(self, run, on_success=None, on_error=None, batch_size=DEFAULT_BATCH_SIZE, progress=None,
+                 throttle=None):
+        """Initialize batch
+
+        Args:
+            run: Callable taking a psql script (fed on stdin) and returning
+                (stdout, stderr); raises on a non-zero psql exit status
+            on_success: Called as on_success(key, new_id) per inserted row
+            on_error: Called as on_error(key, exception) per rejected row
+            batch_size: Statements per psql invocation / transaction
+            progress: Optional TableProgress used to time psql round trips
+            throttle: Optional AdaptiveThrottle setting the pace and batch
+                size; the COMMIT is timed with psql's \\timing for it
+        """
+        self.run = run
+        self.on_success = on_success
+        self.on_error = on_error
+        self.batch_size = max(1, batch_size)
+        self.progress = progress
+        self.throttle = throttle
+        # Have psql report every statement's time (\timing), for the throttle
+        # and for --profile (see server_seconds())
+        self.timing = throttle is not None
+        self.succeeded = 0
+        self.failed = 0
+        self.retried_batches = 0
+        self._pending = []
+
+    def execute(self, statement, key=None):
+        """Queue one INSERT statement (without RETURNING or trailing semicolon)."""
+        self._pending.append((statement.strip().rstrip(';'), key))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _prologue(self):
+        """SQL run once per psql session before the transaction."""
+        return ''
+
+    def _statement(self, position, item):
+        return '{}\nRETURNING id, {};\n'.format(item, position)
+
+    def _script(self, pending, isolate):
+        parts = [_PSQL_HEADER]
+        if isolate:
+            parts.append('\\set ON_ERROR_STOP off\n\\set ON_ERROR_ROLLBACK on\n')
+        else:
+            parts.append('\\set ON_ERROR_STOP on\n')
+        if self.timing:
+            parts.append('\\timing on\n')
+        parts.append(self._prologue())
+        parts.append('BEGIN;\n')
+        for position, (item, _) in enumerate(pending):
+            parts.append(self._statement(position, item))
+        parts.append('COMMIT;\n')
+        return ''.join(parts)
+
+    def _call(self, script):
+        if self.progress is not None:
+            return self.progress.call(self.run, script)
+        return self.run(script)
+
+    @staticmethod
+    def server_seconds(stdout):
+        """Seconds the statements of a script took, as reported by psql's \\timing."""
+        return sum(float(ms) for ms in _TIMING_RE.findall(stdout)) / 1000
+
+    @staticmethod
+    def _parse(stdout):
+        results = {}
+        for line in stdout.splitlines():
+            fields = line.strip().split('|')
+            if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                results[int(fields[1])] = int(fields[0])
+        return results
+
+    def flush(self):
+        """Run the queued statements as one psql script."""
+        _throttled_flush(self, self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        errors = []
+        try:
+            stdout, _ = self._call(self._script(pending, isolate=False))
+        except RuntimeError as e:
+            self.retried_batches += 1
+            logger.debug("Batch of {} rows failed ({}); retrying rows individually".format(
+                len(pending), str(e).strip().splitlines()[0] if str(e).strip() else e))
+            stdout, stderr = self._call(self._script(pending, isolate=True))
+            # psql prints one ERROR line per failed statement, in order
+            errors = [line for line in stderr.splitlines() if 'ERROR:' in line]
+        results = self._parse(stdout)
+        if self.throttle is not None:
+            timings = _TIMING_RE.findall(stdout)
+            if timings:
+                self.throttle.observe_commit(float(timings[-1]) / 1000)
+
+        missing = 0
+        for position, (_, key) in enumerate(pending):
+            if position in results:
+                self.succeeded += 1
+                if self.on_success is not None:
+                    self.on_success(key, results[position])
+                continue
+            message = errors[missing] if missing < len(errors) else 'row rejected in batch retry'
+            missing += 1
+            self.failed += 1
+            if self.on_error is not None:
+                self.on_error(key, RuntimeError(message))
+
+    def finish(self):
+        """Run the last (partial) batch."""
+        self.flush()
+
+
+def sql_literal(value):
+    """Render a Python value as a PostgreSQL literal (None -> NULL).
+
+    Strings are always quoted, so their type comes from the context they are
+    used in (e.g. a prepared statement parameter) and bad input is rejected
+    by the server's input function rather than parsed as SQL.
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, int):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+class PreparedPsqlBatch(PsqlBatch):
+    """PsqlBatch that PREPAREs the INSERT once per session and EXECUTEs it per row."""
+
+    def __init__(self, run, statement, types=None, on_success=None, on_error=None,
+                 batch_size=DEFAULT_BATCH_SIZE, progress=None, name='import_row', throttle=None):
+        """Initialize batch
+
+        Args:
+            run: Callable taking a psql script and returning (stdout, stderr)
+            statement: INSERT with $1..$n placeholders, without RETURNING
+            types: Optional PostgreSQL types of $1..$n; by default the server
+                infers them from the target columns
+            on_success: Called as on_success(key, new_id) per inserted row
+            on_error: Called as on_error(key, exception) per rejected row
+            batch_size: Rows per psql invocation / transaction
+            progress: Optional TableProgress used to time psql round trips
+            name: Prepared statement name
+            throttle: Optional AdaptiveThrottle (see PsqlBatch)
+        """
+        super(PreparedPsqlBatch, self).__init__(run, on_success, on_error, batch_size=batch_size, progress=progress,
+                                                throttle=throttle)
+        self.statement = statement.strip().rstrip(';')
+        self.types = tuple(types) if types else None
+        self.name = name
+        self._arity = None
+
+    def execute(self, params, key=None):
+        """Queue one row of parameter values for $1..$n."""
+        params = tuple(params)
+        if self._arity is None:
+            self._arity = len(params)
+        elif len(params) != self._arity:
+            raise ValueError("Expected {} parameters, got {}".format(self._arity, len(params)))
+        self._pending.append((params, key))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _prologue(self):
+        # The row's batch position is passed as an extra parameter so results
+        # can be matched to rows as in PsqlBatch
+        types = ''
+        if self.types:
+            types = ' ({}, integer)'.format(', '.join(self.types))
+        return 'PREPARE {}{} AS {}\nRETURNING id, ${}::integer;\n'.format(
+            self.name, types, self.statement, (self._arity or 0) + 1)
+
+    def _statement(self, position, item):
+        return 'EXECUTE {}({});\n'.format(self.name, ', '.join(
+            [sql_literal(value) for value in item] + [str(position)]))
@@ -0,0 +1,244 @@
+"""
+Bulk-load mode: defer secondary indexes and foreign keys during an import
+
+BulkLoad drops the non-unique indexes and foreign keys of the target tables
+before a load and rebuilds them in parallel afterwards. The dropped
+definitions are kept in a state file, so the next run can restore them.
+"""
+
+import os
+import json
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Tables whose per-row index and FK maintenance dominates the import
+BULK_LOAD_TABLES = ('Word', 'WordThemeRelation')
+
+DEFAULT_REBUILD_WORKERS = 4
+
+DEFAULT_MAINTENANCE_WORK_MEM = '256MB'
+
+_INDEXES_SQL = """
+    SELECT coalesce(json_agg(json_build_array(i.relname, t.relname, pg_get_indexdef(i.oid))
+                             ORDER BY t.relname, i.relname), '[]')::text
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = current_schema()
+      AND t.relname IN ({tables})
+      AND NOT x.indisprimary
+      AND NOT x.indisunique
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+"""
+
+_FOREIGN_KEYS_SQL = """
+    SELECT coalesce(json_agg(json_build_array(c.conname, t.relname, pg_get_constraintdef(c.oid))
+                             ORDER BY t.relname, c.conname), '[]')::text
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = current_schema()
+      AND c.contype = 'f'
+      AND t.relname IN ({tables})
+"""
+
+_EXISTING_CONSTRAINTS_SQL = """
+    SELECT coalesce(json_agg(c.conname), '[]')::text
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = current_schema()
+      AND t.relname IN ({tables})
+"""
+
+
+def quote_ident(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def default_state_path(database):
+    return os.path.join(tempfile.gettempdir(), 'content-bulkload-{}.json'.format(database or 'default'))
+
+
+def psycopg2_runners(connect):
+    """Build (query, execute) callables that open their own autocommit connection per call.
+
+    Args:
+        connect: Zero-argument callable returning a new psycopg2 (or psycopg 3)
+            connection
+    """
+    def query(sql):
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def execute(sql):
+        conn = connect()
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(sql)
+        finally:
+            conn.close()
+
+    return query, execute
+
+
+def psql_runners(run):
+    """Build (query, execute) callables on a psql script runner (see engine.psql_runner).
+
+    Every call is its own psql session, so statements run in autocommit mode.
+    """
+    def query(sql):
+        stdout, _ = run('\\set QUIET on\n\\set ON_ERROR_STOP on\n\\pset format unaligned\n'
+                        '\\pset tuples_only on\n{};\n'.format(sql))
+        return stdout.strip()
+
+    def execute(sql):
+        run('\\set ON_ERROR_STOP on\n{};\n'.format(sql))
+
+    return query, execute
+
+
+def run_parallel(execute, statements, workers, label):
+    """Run statements on up to workers sessions; return the (statement, error) failures."""
+    failures = []
+    if not statements:
+        return failures
+    with ThreadPoolExecutor(max_workers=min(workers, len(statements))) as pool:
+        futures = [(statement, pool.submit(execute, statement)) for statement in statements]
+        for statement, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("{}: failed: {}: {}".format(label, statement, e))
+                failures.append((statement, e))
+    return failures
+
+
+class BulkLoad(object):
+    """Drop and rebuild secondary indexes and foreign keys around a bulk import."""
+
+    def __init__(self, query, execute, state_path, tables=BULK_LOAD_TABLES,
+                 workers=DEFAULT_REBUILD_WORKERS, maintenance_work_mem=DEFAULT_MAINTENANCE_WORK_MEM):
+        """Initialize bulk load
+
+        Args:
+            query: Callable running a SELECT and returning its single value
+            execute: Callable running one statement in its own autocommit
+                session; called from several threads at once
+            state_path: JSON file holding the recorded definitions
+            tables: Target table names
+            workers: Parallel sessions used to rebuild indexes and validate FKs
+            maintenance_work_mem: Per-session memory for index builds
+        """
+        self.query = query
+        self.execute = execute
+        self.state_path = state_path
+        self.tables = tuple(tables)
+        self.workers = max(1, workers)
+        self.maintenance_work_mem = maintenance_work_mem
+        self.indexes = []
+        self.foreign_keys = []
+        self.prepared = False
+
+    def _table_list(self):
+        return ', '.join(_quote_literal(table) for table in self.tables)
+
+    def _query_json(self, template):
+        value = self.query(template.format(tables=self._table_list()))
+        return json.loads(value) if isinstance(value, str) else value
+
+    def record(self):
+        """Read the index and FK definitions from the catalog."""
+        self.indexes = [tuple(item) for item in self._query_json(_INDEXES_SQL)]
+        self.foreign_keys = [tuple(item) for item in self._query_json(_FOREIGN_KEYS_SQL)]
+
+    def _save_state(self):
+        state = {'tables': list(self.tables), 'indexes': self.indexes, 'foreign_keys': self.foreign_keys}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.rename(tmp_path, self.state_path)
+
+    def prepare(self):
+        """Record (or reload) the definitions, then drop the FKs and indexes."""
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.indexes = [tuple(item) for item in state['indexes']]
+            self.foreign_keys = [tuple(item) for item in state['foreign_keys']]
+            logger.warning("Bulk load: reusing definitions from unfinished run in {}".format(self.state_path))
+        else:
+            self.record()
+            self._save_state()
+
+        logger.info("Bulk load: dropping {} foreign keys and {} indexes on {}".format(
+            len(self.foreign_keys), len(self.indexes), ', '.join(self.tables)))
+        for name, table, _ in self.foreign_keys:
+            self.execute('ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}'.format(quote_ident(table), quote_ident(name)))
+        for name, _, _ in self.indexes:
+            self.execute('DROP INDEX IF EXISTS {}'.format(quote_ident(name)))
+        self.prepared = True
+
+    def _parallel(self, statements):
+        """Run statements on up to `workers` sessions; return the failures."""
+        return run_parallel(self.execute, statements, self.workers, 'Bulk load')
+
+    def restore(self, analyze_tables=None):
+        """Rebuild indexes and FKs in parallel, then ANALYZE.
+
+        Args:
+            analyze_tables: Tables to ANALYZE (default: the target tables)
+
+        Raises:
+            RuntimeError: If any index or constraint could not be restored;
+                the state file is kept so a re-run can retry.
+        """
+        if not self.prepared:
+            return
+        memory = 'SET maintenance_work_mem = {}; '.format(_quote_literal(self.maintenance_work_mem))
+
+        logger.info("Bulk load: rebuilding {} indexes on {} sessions".format(len(self.indexes), self.workers))
+        failures = self._parallel([
+            memory + definition.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+            for _, _, definition in self.indexes
+        ])
+
+        existing = set(self._query_json(_EXISTING_CONSTRAINTS_SQL))
+        for name, table, definition in self.foreign_keys:
+            if name in existing:
+                continue
+            try:
+                self.execute('ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID'.format(
+                    quote_ident(table), quote_ident(name), definition))
+            except Exception as e:
+                logger.error("Bulk load: could not re-add {}: {}".format(name, e))
+                failures.append((name, e))
+        logger.info("Bulk load: validating {} foreign keys".format(len(self.foreign_keys)))
+        failures.extend(self._parallel([
+            'ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(quote_ident(table), quote_ident(name))
+            for name, table, _ in self.foreign_keys
+        ]))
+
+        tables = analyze_tables or self.tables
+        logger.info("Bulk load: analyzing {}".format(', '.join(tables)))
+        failures.extend(self._parallel(['ANALYZE {}'.format(quote_ident(table)) for table in tables]))
+
+        if failures:
+            raise RuntimeError("Bulk load: {} statements failed during restore; definitions kept in {}".format(
+                len(failures), self.state_path))
+        os.remove(self.state_path)
+        self.prepared = False
@@ -0,0 +1,170 @@
+"""
+COPY-based batching with client-side id pre-allocation
+
+CopyBatch reserves the new ids of a batch in one round trip and streams the
+rows through COPY; a failed batch is retried row by row with the same ids.
+"""
+
+import io
+import re
+import logging
+
+from .batching import DEFAULT_BATCH_SIZE, DEFAULT_COMMIT_INTERVAL, SavepointBatch, _throttled_flush
+
+logger = logging.getLogger(__name__)
+
+_INSERT_RE = re.compile(
+    r'^\s*INSERT\s+INTO\s+(?P<table>"[^"]+"|\w+)\s*\((?P<columns>[^)]*)\)\s*'
+    r'VALUES\s*\((?P<values>[^)]*)\)\s*(?P<returning>RETURNING\s+id)?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+
+_RESERVE_SQL = "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)"
+
+_COPY_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+
+def copy_value(value):
+    """Encode one value for COPY's text format (None -> \\N)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    text = str(value)
+    for char, escaped in _COPY_ESCAPES:
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
+
+
+def reserve_ids(cursor, table, count):
+    """Reserve count new ids from table's id sequence in one round trip.
+
+    Args:
+        cursor: DB-API cursor on the target database
+        table: Quoted table name as used in SQL, e.g. '"Word"'
+        count: Number of ids to reserve
+
+    Returns:
+        List of count ids, ascending
+    """
+    cursor.execute(_RESERVE_SQL, (table, count))
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+class _Statement(object):
+    """An INSERT statement parsed into its COPY equivalent."""
+
+    def __init__(self, sql):
+        match = _INSERT_RE.match(sql)
+        if match is None:
+            raise ValueError("CopyBatch only handles single-row INSERT ... VALUES statements: {}".format(
+                sql.strip()[:80]))
+        if any(value.strip() != '%s' for value in match.group('values').split(',')):
+            raise ValueError("CopyBatch needs a %s placeholder for every column: {}".format(sql.strip()[:80]))
+        self.table = match.group('table')
+        self.columns = [column.strip() for column in match.group('columns').split(',')]
+        self.returns_id = match.group('returning') is not None
+        columns = (['id'] if self.returns_id else []) + self.columns
+        self.copy_sql = 'COPY {} ({}) FROM STDIN'.format(self.table, ', '.join(columns))
+        # Row-by-row fallback with the pre-assigned id
+        self.insert_sql = 'INSERT INTO {} ({}) VALUES ({}){}'.format(
+            self.table, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+            ' RETURNING id' if self.returns_id else '')
+
+
+class CopyBatch(SavepointBatch):
+    """Batch INSERT statements into COPY with pre-allocated ids.
+
+    Drop-in replacement for SavepointBatch: same execute(sql, params, key),
+    callbacks, counters and commit handling. The statements must insert one
+    row with a %s placeholder per column.
+    """
+
+    def __init__(self, cursor, on_success=None, on_error=None, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, progress=None, throttle=None):
+        """Initialize batch
+
+        Args are as for SavepointBatch; cursor may be a psycopg2 or psycopg 3
+        cursor, batch_size is rows per COPY, and on_success receives the
+        pre-allocated id (None for statements without RETURNING id).
+        """
+        super(CopyBatch, self).__init__(cursor, on_success, on_error, batch_size=batch_size,
+                                        commit_interval=commit_interval, progress=progress, throttle=throttle)
+        self.reserved_ids = 0
+        self._statements = {}
+        self._statement = None
+
+    def execute(self, sql, params=None, key=None):
+        """Queue one INSERT; runs the batch once it is full."""
+        statement = self._statements.get(sql)
+        if statement is None:
+            statement = self._statements[sql] = _Statement(sql)
+        if self._statement is not None and statement is not self._statement:
+            self.flush()
+        self._statement = statement
+        self._pending.append((tuple(params or ()), key))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _call(self, func, *args):
+        if self.progress is not None:
+            return self.progress.call(func, *args)
+        return func(*args)
+
+    def _copy(self, statement, rows):
+        data = ''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+        cursor = self.cursor
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            self._call(cursor.copy_expert, statement.copy_sql, io.StringIO(data))
+        else:
+            # psycopg 3
+            def copy():
+                with cursor.copy(statement.copy_sql) as stream:
+                    stream.write(data)
+            self._call(copy)
+
+    def flush(self):
+        """COPY the queued rows inside one savepoint."""
+        _throttled_flush(self, self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        statement = self._statement
+        if not pending:
+            return
+        cursor = self.cursor
+        if statement.returns_id:
+            ids = reserve_ids(cursor, statement.table, len(pending))
+            self.reserved_ids += len(ids)
+            rows = [(new_id,) + params for new_id, (params, _) in zip(ids, pending)]
+        else:
+            ids = [None] * len(pending)
+            rows = [params for params, _ in pending]
+
+        cursor.execute('SAVEPOINT import_copy')
+        try:
+            self._copy(statement, rows)
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT import_copy')
+            self.retried_batches += 1
+            logger.debug("COPY of {} rows failed ({}); inserting rows individually".format(len(pending), e))
+            self._retry(statement, rows, pending)
+        else:
+            cursor.execute('RELEASE SAVEPOINT import_copy')
+            for new_id, (_, key) in zip(ids, pending):
+                self._success(key, new_id)
+
+        self._uncommitted += len(pending)
+        if self.commit_interval and self._uncommitted >= self.commit_interval:
+            self.commit()
+
+    def _retry(self, statement, rows, pending):
+        fallback = SavepointBatch(self.cursor, self.on_success, self.on_error,
+                                  batch_size=max(1, self.batch_size // 10), commit_interval=0)
+        for row, (_, key) in zip(rows, pending):
+            fallback.execute(statement.insert_sql, row, key)
+        fallback.finish()
+        self.succeeded += fallback.succeeded
+        self.failed += fallback.failed
@@ -0,0 +1,124 @@
+"""
+Pre-import deduplication against a unique key
+
+KeyDeduplicator drops rows that repeat an earlier row's unique key before
+they are written, using 64-bit key hashes, and maps each repeat to the new
+id of the row it repeats. As in the unique index, a key with a NULL part
+never collides.
+"""
+
+import struct
+import hashlib
+from array import array
+
+from .idmap import IdMapping
+
+_EMPTY = 0
+
+_INITIAL_SLOTS = 1 << 10
+
+# Grow the table when it is more than this full
+_MAX_LOAD = 0.5
+
+_HASH = struct.Struct('<q')
+
+
+def key_hash(key):
+    """Non-zero 64-bit hash of a key tuple, the same in every process."""
+    text = '\x00'.join('' if part is None else str(part) for part in key)
+    value = _HASH.unpack_from(hashlib.md5(text.encode('utf-8', 'surrogatepass')).digest())[0]
+    return value or 1
+
+
+class KeyDeduplicator(object):
+    """Drop rows whose unique key was already seen."""
+
+    def __init__(self, spill_dir=None):
+        """Initialize deduplicator
+
+        Args:
+            spill_dir: Optional spill directory for the collapsed ids (see
+                idmap.IdMapping)
+        """
+        self._hashes = array('q', [_EMPTY]) * _INITIAL_SLOTS
+        self._ids = array('q', [0]) * _INITIAL_SLOTS
+        self._count = 0
+        self.collapsed = IdMapping(spill_dir)
+        self.duplicates = 0
+
+    def __len__(self):
+        return self._count
+
+    def _grow(self):
+        hashes, ids = self._hashes, self._ids
+        size = len(hashes) * 2
+        self._hashes = array('q', [_EMPTY]) * size
+        self._ids = array('q', [0]) * size
+        for value, legacy_id in zip(hashes, ids):
+            if value != _EMPTY:
+                self._insert(value, legacy_id)
+
+    def _insert(self, value, legacy_id):
+        """Slot of value's entry, adding it with legacy_id if absent; returns (slot, added)."""
+        hashes = self._hashes
+        mask = len(hashes) - 1
+        slot = value & mask
+        while True:
+            current = hashes[slot]
+            if current == _EMPTY:
+                hashes[slot] = value
+                self._ids[slot] = legacy_id
+                return slot, True
+            if current == value:
+                return slot, False
+            slot = (slot + 1) & mask
+
+    def add(self, key, legacy_id):
+        """Register a row; returns True if it is the first with its key (import it).
+
+        Args:
+            key: Tuple of the unique key's values (as they will be
+                written); a None part means the row never collides
+            legacy_id: Legacy id of the row
+        """
+        if any(part is None for part in key):
+            return True
+        return self.add_hash(key_hash(key), legacy_id)
+
+    def add_hash(self, value, legacy_id):
+        """add() for a key already hashed with key_hash() (keys with a None part are not added)."""
+        if self._count + 1 > len(self._hashes) * _MAX_LOAD:
+            self._grow()
+        slot, added = self._insert(value, legacy_id)
+        if added:
+            self._count += 1
+            return True
+        self.collapsed[legacy_id] = self._ids[slot]
+        self.duplicates += 1
+        return False
+
+    def merge_into(self, id_mapping):
+        """Map every collapsed legacy id to its survivor's new id in id_mapping.
+
+        Returns:
+            Number of collapsed ids mapped (survivors that were not imported
+            leave their repeats unmapped)
+        """
+        # Look every survivor up before adding anything: an IdMapping re-sorts
+        # on the first lookup after an out-of-order assignment
+        keys, values = array('q'), array('q')
+        for legacy_id, survivor in self.collapsed.items():
+            new_id = id_mapping.get(survivor)
+            if new_id is not None:
+                keys.append(legacy_id)
+                values.append(new_id)
+        id_mapping.extend(keys, values)
+        return len(keys)
+
+
+def word_key(word, language_id, translation):
+    """Word's unique key (word, languageId, translation) as the importers write it.
+
+    language_id may be the legacy id: the language mapping is one to one.
+    """
+    return (word, language_id, translation)
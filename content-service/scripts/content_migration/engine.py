@@ -0,0 +1,396 @@
+"""
+One migration engine for every route from the legacy data to Prisma
+
+MigrationEngine runs the table loop once per TableSpec, reading from a
+source (export files or the legacy database) and writing through a sink
+(a cursor batcher or psql).
+"""
+
+import os
+import logging
+import subprocess
+from functools import partial
+
+from .batching import (
+    DEFAULT_BATCH_SIZE, DEFAULT_COMMIT_INTERVAL, PipelineBatch, PreparedPsqlBatch, SavepointBatch
+)
+from .copyload import CopyBatch
+from .dedup import KeyDeduplicator
+from .idmap import IdMapping
+from .manifest import ExportManifest
+from .partition import SHARED_TABLES, shared_mapping, shared_select_sql
+from .profiling import Profiler
+from .reader import ExportFile
+from .rejects import RejectSink
+from .schema import check_tables, column_types
+from .tables import TABLES, get_table, parse_export_line
+from .transfer import materialize
+
+logger = logging.getLogger(__name__)
+
+BATCH_CLASSES = {
+    'savepoint': SavepointBatch,
+    'pipeline': PipelineBatch,
+    'copy': CopyBatch,
+}
+
+SOURCES = ('files', 'django', 'legacy-db')
+SINKS = ('savepoint', 'pipeline', 'copy', 'psql')
+
+# A bad value in a row surfaces as one of these from parse/transform
+_ROW_ERRORS = (ValueError, IndexError, TypeError)
+
+
+class FileSource(object):
+    """Rows from the storagebox export files in a directory."""
+
+    def __init__(self, directory):
+        """Initialize source
+
+        Args:
+            directory: Export directory; chunked files (transfer.py) are
+                reassembled into a local directory first
+        """
+        if not ExportManifest.load(directory).complete:
+            raise ValueError("The export in {} is still in progress".format(directory))
+        self.directory = materialize(directory, [spec.filename for spec in TABLES])
+
+    def path(self, spec):
+        return os.path.join(self.directory, spec.filename)
+
+    def table_progress(self, reporter, spec):
+        return reporter.table(spec.key, total_bytes=os.path.getsize(self.path(spec)))
+
+    def read(self, spec, progress):
+        """Yield (offset, raw line) for every data line of the table's file."""
+        with ExportFile(self.path(spec)) as export:
+            for item in export.lines(progress=progress, offsets=True):
+                yield item
+
+    def manifest(self, tables):
+        """Fingerprints of the export files (manifest.json, see manifest.py)."""
+        return ExportManifest.load(self.directory)
+
+    def parse(self, item):
+        return parse_export_line(item[1].decode('utf-8'))
+
+    def position(self, item):
+        """(offset, line) of an item, for the rejects file."""
+        return item
+
+
+class ReaderSource(object):
+    """Rows from a legacy reader: LegacyReader (driver) or OrmReader (Django), see legacy.py."""
+
+    def __init__(self, reader, partition=None):
+        """Initialize source
+
+        Args:
+            reader: LegacyReader or OrmReader
+            partition: Optional LanguagePartition; only its rows are read
+        """
+        self.reader = reader
+        self.partition = partition
+
+    def _where(self, spec):
+        if self.partition is None or spec.key in SHARED_TABLES:
+            return None
+        return self.partition.legacy_where(spec)
+
+    def table_progress(self, reporter, spec):
+        return reporter.table(spec.key, total_rows=self.reader.count(spec, where=self._where(spec)))
+
+    def read(self, spec, progress):
+        return self.reader.rows(spec, where=self._where(spec))
+
+    def manifest(self, tables):
+        """Fingerprints of the legacy tables, computed by the legacy database."""
+        manifest = ExportManifest()
+        for spec in tables:
+            manifest.record(spec, self.reader.fingerprint(spec))
+        return manifest
+
+    def parse(self, item):
+        return item
+
+    def position(self, item):
+        return None, item
+
+
+class CursorSink(object):
+    """Write through a batcher on a psycopg2 / psycopg 3 connection."""
+
+    def __init__(self, connection, backend='savepoint', batch_size=DEFAULT_BATCH_SIZE,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, throttle=None, returning=False):
+        """Initialize sink
+
+        Args:
+            connection: Connection to the new database (autocommit off;
+                psycopg 3 for the 'pipeline' backend)
+            backend: 'savepoint', 'pipeline' or 'copy'
+            batch_size: Rows per batch
+            commit_interval: Commit every N rows (0: one transaction)
+            throttle: Optional AdaptiveThrottle shared by the tables' batches
+            returning: Return the new id of every table's rows, not only of
+                the parent tables (to tag them with an import batch)
+        """
+        if backend not in BATCH_CLASSES:
+            raise ValueError("Unknown backend {!r} (expected one of {})".format(
+                backend, ', '.join(sorted(BATCH_CLASSES))))
+        self.connection = connection
+        self.batch_class = BATCH_CLASSES[backend]
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.throttle = throttle
+        self.returning = returning
+        self._cursor = connection.cursor()
+
+    def batch(self, spec, progress, on_success, on_error):
+        return self.batch_class(progress.cursor(self._cursor), on_success, on_error, batch_size=self.batch_size,
+                                commit_interval=self.commit_interval, progress=progress, throttle=self.throttle)
+
+    def bind(self, batch, spec):
+        """execute(params, key) for the table's rows on batch."""
+        return partial(batch.execute, spec.insert_sql(returning=True if self.returning else None))
+
+    def statement(self, sql):
+        """Run one statement in the current transaction; returns its row count."""
+        self._cursor.execute(sql)
+        return self._cursor.rowcount
+
+    def fetch(self, sql):
+        """Rows of a SELECT run in the current transaction."""
+        self._cursor.execute(sql)
+        return self._cursor.fetchall()
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        """Close the cursor and the connection."""
+        self._cursor.close()
+        self.connection.close()
+
+
+class PsqlSink(object):
+    """Write through psql subprocesses, one script (and transaction) per batch."""
+
+    def __init__(self, run, batch_size=DEFAULT_BATCH_SIZE, models=None, throttle=None):
+        """Initialize sink
+
+        Args:
+            run: Callable running a psql script, see psql_runner()
+            batch_size: Rows per psql invocation
+            models: Optional Prisma models (schema.load_schema()) to type
+                the prepared INSERTs with
+            throttle: Optional AdaptiveThrottle shared by the tables' batches
+        """
+        self.run = run
+        self.batch_size = batch_size
+        self.models = models
+        self.throttle = throttle
+
+    def batch(self, spec, progress, on_success, on_error):
+        types = column_types(self.models, spec) if self.models is not None else None
+        return PreparedPsqlBatch(self.run, spec.insert_sql(returning=False, numbered=True), types=types,
+                                 on_success=on_success, on_error=on_error, batch_size=self.batch_size,
+                                 progress=progress, throttle=self.throttle)
+
+    def bind(self, batch, spec):
+        return batch.execute
+
+    # Every batch commits in its own psql session
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def psql_runner(database_url, psql='psql'):
+    """Build a run(script) -> (stdout, stderr) callable feeding scripts to psql.
+
+    Raises RuntimeError when psql exits non-zero (e.g. under ON_ERROR_STOP).
+    """
+    def run(script):
+        process = subprocess.Popen([psql, '-X', '-d', database_url], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate(script.encode('utf-8'))
+        stdout = stdout.decode('utf-8', 'replace')
+        stderr = stderr.decode('utf-8', 'replace')
+        if process.returncode != 0:
+            raise RuntimeError("psql failed: {}".format(stderr))
+        return stdout, stderr
+    return run
+
+
+class MigrationEngine(object):
+    """Migrate the content tables from a source to a sink."""
+
+    def __init__(self, source, sink, reporter, rejects=None, profiler=None, id_map_dir=None, models=None,
+                 state=None, partition=None, import_batch=None):
+        """Initialize engine
+
+        Args:
+            source: FileSource or ReaderSource
+            sink: CursorSink or PsqlSink
+            reporter: ProgressReporter of the run
+            rejects: Optional RejectSink (default: count and log only)
+            profiler: Optional Profiler
+            id_map_dir: Spill directory for the id mappings (see idmap.py)
+            models: Optional Prisma models to check the table specs against
+            state: Optional ImportState; tables already imported from the
+                source's fingerprints are skipped and imported ones recorded
+            partition: Optional LanguagePartition to replace instead of
+                importing everything (needs a CursorSink with
+                commit_interval 0)
+            import_batch: Optional ImportBatch recording the new rows (the
+                sink must return every table's new ids, see CursorSink)
+        """
+        self.source = source
+        self.sink = sink
+        self.reporter = reporter
+        self.rejects = rejects if rejects is not None else RejectSink()
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.id_map_dir = id_map_dir
+        self.models = models
+        self.state = state
+        self.partition = partition
+        self.import_batch = import_batch
+        self.stats = {}
+
+    def run(self, tables=TABLES):
+        """Migrate tables in order; returns the id mappings by table key.
+
+        Raises:
+            ValueError: If the table specs do not match the Prisma models,
+                a partition is given without a single-transaction sink, or a
+                partition code matches no legacy language (the partition's
+                deletes are rolled back)
+        """
+        if self.models is not None:
+            problems = check_tables(self.models, tables)
+            if problems:
+                raise ValueError("Table specs do not match schema.prisma:\n  {}".format('\n  '.join(problems)))
+        partition = self.partition
+        if partition is not None:
+            if not isinstance(self.sink, CursorSink) or self.sink.commit_interval != 0:
+                raise ValueError("A language partition is replaced in one transaction: "
+                                 "use a cursor sink with commit interval 0")
+            tables = partition.tables(tables)
+
+        manifest = skipped = None
+        if self.state is not None:
+            manifest = self.source.manifest(tables)
+            skipped = self.state.skipped(manifest, tables)
+
+        id_mappings = {}
+        try:
+            if partition is not None:
+                id_mappings.update(self.prepare_partition(tables))
+            for spec in tables:
+                if skipped and spec.key in skipped:
+                    logger.info("Skipping {}: already imported from this source".format(spec.key))
+                    continue
+                id_mapping = self.migrate_table(spec, id_mappings)
+                if id_mapping is not None:
+                    id_mappings[spec.key] = id_mapping
+            if partition is not None and partition.missing_codes():
+                raise ValueError("No legacy language with code {}".format(', '.join(partition.missing_codes())))
+            self.sink.commit()
+        except Exception:
+            self.sink.rollback()
+            raise
+        if self.state is not None:
+            for spec in tables:
+                if spec.key not in skipped:
+                    self.state.record(spec, manifest)
+        return id_mappings
+
+    def prepare_partition(self, tables):
+        """Map the shared tables and empty the partition; returns the shared id mappings."""
+        id_mappings = {}
+        for key in SHARED_TABLES:
+            spec = get_table(key)
+            rows = (self.source.parse(item) for item in self.source.read(spec, None))
+            id_mappings[key] = shared_mapping(spec, (row for row in rows if row is not None),
+                                              self.sink.fetch(shared_select_sql(spec)))
+            logger.info("Mapped {} existing {} rows".format(len(id_mappings[key]), spec.key))
+        for spec, sql in self.partition.delete_sql(tables):
+            logger.info("Deleted {} {} rows of languages {}".format(
+                self.sink.statement(sql), spec.key, ', '.join(self.partition.codes)))
+        return id_mappings
+
+    def migrate_table(self, spec, id_mappings):
+        """Migrate one table; returns its legacy -> new id mapping (None unless spec.returns_id)."""
+        logger.info("Migrating {}...".format(spec.key))
+        source = self.source
+        progress = source.table_progress(self.reporter, spec)
+        rejects = self.rejects.table(progress)
+        id_mapping = IdMapping(self.id_map_dir) if spec.returns_id else None
+        keep = self.partition.row_filter(spec) if self.partition is not None else None
+        dedup = KeyDeduplicator(self.id_map_dir) if spec.unique else None
+        skipped = 0
+
+        def imported(key, new_id):
+            if id_mapping is not None:
+                id_mapping[key] = new_id
+            progress.advance()
+
+        if self.import_batch is not None:
+            imported = self.import_batch.recorder(spec.target, imported)
+
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self.sink.batch(spec, progress, imported, rejects.reject))
+            execute = self.sink.bind(batch, spec)
+            parse = profile.wrap('parse', source.parse)
+            position = source.position
+            transform = spec.transform
+            resolve = spec.resolve
+
+            for item in profile.read(source.read(spec, progress)):
+                offset, line = position(item)
+                key = offset
+                try:
+                    row = parse(item)
+                    if row is None or (keep is not None and not keep(row)):
+                        continue
+                    key = row[0]
+                    params = resolve(transform(row), id_mappings)
+                except _ROW_ERRORS as e:
+                    skipped += 1
+                    rejects.reject(key, e, offset, line)
+                    continue
+                if params is None:
+                    skipped += 1
+                    rejects.reject(key, 'missing_parent', offset, line)
+                    continue
+                if dedup is not None and not dedup.add(spec.unique_key(params), key):
+                    continue
+                rejects.expect(key, offset, line)
+                execute(params, key)
+
+            batch.finish()
+
+        if self.import_batch is not None:
+            self.import_batch.flush()
+        collapsed = 0
+        if dedup is not None:
+            collapsed = dedup.duplicates
+            if id_mapping is not None:
+                dedup.merge_into(id_mapping)
+        if id_mapping is not None:
+            id_mapping.compact()
+        progress.finish()
+        rejects.finish()
+        self.stats[spec.key] = {'succeeded': batch.succeeded, 'failed': batch.failed, 'skipped': skipped,
+                                'collapsed': collapsed}
+        logger.info("Migrated {} {} ({} rejected, {} skipped, {} duplicates collapsed)".format(
+            batch.succeeded, spec.key, batch.failed, skipped, collapsed))
+        return id_mapping
@@ -0,0 +1,292 @@
+"""
+Dry-run throughput estimation
+
+Times a sample of each table through the migration transforms and a
+rolled-back insert batch, and projects wall-clock time and peak memory.
+"""
+
+import sys
+import time
+import logging
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+from .idmap import IdMapping
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 200
+
+STAGES = ('read', 'parse', 'transform', 'serialize', 'write')
+
+
+def _approx_size(obj):
+    """Shallow-plus-one-level size of a sampled item in bytes."""
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+        size += sum(sys.getsizeof(value) for value in attrs.values())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(sys.getsizeof(value) for value in obj)
+    return size
+
+
+def _mapping_bytes_per_entry(sample=1000):
+    """Bytes an IdMapping costs per entry (sparse legacy ids, the worst case)."""
+    mapping = IdMapping()
+    for i in range(sample):
+        mapping[1000000 + 3 * i] = 2000000 + i
+    mapping.compact()
+    return mapping.nbytes() // sample
+
+
+def current_rss_bytes():
+    """Peak resident set size of this process so far (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def format_bytes(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(value, unit)
+        value /= 1024.0
+
+
+class TableEstimate(object):
+    """Sample measurements and projections for one table."""
+
+    def __init__(self, key, rows):
+        self.key = key
+        self.rows = rows
+        self.sampled = 0
+        self.written = 0
+        self.invalid = 0
+        self.stage_seconds = {}
+        self.item_bytes = 0
+        self.retains_items = False
+        self.returns_id = False
+        self.notes = []
+
+    def per_row(self, stage):
+        seconds = self.stage_seconds.get(stage)
+        if seconds is None:
+            return None
+        count = self.written if stage == 'write' else self.sampled
+        return seconds / count if count else None
+
+    def projected(self, stage):
+        per_row = self.per_row(stage)
+        return per_row * self.rows if per_row is not None else None
+
+    def projected_total(self):
+        return sum(self.projected(stage) or 0.0 for stage in STAGES)
+
+    def as_dict(self):
+        return {
+            'table': self.key,
+            'rows': self.rows,
+            'sampled': self.sampled,
+            'written': self.written,
+            'invalid': self.invalid,
+            'projected_seconds': dict(
+                (stage, self.projected(stage)) for stage in STAGES if stage in self.stage_seconds
+            ),
+            'projected_total_seconds': self.projected_total(),
+            'notes': list(self.notes),
+        }
+
+
+class ThroughputEstimator(object):
+    """Estimate migration wall-clock time and memory from small samples."""
+
+    def __init__(self, conn=None, sample_size=DEFAULT_SAMPLE_SIZE):
+        """Initialize estimator
+
+        Args:
+            conn: Optional psycopg2 connection to the target database. Sample
+                inserts run in a single transaction that is always rolled back.
+            sample_size: Number of records sampled per table
+        """
+        self.conn = conn
+        self.sample_size = sample_size
+        self.estimates = []
+        self._cursor = conn.cursor() if conn is not None else None
+        self._sample_ids = {}
+        self._baseline_rss = current_rss_bytes()
+
+    def estimate_table(self, spec, total_rows, items, to_row=None,
+                       serialize=None, transform=True, retains_items=False):
+        """Measure one table.
+
+        Args:
+            spec: TableSpec of the table
+            total_rows: Full row count used for extrapolation
+            items: Iterable of source items (model instances or export lines);
+                at most sample_size items are consumed and timed as 'read'
+            to_row: Optional callable turning an item into an exported row,
+                timed as 'parse'
+            serialize: Optional callable formatting an exported row for the
+                export file, timed as 'serialize'
+            transform: Whether to time the import transform and write stages
+                (False for export-only estimates)
+            retains_items: True if the real run keeps every item in memory
+                (e.g. a Django queryset result cache)
+
+        Returns:
+            TableEstimate
+        """
+        estimate = TableEstimate(spec.key, total_rows)
+        estimate.retains_items = retains_items
+        estimate.returns_id = spec.returns_id
+
+        start = time.perf_counter()
+        sample = list(islice(items, self.sample_size))
+        estimate.stage_seconds['read'] = time.perf_counter() - start
+        estimate.sampled = len(sample)
+        if not sample:
+            estimate.notes.append('no rows to sample')
+            self.estimates.append(estimate)
+            return estimate
+        estimate.item_bytes = sum(_approx_size(item) for item in sample) // len(sample)
+
+        rows = sample
+        if to_row is not None:
+            rows = []
+            start = time.perf_counter()
+            for item in sample:
+                try:
+                    row = to_row(item)
+                except ValueError:
+                    estimate.invalid += 1
+                    continue
+                if row:
+                    rows.append(row)
+            estimate.stage_seconds['parse'] = time.perf_counter() - start
+
+        if serialize is not None:
+            start = time.perf_counter()
+            for row in rows:
+                serialize(row)
+            estimate.stage_seconds['serialize'] = time.perf_counter() - start
+
+        if not transform:
+            self.estimates.append(estimate)
+            return estimate
+
+        start = time.perf_counter()
+        transformed = []
+        for row in rows:
+            try:
+                transformed.append((row[0], spec.transform(row)))
+            except (ValueError, TypeError, IndexError):
+                estimate.invalid += 1
+        estimate.stage_seconds['transform'] = time.perf_counter() - start
+
+        if self._cursor is not None:
+            self._time_write(spec, transformed, estimate)
+
+        self.estimates.append(estimate)
+        return estimate
+
+    def _resolve_sample(self, spec, params):
+        """Map legacy parent ids onto sampled parent rows.
+
+        Parents outside the sample are pointed at any sampled parent; the
+        write timing only needs valid foreign keys, not the right ones.
+        """
+        resolved = list(params)
+        for column, parent_key in spec.foreign_keys.items():
+            parent_ids = self._sample_ids.get(parent_key)
+            if not parent_ids:
+                return None
+            position = spec.columns.index(column)
+            resolved[position] = parent_ids.get(resolved[position], next(iter(parent_ids.values())))
+        return tuple(resolved)
+
+    def _time_write(self, spec, transformed, estimate):
+        batch = []
+        for legacy_id, params in transformed:
+            resolved = self._resolve_sample(spec, params)
+            if resolved is None:
+                estimate.notes.append('write not timed: no sampled parent rows')
+                return
+            batch.append((legacy_id, resolved))
+
+        sql = spec.insert_sql()
+        savepoint = 'estimate_{}'.format(spec.key)
+        new_ids = {}
+        self._cursor.execute('SAVEPOINT {}'.format(savepoint))
+        start = time.perf_counter()
+        try:
+            for legacy_id, params in batch:
+                self._cursor.execute(sql, params)
+                if spec.returns_id:
+                    new_ids[legacy_id] = self._cursor.fetchone()[0]
+        except Exception as e:
+            self._cursor.execute('ROLLBACK TO SAVEPOINT {}'.format(savepoint))
+            estimate.notes.append('write not timed: {}'.format(str(e).strip().splitlines()[0]))
+            return
+        estimate.stage_seconds['write'] = time.perf_counter() - start
+        estimate.written = len(batch)
+        if spec.returns_id:
+            self._sample_ids[spec.key] = new_ids
+
+    def finish(self):
+        """Roll back all sample inserts."""
+        if self.conn is not None:
+            self.conn.rollback()
+            self._cursor.close()
+            self._cursor = None
+
+    def peak_memory_bytes(self):
+        """Projected peak RSS of a full run.
+
+        Id mappings of parent tables stay alive until the last child table is
+        imported; retained source items (queryset caches) only live while
+        their own table is migrated.
+        """
+        mapping_entry = _mapping_bytes_per_entry()
+        mappings = sum(e.rows * mapping_entry for e in self.estimates if e.returns_id)
+        retained = max([e.rows * e.item_bytes for e in self.estimates if e.retains_items] or [0])
+        return self._baseline_rss + mappings + retained
+
+    def summary(self):
+        return {
+            'sample_size': self.sample_size,
+            'tables': [estimate.as_dict() for estimate in self.estimates],
+            'projected_total_seconds': sum(e.projected_total() for e in self.estimates),
+            'projected_peak_memory_bytes': self.peak_memory_bytes(),
+        }
+
+    def log_report(self):
+        """Log per-table projections and totals."""
+        logger.info("=" * 60)
+        logger.info("Dry-run Estimate (sample size {})".format(self.sample_size))
+        logger.info("=" * 60)
+        header = "{:<22} {:>10} " + " ".join(["{:>9}"] * len(STAGES)) + " {:>10}"
+        logger.info(header.format('table', 'rows', *(STAGES + ('total s',))))
+        for estimate in self.estimates:
+            cells = []
+            for stage in STAGES:
+                projected = estimate.projected(stage)
+                cells.append('-' if projected is None else '{:.1f}'.format(projected))
+            logger.info(header.format(
+                estimate.key, estimate.rows, *(cells + ['{:.1f}'.format(estimate.projected_total())])
+            ))
+            for note in estimate.notes:
+                logger.info("  {}: {}".format(estimate.key, note))
+            if estimate.invalid:
+                logger.info("  {}: {} of {} sampled rows failed to transform".format(
+                    estimate.key, estimate.invalid, estimate.sampled))
+        total = sum(e.projected_total() for e in self.estimates)
+        logger.info("Projected wall-clock: {:.1f}s ({:.1f} min)".format(total, total / 60.0))
+        logger.info("Projected peak memory: {}".format(format_bytes(self.peak_memory_bytes())))
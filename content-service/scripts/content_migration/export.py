@@ -0,0 +1,97 @@
+"""
+Streaming export of legacy querysets to storagebox export files
+
+export_rows() reads the export fields with values_list() over a server-side
+iterator; ExportWriter formats the rows and writes them in chunks.
+"""
+
+# Rows formatted per write() call
+EXPORT_CHUNK_ROWS = 1000
+
+
+def _quote(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def _boolean(value):
+    return 'TRUE' if value else 'FALSE'
+
+
+def _other(value):
+    # e.g. a FieldFile: exported as its string form
+    return _quote(str(value))
+
+
+# Same output as tables.format_export_value (after row_from_instance's
+# str() conversion of non-scalar values), dispatched by exact type
+_FORMATTERS = {
+    str: _quote,
+    int: str,
+    float: str,
+    bool: _boolean,
+    type(None): lambda value: 'NULL',
+}
+
+
+def format_export_row(row):
+    """Format a values_list row as one export line (with newline)."""
+    get = _FORMATTERS.get
+    return ','.join([get(type(value), _other)(value) for value in row]) + '\n'
+
+
+def export_rows(queryset, fields, limit=None):
+    """Iterate the export fields of queryset as tuples, ordered by id.
+
+    Args:
+        queryset: Legacy model queryset
+        fields: TableSpec.export_fields (values_list field names)
+        limit: Optional maximum number of rows (for sampling)
+    """
+    rows = queryset.order_by('id').values_list(*fields)
+    if limit is not None:
+        rows = rows[:limit]
+    # iterator() skips the result cache (and uses a server-side cursor on PostgreSQL)
+    return rows.iterator()
+
+
+class ExportWriter(object):
+    """Write export rows to a file in chunks."""
+
+    def __init__(self, f, progress=None, chunk_rows=EXPORT_CHUNK_ROWS, on_chunk=None):
+        """Initialize writer
+
+        Args:
+            f: Text file opened for writing
+            progress: Optional TableProgress advanced per chunk
+            chunk_rows: Rows formatted per write
+            on_chunk: Optional callable(total_rows) called after each chunk
+        """
+        self.f = f
+        self.progress = progress
+        self.chunk_rows = max(1, chunk_rows)
+        self.on_chunk = on_chunk
+        self.rows = 0
+        self._lines = []
+
+    def write(self, row):
+        self._lines.append(format_export_row(row))
+        if len(self._lines) >= self.chunk_rows:
+            self.flush()
+
+    def write_all(self, rows):
+        """Write every row of an iterable; returns the total rows written."""
+        for row in rows:
+            self.write(row)
+        self.flush()
+        return self.rows
+
+    def flush(self):
+        lines, self._lines = self._lines, []
+        if not lines:
+            return
+        self.f.write(''.join(lines))
+        self.rows += len(lines)
+        if self.progress is not None:
+            self.progress.advance(len(lines))
+        if self.on_chunk is not None:
+            self.on_chunk(self.rows)
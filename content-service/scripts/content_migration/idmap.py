@@ -0,0 +1,300 @@
+"""
+Compact legacy-id -> new-id mapping
+
+IdMapping keeps the pairs in array('q') columns (16 bytes per entry, 8 for
+near-contiguous legacy ids), optionally mmap'ed, and supports the part of
+the dict interface the importers use.
+"""
+
+import heapq
+import mmap
+import tempfile
+from array import array
+from bisect import bisect_left
+
+# Use the dense layout when the legacy id range is at most this many times
+# the number of entries (dense costs 8 bytes per id in range, sorted 16 per entry)
+DENSE_MAX_SPREAD = 2.0
+
+# compact() sorts out-of-order columns in place in slices of this many
+# entries and merges the sorted slices, so its scratch memory is bounded by
+# one slice instead of growing with the mapping
+RUN_SIZE = 65536
+
+# Marks a hole in the dense layout; new ids come from SERIAL columns and are > 0
+_MISSING = -1
+
+_ITEM_SIZE = array('q').itemsize
+
+
+class IdMapping(object):
+    """Append-friendly int -> int mapping backed by array('q') columns."""
+
+    def __init__(self, spill_dir=None):
+        """Initialize mapping
+
+        Args:
+            spill_dir: Optional directory; when set, the compacted columns are
+                written to an unlinked temporary file there and mmap'ed
+        """
+        self.spill_dir = spill_dir
+        self._keys = array('q')
+        self._values = array('q')
+        self._sorted = True
+        self._dense = None
+        self._base = 0
+        self._count = 0
+        self._mmap = None
+        # Assignments to a dense or spilled mapping that could not be written
+        # in place; merged into the columns by the next lookup or compact()
+        self._pending_keys = array('q')
+        self._pending_values = array('q')
+
+    def __setitem__(self, key, value):
+        if not self._pending_keys and self._assign_in_place(key, value):
+            return
+        if self._dense is not None or self._mmap is not None:
+            self._pending_keys.append(key)
+            self._pending_values.append(value)
+            return
+        keys = self._keys
+        if keys and key <= keys[-1]:
+            self._sorted = False
+        keys.append(key)
+        self._values.append(value)
+
+    def _assign_in_place(self, key, value):
+        """Overwrite key's slot in the compacted columns; False if it has none."""
+        if self._dense is not None:
+            offset = key - self._base
+            if not 0 <= offset < len(self._dense):
+                return False
+            if self._dense[offset] == _MISSING:
+                self._count += 1
+            self._dense[offset] = value
+            return True
+        keys = self._keys
+        if not self._sorted or not keys or key > keys[-1]:
+            return False
+        position = bisect_left(keys, key)
+        if keys[position] != key:
+            return False
+        self._values[position] = value
+        return True
+
+    def extend(self, keys, values):
+        """Append parallel key/value columns, e.g. a worker's partial mapping."""
+        if not keys:
+            return
+        if self._dense is not None or self._mmap is not None:
+            self._pending_keys.extend(keys)
+            self._pending_values.extend(values)
+            return
+        if self._sorted:
+            previous = self._keys[-1] if self._keys else None
+            for key in keys:
+                if previous is not None and key <= previous:
+                    self._sorted = False
+                    break
+                previous = key
+        self._keys.extend(keys)
+        self._values.extend(values)
+
+    def _lookup(self, key):
+        if self._pending_keys or not self._sorted:
+            self.compact()
+        if self._dense is not None:
+            offset = key - self._base
+            if 0 <= offset < len(self._dense):
+                value = self._dense[offset]
+                if value != _MISSING:
+                    return value
+            return None
+        keys = self._keys
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return self._values[position]
+        return None
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is None else value
+
+    def __len__(self):
+        if self._pending_keys or not self._sorted:
+            self.compact()
+        if self._dense is not None:
+            return self._count
+        return len(self._keys)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def items(self):
+        """Iterate (legacy_id, new_id) pairs in legacy id order."""
+        if self._pending_keys or not self._sorted:
+            self.compact()
+        return self._column_items()
+
+    def _column_items(self):
+        if self._dense is not None:
+            for offset, value in enumerate(self._dense):
+                if value != _MISSING:
+                    yield self._base + offset, value
+            return
+        for pair in zip(self._keys, self._values):
+            yield pair
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def compact(self):
+        """Sort and de-duplicate the columns (last assignment wins) and pick
+        the dense layout if the legacy ids are close to contiguous.
+
+        Called automatically on the first lookup; call it explicitly once a
+        table is fully imported to release the append slack early.
+        """
+        if self._pending_keys:
+            pending_keys, pending_values = self._pending_keys, self._pending_values
+            runs = [self._column_items()]
+            runs.extend(_sorted_runs(pending_keys, pending_values))
+            keys, values = _merge(runs)
+            del runs
+            self.close()
+            self._dense = None
+            self._pending_keys, self._pending_values = array('q'), array('q')
+        elif self._dense is not None or self._mmap is not None:
+            # Already compacted
+            return
+        elif not self._sorted:
+            keys, values = _merge(_sorted_runs(self._keys, self._values))
+            self._sorted = True
+        else:
+            keys, values = self._keys, self._values
+
+        count = len(keys)
+        if count and (keys[-1] - keys[0] + 1) <= DENSE_MAX_SPREAD * count:
+            base = keys[0]
+            dense = array('q', [_MISSING]) * (keys[-1] - base + 1)
+            for key, value in zip(keys, values):
+                dense[key - base] = value
+            self._dense, self._base, self._count = dense, base, count
+            self._keys, self._values = array('q'), array('q')
+        else:
+            self._keys, self._values = keys, values
+
+        if self.spill_dir:
+            self._spill()
+
+    def _spill(self):
+        """Move the compacted columns into an mmap'ed temporary file."""
+        if self._mmap is not None:
+            return
+        columns = [self._dense] if self._dense is not None else [self._keys, self._values]
+        size = sum(len(column) for column in columns) * _ITEM_SIZE
+        if not size:
+            return
+        with tempfile.TemporaryFile(prefix='idmap-', dir=self.spill_dir) as f:
+            for column in columns:
+                column.tofile(f)
+            f.flush()
+            self._mmap = mmap.mmap(f.fileno(), size)
+        view = memoryview(self._mmap).cast('B')
+        mapped = []
+        offset = 0
+        for column in columns:
+            length = len(column) * _ITEM_SIZE
+            mapped.append(view[offset:offset + length].cast('q'))
+            offset += length
+        if self._dense is not None:
+            self._dense = mapped[0]
+        else:
+            self._keys, self._values = mapped
+
+    def nbytes(self):
+        """Bytes held by the columns (heap or mmap)."""
+        pending = (len(self._pending_keys) + len(self._pending_values)) * _ITEM_SIZE
+        if self._dense is not None:
+            return len(self._dense) * _ITEM_SIZE + pending
+        return (len(self._keys) + len(self._values)) * _ITEM_SIZE + pending
+
+    def close(self):
+        """Release the mmap'ed file, if any. The mapping becomes empty."""
+        if self._mmap is None:
+            return
+        self._dense = None
+        self._keys, self._values = array('q'), array('q')
+        self._mmap.close()
+        self._mmap = None
+
+    def __repr__(self):
+        return '<IdMapping {} entries, {} bytes{}>'.format(
+            len(self), self.nbytes(), ', mmap' if self._mmap is not None else '')
+
+
+def _sorted_runs(keys, values):
+    """Sort keys/values in place in RUN_SIZE slices; returns one (key, value)
+    iterator per run of slices that continue each other in key order."""
+    bounds = []
+    for start in range(0, len(keys), RUN_SIZE):
+        stop = min(start + RUN_SIZE, len(keys))
+        if any(keys[i] > keys[i + 1] for i in range(start, stop - 1)):
+            # sorted() is stable, so repeated keys keep assignment order
+            order = sorted(range(start, stop), key=keys.__getitem__)
+            run_keys = array('q', (keys[i] for i in order))
+            run_values = array('q', (values[i] for i in order))
+            keys[start:stop], values[start:stop] = run_keys, run_values
+        if bounds and keys[bounds[-1][1] - 1] <= keys[start]:
+            bounds[-1][1] = stop
+        else:
+            bounds.append([start, stop])
+    return [_run_items(keys, values, start, stop) for start, stop in bounds]
+
+
+def _run_items(keys, values, start, stop):
+    """Iterate a sorted run's (key, value) pairs, last assignment of a key only."""
+    for i in range(start, stop):
+        if i + 1 < stop and keys[i + 1] == keys[i]:
+            continue
+        yield keys[i], values[i]
+
+
+def _tagged(run, index):
+    for key, value in run:
+        yield key, index, value
+
+
+def _merge(runs):
+    """Merge sorted (key, value) runs into new columns; on a repeated key the
+    pair from the later run wins."""
+    keys, values = array('q'), array('q')
+    if len(runs) == 1:
+        tagged = ((key, 0, value) for key, value in runs[0])
+    else:
+        # Tag pairs with their run index: heapq.merge has no key= before 3.5
+        tagged = heapq.merge(*[_tagged(run, index) for index, run in enumerate(runs)])
+    for key, _, value in tagged:
+        if keys and keys[-1] == key:
+            values[-1] = value
+            continue
+        keys.append(key)
+        values.append(value)
+    return keys, values
@@ -0,0 +1,240 @@
+"""
+Batch-tagged imports with targeted rollback
+
+ImportBatch records the id ranges each import run inserts, per schema and
+table, in _content_import_batches; rollback() deletes exactly those rows.
+"""
+
+import os
+import re
+import binascii
+import logging
+from array import array
+from datetime import datetime
+
+from .bulkload import _quote_literal, quote_ident
+from .tables import TABLES
+
+logger = logging.getLogger(__name__)
+
+BATCH_TABLE = '_content_import_batches'
+
+# Schema of the live content tables
+DEFAULT_SCHEMA = 'public'
+
+# Recorded ids held in memory before they are written to the side table
+DEFAULT_FLUSH_IDS = 10000
+
+# Ranges per INSERT into the side table
+_RANGES_PER_STATEMENT = 1000
+
+_INSERT_TABLE_RE = re.compile(r'^\s*INSERT\s+INTO\s+"([^"]+)"', re.IGNORECASE)
+
+
+def new_batch_id():
+    """A new batch id: start time and a random suffix (e.g. 20261019-131500-4f2a)."""
+    return '{}-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'),
+                          binascii.hexlify(os.urandom(2)).decode('ascii'))
+
+
+def insert_table(sql):
+    """Target table of an INSERT statement (e.g. 'Word')."""
+    match = _INSERT_TABLE_RE.match(sql)
+    if match is None:
+        raise ValueError("Not an INSERT into a quoted table: {}".format(sql.strip()[:60]))
+    return match.group(1)
+
+
+def id_ranges(ids):
+    """(first, last) runs of consecutive ids, in id order."""
+    ranges = []
+    for new_id in sorted(ids):
+        if ranges and new_id <= ranges[-1][1] + 1:
+            if new_id > ranges[-1][1]:
+                ranges[-1][1] = new_id
+        else:
+            ranges.append([new_id, new_id])
+    return [tuple(pair) for pair in ranges]
+
+
+def _ensure_table(execute):
+    execute('CREATE TABLE IF NOT EXISTS {0} (batch_id text NOT NULL, schema_name text NOT NULL, '
+            'table_name text NOT NULL, first_id integer NOT NULL, last_id integer NOT NULL, '
+            'recorded_at timestamptz NOT NULL DEFAULT now()); '
+            'CREATE INDEX IF NOT EXISTS {1} ON {0} (batch_id, table_name)'.format(
+                quote_ident(BATCH_TABLE), quote_ident('{}_batch_idx'.format(BATCH_TABLE))))
+
+
+class ImportBatch(object):
+    """Records the new rows of one import run under its batch id."""
+
+    def __init__(self, query, execute, batch_id=None, flush_ids=DEFAULT_FLUSH_IDS, schema=DEFAULT_SCHEMA):
+        """Initialize import batch
+
+        Args:
+            query: Callable running a SELECT and returning its single value
+                (see bulkload.psycopg2_runners / psql_runners); on the live
+                schema, where the batch table is kept
+            execute: Callable running SQL in its own autocommit session
+            batch_id: Batch id (default: new_batch_id())
+            flush_ids: Write the recorded ids once this many are pending
+            schema: Schema of the tables the rows are written to
+        """
+        self.query = query
+        self.execute = execute
+        self.schema = schema
+        self.batch_id = batch_id or new_batch_id()
+        self.flush_ids = flush_ids
+        self._pending = {}
+        self._count = 0
+        self._ready = False
+
+    def record(self, table, new_id):
+        """Record one inserted row of table (a Prisma table name)."""
+        ids = self._pending.get(table)
+        if ids is None:
+            ids = self._pending[table] = array('q')
+        ids.append(new_id)
+        self._count += 1
+        if self.flush_ids and self._count >= self.flush_ids:
+            self.flush()
+
+    def recorder(self, table, on_success):
+        """on_success(key, new_id) callback that records the row, then calls on_success."""
+        record = self.record
+
+        def recorded(key, new_id):
+            if new_id is not None:
+                record(table, new_id)
+            on_success(key, new_id)
+        return recorded
+
+    def flush(self):
+        """Write the pending ids to the side table."""
+        if not self._count:
+            return
+        if not self._ready:
+            _ensure_table(self.execute)
+            self._ready = True
+        batch = _quote_literal(self.batch_id)
+        schema = _quote_literal(self.schema)
+        values = []
+        for table, ids in sorted(self._pending.items()):
+            table = _quote_literal(table)
+            values.extend('({}, {}, {}, {}, {})'.format(batch, schema, table, first, last)
+                          for first, last in id_ranges(ids))
+        for start in range(0, len(values), _RANGES_PER_STATEMENT):
+            self.execute('INSERT INTO {} (batch_id, schema_name, table_name, first_id, last_id) VALUES {}'.format(
+                quote_ident(BATCH_TABLE), ', '.join(values[start:start + _RANGES_PER_STATEMENT])))
+        self._pending = {}
+        self._count = 0
+
+    def tagged(self):
+        """Dict of table -> rows recorded under this batch (by every process of the run)."""
+        return tagged_rows(self.query, self.batch_id)
+
+
+def _table_exists(query):
+    return int(query("SELECT (to_regclass({}) IS NOT NULL)::int".format(
+        _quote_literal(quote_ident(BATCH_TABLE))))) == 1
+
+
+def tagged_rows(query, batch_id):
+    """Dict of table -> rows recorded under batch_id."""
+    if not _table_exists(query):
+        return {}
+    text = query("SELECT coalesce(string_agg(table_name || ':' || rows, ',' ORDER BY table_name), '') FROM ("
+                 "SELECT table_name, sum(last_id - first_id + 1) AS rows FROM {} WHERE batch_id = {} "
+                 "GROUP BY table_name) AS batch".format(quote_ident(BATCH_TABLE), _quote_literal(batch_id)))
+    counts = {}
+    for item in str(text or '').split(','):
+        if item:
+            table, rows = item.rsplit(':', 1)
+            counts[table] = int(rows)
+    return counts
+
+
+def list_batches(query):
+    """Lines describing the recorded batches, newest first."""
+    if not _table_exists(query):
+        return []
+    text = query("SELECT coalesce(string_agg(line, E'\\n' ORDER BY started DESC), '') FROM ("
+                 "SELECT min(recorded_at) AS started, batch_id || '  ' || to_char(min(recorded_at), "
+                 "'YYYY-MM-DD HH24:MI:SS') || '  ' || sum(last_id - first_id + 1) || ' rows in ' || "
+                 "string_agg(DISTINCT schema_name, ', ') AS line "
+                 "FROM {} GROUP BY batch_id) AS batches".format(quote_ident(BATCH_TABLE)))
+    return [line for line in str(text or '').split('\n') if line]
+
+
+def batch_schemas(query, batch_id):
+    """Schemas batch_id's rows were written to."""
+    text = query("SELECT coalesce(string_agg(DISTINCT schema_name, ','), '') FROM {} WHERE batch_id = {}".format(
+        quote_ident(BATCH_TABLE), _quote_literal(batch_id)))
+    return sorted(schema for schema in str(text or '').split(',') if schema)
+
+
+def rollback_sql(batch_id, tables=TABLES, schemas=(DEFAULT_SCHEMA,)):
+    """The statements deleting batch_id's rows from schemas, children first, and then its ranges."""
+    batch = _quote_literal(batch_id)
+    statements = []
+    for schema in schemas:
+        for spec in reversed(tables):
+            statements.append(
+                'DELETE FROM {0}.{1} AS target USING {2} AS batch WHERE batch.batch_id = {3} '
+                'AND batch.schema_name = {4} AND batch.table_name = {5} '
+                'AND target.id BETWEEN batch.first_id AND batch.last_id'.format(
+                    quote_ident(schema), quote_ident(spec.target), quote_ident(BATCH_TABLE), batch,
+                    _quote_literal(schema), _quote_literal(spec.target)))
+    statements.append('DELETE FROM {} WHERE batch_id = {}'.format(quote_ident(BATCH_TABLE), batch))
+    return statements
+
+
+def move_schemas_sql(moves):
+    """Statement moving the recorded batches along with their tables.
+
+    Args:
+        moves: (schema, new schema) pairs, applied at once; a new schema of
+            None forgets the schema's batches (its tables are dropped)
+
+    Returns:
+        One statement, a no-op while the batch table does not exist
+    """
+    table = quote_ident(BATCH_TABLE)
+    statements = []
+    dropped = [_quote_literal(schema) for schema, target in moves if target is None]
+    if dropped:
+        statements.append('DELETE FROM {} WHERE schema_name IN ({})'.format(table, ', '.join(dropped)))
+    moved = [(schema, target) for schema, target in moves if target is not None]
+    if moved:
+        statements.append('UPDATE {} SET schema_name = CASE schema_name {} END WHERE schema_name IN ({})'.format(
+            table, ' '.join('WHEN {} THEN {}'.format(_quote_literal(schema), _quote_literal(target))
+                            for schema, target in moved),
+            ', '.join(_quote_literal(schema) for schema, _ in moved)))
+    return 'DO $$BEGIN IF to_regclass({}) IS NOT NULL THEN {}; END IF; END$$'.format(
+        _quote_literal(table), '; '.join(statements))
+
+
+def rollback(query, execute, batch_id, tables=TABLES):
+    """Delete the rows inserted by batch_id in one transaction.
+
+    Returns:
+        Dict of table -> rows recorded under the batch
+
+    Raises:
+        ValueError: If no rows are recorded under batch_id
+        RuntimeError: If the deletes fail (e.g. rows of another batch still
+            reference them); nothing is deleted then
+    """
+    counts = tagged_rows(query, batch_id)
+    if not counts:
+        raise ValueError("No rows recorded for import batch {}".format(batch_id))
+    schemas = batch_schemas(query, batch_id)
+    logger.info("Rolling back import batch {} in {}: {}".format(
+        batch_id, ', '.join(schemas), ', '.join('{} {}'.format(rows, table) for table, rows in sorted(counts.items()))))
+    try:
+        execute('; '.join(['BEGIN'] + rollback_sql(batch_id, tables, schemas) + ['COMMIT']))
+    except Exception as e:
+        raise RuntimeError("Rollback of import batch {} failed, nothing was deleted: {} "
+                           "(if rows of a later batch reference it, roll that batch back first)".format(batch_id, e))
+    logger.info("Rolled back import batch {}".format(batch_id))
+    return counts
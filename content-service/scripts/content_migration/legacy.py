@@ -0,0 +1,191 @@
+"""
+Readers for the legacy content tables
+
+LegacyReader streams the export fields of the legacy tables through
+server-side cursors in one read-only snapshot, without Django. OrmReader
+offers the same interface over the Django models.
+"""
+
+import logging
+from collections import namedtuple
+
+from .bulkload import quote_ident
+from .export import export_rows
+from .manifest import Fingerprint, fingerprint_sql
+
+logger = logging.getLogger(__name__)
+
+# Rows per FETCH from the server-side cursor
+DEFAULT_FETCH_ROWS = 2000
+
+_RECORD_CLASSES = {}
+
+
+def record_class(spec):
+    """namedtuple class with the table's export fields."""
+    cls = _RECORD_CLASSES.get(spec.key)
+    if cls is None:
+        cls = _RECORD_CLASSES[spec.key] = namedtuple('Legacy{}'.format(spec.target), spec.export_fields)
+    return cls
+
+
+class LegacyReader(object):
+    """Read the legacy tables over a psycopg2 / psycopg 3 connection."""
+
+    def __init__(self, connection, fetch_rows=DEFAULT_FETCH_ROWS):
+        """Initialize reader
+
+        Args:
+            connection: Connection to the legacy database with autocommit
+                off (named cursors live inside a transaction)
+            fetch_rows: Rows per fetchmany() round trip
+        """
+        self.connection = connection
+        self.fetch_rows = max(1, fetch_rows)
+
+    def count(self, spec, where=None):
+        """Number of rows in the table (matching where, if given)."""
+        cursor = self.connection.cursor()
+        try:
+            sql = 'SELECT count(*) FROM {}'.format(quote_ident(spec.legacy_table))
+            if where is not None:
+                sql += ' WHERE {}'.format(where)
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def fingerprint(self, spec):
+        """Fingerprint of the table's export fields (see manifest.py)."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(fingerprint_sql(spec.legacy_table, spec.export_fields))
+            return Fingerprint.parse(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+
+    def select_sql(self, spec, limit=None, where=None):
+        sql = 'SELECT {} FROM {}'.format(
+            ', '.join(quote_ident(field) for field in spec.export_fields), quote_ident(spec.legacy_table))
+        if where is not None:
+            sql += ' WHERE {}'.format(where)
+        sql += ' ORDER BY {}'.format(quote_ident('id'))
+        if limit is not None:
+            sql += ' LIMIT {}'.format(int(limit))
+        return sql
+
+    def rows(self, spec, limit=None, where=None):
+        """Yield the table's export fields as tuples, ordered by id.
+
+        Args:
+            spec: TableSpec of the table
+            limit: Optional maximum number of rows (for sampling)
+            where: Optional SQL condition on the legacy table (see
+                partition.py)
+        """
+        cursor = self.connection.cursor(name='legacy_{}'.format(spec.key))
+        # psycopg2 fetches itersize rows per round trip when iterated
+        cursor.itersize = self.fetch_rows
+        try:
+            cursor.execute(self.select_sql(spec, limit, where))
+            fetch_rows = self.fetch_rows
+            while True:
+                rows = cursor.fetchmany(fetch_rows)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    def records(self, spec, limit=None, where=None):
+        """Like rows(), as namedtuples with the export field names."""
+        return map(record_class(spec)._make, self.rows(spec, limit, where))
+
+    def close(self):
+        """End the read-only transaction and close the connection."""
+        self.connection.rollback()
+        self.connection.close()
+
+
+class OrmReader(object):
+    """Read the legacy tables through the Django models (ORM mode)."""
+
+    def __init__(self, models):
+        """Initialize reader
+
+        Args:
+            models: Dict of table key -> legacy model class
+        """
+        self.models = models
+
+    def queryset(self, spec, where=None):
+        queryset = self.models[spec.key].objects.all()
+        return queryset.extra(where=[where]) if where is not None else queryset
+
+    def count(self, spec, where=None):
+        return self.queryset(spec, where).count()
+
+    def fingerprint(self, spec):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute(fingerprint_sql(self.models[spec.key]._meta.db_table, spec.export_fields))
+            return Fingerprint.parse(cursor.fetchone()[0])
+
+    def rows(self, spec, limit=None, where=None):
+        return export_rows(self.queryset(spec, where), spec.export_fields, limit=limit)
+
+    def records(self, spec, limit=None, where=None):
+        return map(record_class(spec)._make, self.rows(spec, limit, where))
+
+    def close(self):
+        pass
+
+
+def connect_legacy(url, fetch_rows=DEFAULT_FETCH_ROWS):
+    """Open a read-only, single-snapshot LegacyReader on the database at url."""
+    try:
+        import psycopg2
+    except ImportError:
+        import psycopg
+        connection = psycopg.connect(url, autocommit=False)
+        connection.read_only = True
+        connection.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    else:
+        connection = psycopg2.connect(url)
+        connection.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+    return LegacyReader(connection, fetch_rows)
+
+
+def legacy_models():
+    """Set up Django and return the legacy model of every table key.
+
+    Needs the speakasap-portal checkout on sys.path and
+    DJANGO_SETTINGS_MODULE set.
+    """
+    import django
+    django.setup()
+
+    from language.models import Language
+    from grammar.models import GrammarCourse, GrammarLesson
+    from phonetics.models import PhoneticsCourse, PhoneticsLesson
+    from songs.models import SongsCourse, SongsLesson
+    from dictionary.models import Word, WordTheme, WordThemeRelation
+
+    return {
+        'languages': Language,
+        'grammar_courses': GrammarCourse,
+        'grammar_lessons': GrammarLesson,
+        'phonetics_courses': PhoneticsCourse,
+        'phonetics_lessons': PhoneticsLesson,
+        'songs_courses': SongsCourse,
+        'songs_lessons': SongsLesson,
+        'words': Word,
+        'word_themes': WordTheme,
+        'word_theme_relations': WordThemeRelation,
+    }
+
+
+def django_reader():
+    """OrmReader over the legacy models (sets up Django)."""
+    return OrmReader(legacy_models())
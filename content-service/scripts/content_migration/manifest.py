@@ -0,0 +1,262 @@
+"""
+Export manifest: skip tables that have not changed since the last run
+
+ExportManifest records a fingerprint of every exported table; ImportState
+records what each target table was imported from, so unchanged tables are
+skipped on both sides.
+"""
+
+import os
+import json
+import time
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from .bulkload import _quote_literal, quote_ident
+from .transfer import stored_size
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+STATE_TABLE = '_content_migration_tables'
+
+_MANIFEST_VERSION = 1
+
+# Seconds between manifest reads when following an export
+DEFAULT_POLL_INTERVAL = 5
+
+
+class Fingerprint(namedtuple('Fingerprint', ['rows', 'max_id', 'digest'])):
+    """Row count, max id and aggregate hash of a table."""
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, text):
+        rows, max_id, digest = text.strip().split(':')
+        return cls(int(rows), int(max_id), digest)
+
+    def __str__(self):
+        return '{}:{}:{}'.format(self.rows, self.max_id, self.digest)
+
+
+def fingerprint_sql(table, fields):
+    """SELECT returning the fingerprint of fields of table as one 'rows:max_id:digest' value."""
+    return ("SELECT count(*) || ':' || coalesce(max(t.id), 0) || ':' || "
+            "coalesce(sum(hashtext(t::text)::bigint), 0) FROM (SELECT {} FROM {}) t").format(
+                ', '.join(quote_ident(field) for field in fields), quote_ident(table))
+
+
+def target_fingerprint_sql(table):
+    """SELECT returning 'rows:max_id' of a target table."""
+    return "SELECT count(*) || ':' || coalesce(max(id), 0) FROM {}".format(quote_ident(table))
+
+
+class ExportManifest(object):
+    """Fingerprints of the export files in a directory (manifest.json)."""
+
+    def __init__(self, tables=None, run=None, complete=True):
+        # Table key -> {'fingerprint', 'fields', 'size', 'exported_at', 'published'}
+        self.tables = tables or {}
+        # Export run that wrote the manifest; complete once every table is published
+        self.run = run
+        self.complete = complete
+
+    @classmethod
+    def load(cls, directory):
+        """Manifest in directory (empty if there is none or it cannot be read)."""
+        path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable manifest {}: {}".format(path, e))
+            return cls()
+        if data.get('version') != _MANIFEST_VERSION:
+            return cls()
+        return cls(data.get('tables', {}), data.get('run'), data.get('complete', True))
+
+    def fingerprint(self, key):
+        """Recorded fingerprint string of a table, or None."""
+        entry = self.tables.get(key)
+        return entry['fingerprint'] if entry else None
+
+    def published(self, key):
+        """Whether the table's file is on the storagebox (not still being exported)."""
+        entry = self.tables.get(key)
+        return entry is not None and entry.get('published', True)
+
+    def unchanged(self, spec, fingerprint, directory):
+        """Whether the export of spec in directory is current for fingerprint."""
+        entry = self.tables.get(spec.key)
+        if entry is None or entry['fingerprint'] != str(fingerprint) or entry['fields'] != list(spec.export_fields):
+            return False
+        if not self.published(spec.key):
+            return False
+        return stored_size(directory, spec.filename) == entry['size']
+
+    def record(self, spec, fingerprint, path=None):
+        """Record the export of spec written to path (None: fingerprint only, for direct reads)."""
+        self.tables[spec.key] = {
+            'fingerprint': str(fingerprint),
+            'fields': list(spec.export_fields),
+            'size': os.path.getsize(path) if path is not None else None,
+            'exported_at': datetime.now().isoformat(),
+            'published': True,
+        }
+
+    def start(self):
+        """Begin an export run; tables expected by it are added with expect()."""
+        self.run = '{}-{}'.format(datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.complete = False
+
+    def expect(self, spec, fingerprint):
+        """Announce that spec will be published with fingerprint in this run."""
+        self.tables[spec.key] = {
+            'fingerprint': str(fingerprint),
+            'fields': list(spec.export_fields),
+            'size': None,
+            'exported_at': None,
+            'published': False,
+        }
+
+    def save(self, directory):
+        """Write manifest.json to directory (atomically replacing the old one)."""
+        path = os.path.join(directory, MANIFEST_NAME)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': _MANIFEST_VERSION, 'run': self.run, 'complete': self.complete,
+                       'tables': self.tables}, f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+        return path
+
+
+class ManifestFollower(object):
+    """Wait for the tables of an export run as the exporter publishes them."""
+
+    def __init__(self, directory, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+        """Initialize follower
+
+        Args:
+            directory: Export directory on the storagebox
+            poll_interval: Seconds between manifest reads
+            timeout: Seconds to wait for one table before giving up (None:
+                wait indefinitely)
+        """
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.run = None
+
+    def _poll(self, ready, waiting_for):
+        deadline = time.time() + self.timeout if self.timeout is not None else None
+        logged = False
+        while True:
+            manifest = ExportManifest.load(self.directory)
+            if ready(manifest):
+                return manifest
+            if not logged:
+                logger.info("Waiting for {} in {}".format(waiting_for, self.directory))
+                logged = True
+            if deadline is not None and time.time() > deadline:
+                raise RuntimeError("Timed out waiting for {}".format(waiting_for))
+            time.sleep(self.poll_interval)
+
+    def manifest(self):
+        """The manifest of the current (or last) export run, waiting for one to appear."""
+        manifest = self._poll(lambda manifest: bool(manifest.tables), 'an export manifest')
+        self.run = manifest.run
+        logger.info("Following export run {} ({})".format(
+            manifest.run, 'complete' if manifest.complete else 'in progress'))
+        return manifest
+
+    def wait(self, spec):
+        """Wait until spec is published by the followed run; returns the manifest then.
+
+        Raises:
+            RuntimeError: If another export run replaces the followed one,
+                the run completes without the table, or the wait times out
+        """
+        def ready(manifest):
+            if manifest.run != self.run:
+                raise RuntimeError("Export run {} was replaced by {}; restart the import".format(
+                    self.run, manifest.run))
+            if manifest.published(spec.key):
+                return True
+            if manifest.complete:
+                raise RuntimeError("Export run {} completed without {}".format(self.run, spec.filename))
+            return False
+
+        return self._poll(ready, spec.filename)
+
+
+class ImportState(object):
+    """What each content table of the new database was last imported from."""
+
+    def __init__(self, query, execute):
+        """Initialize import state
+
+        Args:
+            query: Callable running a SELECT and returning its single value
+                (see bulkload.psycopg2_runners / psql_runners)
+            execute: Callable running one statement in its own autocommit
+                session
+        """
+        self.query = query
+        self.execute = execute
+        self._ready = False
+
+    def _ensure(self):
+        if not self._ready:
+            self.execute('CREATE TABLE IF NOT EXISTS {} (table_key text PRIMARY KEY, fingerprint text NOT NULL, '
+                         'target text NOT NULL, imported_at timestamptz NOT NULL DEFAULT now())'.format(
+                             quote_ident(STATE_TABLE)))
+            self._ready = True
+
+    def load(self):
+        """Dict of table key -> (imported fingerprint, target 'rows:max_id')."""
+        self._ensure()
+        text = self.query("SELECT coalesce(json_object_agg(table_key, json_build_array(fingerprint, target)), "
+                          "'{{}}')::text FROM {}".format(quote_ident(STATE_TABLE)))
+        return dict((key, tuple(value)) for key, value in json.loads(text or '{}').items())
+
+    def target(self, spec):
+        return self.query(target_fingerprint_sql(spec.target)).strip()
+
+    def skipped(self, manifest, tables):
+        """Keys of the tables whose import is current for manifest.
+
+        A table is skipped when the manifest fingerprint is the one last
+        imported, the target table still has the row count and max id
+        recorded then, and every table referencing it is skipped as well.
+        """
+        state = self.load()
+        skipped = set()
+        for spec in reversed(tables):
+            recorded = state.get(spec.key)
+            fingerprint = manifest.fingerprint(spec.key)
+            if recorded is None or fingerprint is None or recorded[0] != fingerprint:
+                continue
+            children = [child.key for child in tables if spec.key in child.foreign_keys.values()]
+            if any(key not in skipped for key in children):
+                continue
+            if self.target(spec) != recorded[1]:
+                continue
+            skipped.add(spec.key)
+        return skipped
+
+    def record(self, spec, manifest):
+        """Record that spec was imported from the manifest's export."""
+        fingerprint = manifest.fingerprint(spec.key)
+        if fingerprint is None:
+            return
+        self._ensure()
+        self.execute('INSERT INTO {} (table_key, fingerprint, target) VALUES ({}, {}, {}) '
+                     'ON CONFLICT (table_key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, '
+                     'target = EXCLUDED.target, imported_at = now()'.format(
+                         quote_ident(STATE_TABLE), _quote_literal(spec.key), _quote_literal(fingerprint),
+                         _quote_literal(self.target(spec))))
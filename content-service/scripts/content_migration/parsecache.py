@@ -0,0 +1,301 @@
+"""
+Parsed-export cache for repeated imports
+
+ParseCache keeps the parsed rows of each export file in a local cache file
+keyed by the file's content, so a rerun on an unchanged export skips the
+CSV parsing.
+"""
+
+import os
+import glob
+import mmap
+import struct
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# A cache file holds [row text][line starts][line stops][row ends][trailer].
+# The row text is each row's fields joined by NUL (PostgreSQL text cannot
+# contain one) as UTF-8; the array('q') columns give, per row, the byte
+# range of its line in the export and the end of its fields in the row text.
+_MAGIC = b'PARSED01'
+_TRAILER = struct.Struct('<8sqq')
+_ITEM_SIZE = array('q').itemsize
+_SEPARATOR = '\x00'
+_HASH_CHUNK = 1 << 20
+
+
+def parse_lines(export, parse, start=0, end=None, progress=None):
+    """Yield (offset, raw line, row) for the data lines of export[start:end] that parse.
+
+    Args:
+        export: reader.ExportFile
+        parse: Callable turning a decoded line into a list of fields, or
+            None for lines to skip
+        start, end, progress: See ExportFile.lines()
+    """
+    for offset, raw in export.lines(start, end, progress=progress, offsets=True):
+        row = parse(raw.decode('utf-8'))
+        if row:
+            yield offset, raw, row
+
+
+class _CacheFile(object):
+    """Read-only view of one cache file (or part)."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._data)
+        if size < _TRAILER.size:
+            self.close()
+            raise ValueError("Truncated parse cache file {}".format(path))
+        magic, count, text_size = _TRAILER.unpack_from(self._data, size - _TRAILER.size)
+        if magic != _MAGIC or text_size + 3 * count * _ITEM_SIZE + _TRAILER.size != size:
+            self.close()
+            raise ValueError("Not a parse cache file: {}".format(path))
+        self.count = count
+        self.text_size = text_size
+        self.starts = self._column(0)
+        self.stops = self._column(1)
+        self.ends = self._column(2)
+
+    def _column(self, position):
+        column = array('q')
+        first = self.text_size + position * self.count * _ITEM_SIZE
+        column.frombytes(self._data[first:first + self.count * _ITEM_SIZE])
+        return column
+
+    def text(self, first, last):
+        return self._data[first:last]
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class _CacheWriter(object):
+    """Writes one cache file (or part) under a temporary name and renames it when done."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = '{}.tmp.{}'.format(path, os.getpid())
+        self._file = open(self._tmp, 'wb')
+        self.starts = array('q')
+        self.stops = array('q')
+        self.ends = array('q')
+        self.text_size = 0
+
+    def add(self, start, stop, row):
+        text = _SEPARATOR.join(row)
+        if text.count(_SEPARATOR) != len(row) - 1:
+            raise ValueError("Field contains a NUL character")
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self.text_size += len(data)
+        self.starts.append(start)
+        self.stops.append(stop)
+        self.ends.append(self.text_size)
+
+    def add_text(self, source, first, last):
+        """Append the row text [first, last) of a _CacheFile; returns the shift of its row ends."""
+        shift = self.text_size - first
+        self._file.write(source.text(first, last))
+        self.text_size += last - first
+        return shift
+
+    def finish(self):
+        for column in (self.starts, self.stops, self.ends):
+            column.tofile(self._file)
+        self._file.write(_TRAILER.pack(_MAGIC, len(self.starts), self.text_size))
+        self._file.close()
+        os.rename(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class ParseCache(object):
+    """Local cache of the parsed rows of export files (for one parse function)."""
+
+    def __init__(self, directory):
+        """Initialize cache
+
+        Args:
+            directory: Directory of the cache files (created if missing)
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # (path, size, mtime) -> cache file name; forked workers inherit it
+        self._names = {}
+
+    def _prefix(self, path):
+        return os.path.join(self.directory, os.path.basename(path))
+
+    def _identity(self, path):
+        stat = os.stat(path)
+        return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns), stat.st_size
+
+    def register(self, path, digest):
+        """Key the export at path by a digest from its metadata instead of hashing it.
+
+        Args:
+            path: Export file path
+            digest: String that changes whenever the file's content does,
+                e.g. 'sha256:<hex>' from its chunk index
+        """
+        identity, size = self._identity(path)
+        self._names[identity] = '{}.{}-{}.parsed'.format(
+            self._prefix(path), size, hashlib.sha1(digest.encode('utf-8')).hexdigest()[:16])
+
+    def cache_path(self, path):
+        """Cache file of the export at path; hashes its content unless register() gave a digest."""
+        identity, size = self._identity(path)
+        name = self._names.get(identity)
+        if name is None:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                    digest.update(chunk)
+            name = self._names[identity] = '{}.{}-{}.parsed'.format(
+                self._prefix(path), size, digest.hexdigest()[:16])
+        return name
+
+    def _part_path(self, path, start):
+        return '{}.{}.part'.format(self.cache_path(path), start)
+
+    def prepare(self, path):
+        """Hash the export at path (before forking workers) and log whether it is cached.
+
+        Returns:
+            True if the parsed rows of path are cached
+        """
+        cached = os.path.exists(self.cache_path(path))
+        logger.info("Parse cache {} for {}".format('hit' if cached else 'miss', os.path.basename(path)))
+        return cached
+
+    def rows(self, export, parse, start=0, end=None, progress=None):
+        """Yield (offset, raw line, row) like parse_lines(), from the cache when it has the export.
+
+        On a hit the raw line is a callable that reads it from the export
+        (rejects.TableRejects calls it only for rows it writes out). On a miss the rows are parsed and written to the cache (a part of it
+        when [start, end) is not the whole file, see assemble()).
+        """
+        end = export.size if end is None else end
+        path = self.cache_path(export.path)
+        if os.path.exists(path):
+            try:
+                cache = _CacheFile(path)
+            except ValueError as e:
+                logger.warning("Parse cache: {}; parsing instead".format(e))
+                os.remove(path)
+            else:
+                return self._cached_rows(export, cache, start, end, progress)
+        if start == 0 and end == export.size:
+            target = path
+        else:
+            target = self._part_path(export.path, start)
+        return self._recorded_rows(export, parse, start, end, progress, target)
+
+    def _cached_rows(self, export, cache, start, end, progress):
+        starts, stops, ends = cache.starts, cache.stops, cache.ends
+        line = export.line
+        text = cache.text
+        first = bisect_left(starts, start)
+        last = bisect_left(starts, end)
+        credited = start
+        try:
+            for position in range(first, last):
+                offset, stop = starts[position], stops[position]
+                if progress is not None:
+                    progress.add_bytes(stop - credited)
+                    credited = stop
+                row = text(ends[position - 1] if position else 0, ends[position]).decode('utf-8').split(_SEPARATOR)
+                yield offset, partial(line, offset, stop), row
+            if progress is not None and end > credited:
+                progress.add_bytes(end - credited)
+        finally:
+            cache.close()
+
+    def _recorded_rows(self, export, parse, start, end, progress, target):
+        writer = _CacheWriter(target)
+        line_stop = export.line_stop
+        done = False
+        try:
+            for offset, raw, row in parse_lines(export, parse, start, end, progress):
+                if writer is not None:
+                    try:
+                        writer.add(offset, line_stop(offset, end), row)
+                    except ValueError as e:
+                        logger.warning("Parse cache: not caching {} ({})".format(export.path, e))
+                        writer.abort()
+                        writer = None
+                yield offset, raw, row
+            done = True
+        finally:
+            if writer is not None:
+                if done:
+                    writer.finish()
+                    if target.endswith('.parsed'):
+                        self._remove_stale(export.path, target)
+                else:
+                    writer.abort()
+
+    def assemble(self, path, ranges):
+        """Join the parts written by the shards of path into its cache file.
+
+        Args:
+            path: Export file path
+            ranges: (start, end) byte ranges the shards read
+
+        Returns:
+            True if the cache file exists afterwards
+        """
+        target = self.cache_path(path)
+        if os.path.exists(target):
+            return True
+        ranges = sorted(ranges)
+        size = os.path.getsize(path)
+        parts = [self._part_path(path, start) for start, _ in ranges]
+        covered = (ranges and ranges[0][0] == 0 and ranges[-1][1] == size and
+                   all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:])))
+        if not covered or not all(os.path.exists(part) for part in parts):
+            logger.info("Parse cache: {} not cached (shards incomplete)".format(os.path.basename(path)))
+            return False
+
+        writer = _CacheWriter(target)
+        try:
+            for part in parts:
+                cache = _CacheFile(part)
+                try:
+                    shift = writer.add_text(cache, 0, cache.text_size)
+                    writer.starts.extend(cache.starts)
+                    writer.stops.extend(cache.stops)
+                    writer.ends.extend(end + shift for end in cache.ends)
+                finally:
+                    cache.close()
+            writer.finish()
+        except Exception:
+            writer.abort()
+            raise
+        for part in parts:
+            os.remove(part)
+        self._remove_stale(path, target)
+        logger.info("Parse cache: stored {} rows of {}".format(len(writer.starts), os.path.basename(path)))
+        return True
+
+    def _remove_stale(self, path, current):
+        """Remove the caches and parts of other versions of the export file name."""
+        for stale in glob.glob('{}.*.parsed*'.format(self._prefix(path))):
+            if not stale.startswith(current) and '.tmp.' not in stale:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
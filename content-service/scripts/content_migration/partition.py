@@ -0,0 +1,152 @@
+"""
+Per-language partition of the content tables
+
+LanguagePartition selects the rows of some Language.code values for the
+legacy readers, the export files and the DELETEs that empty the slice in
+the new database. Word themes are shared and not part of a partition.
+"""
+
+import logging
+
+from .bulkload import _quote_literal, quote_ident
+from .tables import get_table
+
+logger = logging.getLogger(__name__)
+
+# Table key -> (parent table key, legacy field referencing the parent)
+PARTITION_PARENTS = {
+    'grammar_courses': ('languages', 'language_id'),
+    'phonetics_courses': ('languages', 'language_id'),
+    'songs_courses': ('languages', 'language_id'),
+    'grammar_lessons': ('grammar_courses', 'course_id'),
+    'phonetics_lessons': ('phonetics_courses', 'course_id'),
+    'songs_lessons': ('songs_courses', 'course_id'),
+    'words': ('languages', 'language_id'),
+    'word_theme_relations': ('words', 'word_id'),
+}
+
+# Shared tables whose new ids are found by content instead of re-imported
+SHARED_TABLES = ('word_themes',)
+
+
+def parse_languages(text):
+    """Language codes from a comma separated list ('en,de')."""
+    codes = [code.strip() for code in text.split(',') if code.strip()]
+    if not codes:
+        raise ValueError("No language codes in {!r}".format(text))
+    return codes
+
+
+class LanguagePartition(object):
+    """The rows of the content tables that belong to some languages."""
+
+    def __init__(self, codes):
+        """Initialize partition
+
+        Args:
+            codes: Language.code values of the partition
+        """
+        self.codes = list(codes)
+        # Table key -> legacy ids kept so far, for the children's filters
+        self._kept = {}
+        # Language codes found among the legacy languages
+        self._found = set()
+
+    def tables(self, tables):
+        """The specs of tables that are part of the partition, in import order."""
+        return [spec for spec in tables if spec.key == 'languages' or spec.key in PARTITION_PARENTS]
+
+    def _codes_sql(self):
+        return ', '.join(_quote_literal(code) for code in self.codes)
+
+    def legacy_where(self, spec):
+        """WHERE condition selecting the partition's rows of spec's legacy table."""
+        if spec.key == 'languages':
+            return '{} IN ({})'.format(quote_ident('code'), self._codes_sql())
+        parent_key, field = PARTITION_PARENTS[spec.key]
+        parent = get_table(parent_key)
+        return '{} IN (SELECT {} FROM {} WHERE {})'.format(
+            quote_ident(field), quote_ident('id'), quote_ident(parent.legacy_table), self.legacy_where(parent))
+
+    def target_where(self, spec):
+        """WHERE condition selecting the partition's rows of spec's table in the new database."""
+        if spec.key == 'languages':
+            return '{} IN ({})'.format(quote_ident('code'), self._codes_sql())
+        parent_key = PARTITION_PARENTS[spec.key][0]
+        column = [column for column, key in spec.foreign_keys.items() if key == parent_key][0]
+        parent = get_table(parent_key)
+        return '{} IN (SELECT {} FROM {} WHERE {})'.format(
+            quote_ident(column), quote_ident('id'), quote_ident(parent.target), self.target_where(parent))
+
+    def delete_sql(self, tables):
+        """(spec, DELETE statement) pairs emptying the partition in the new database, children first."""
+        return [(spec, 'DELETE FROM {} WHERE {}'.format(quote_ident(spec.target), self.target_where(spec)))
+                for spec in reversed(self.tables(tables))]
+
+    def row_filter(self, spec):
+        """keep(row) for exported rows of spec: whether the row is in the partition.
+
+        Filters must be built in import order: a child's filter keeps the
+        rows whose parent was kept.
+        """
+        kept = self._kept[spec.key] = set()
+        if spec.key == 'languages':
+            position = spec.export_fields.index('code')
+            allowed = set(self.codes)
+            found = self._found
+        else:
+            parent_key, field = PARTITION_PARENTS[spec.key]
+            position = spec.export_fields.index(field)
+            allowed = self._kept.get(parent_key, set())
+            found = set()
+
+        def keep(row):
+            value = row[position]
+            if value in allowed:
+                kept.add(row[0])
+                found.add(value)
+                return True
+            return False
+        return keep
+
+    def missing_codes(self):
+        """Codes of the partition not found among the legacy languages read so far."""
+        return [code for code in self.codes if code not in self._found]
+
+
+def shared_mapping(spec, legacy_rows, target_rows):
+    """Legacy id -> new id of a shared table, matching rows by their INSERT values.
+
+    Args:
+        spec: TableSpec of the shared table
+        legacy_rows: Exported rows of the legacy table
+        target_rows: (id, column values...) rows of the new table, in
+            spec.columns order
+
+    Returns:
+        Dict of legacy id -> new id; legacy rows without an equal row in the
+        new database are left out (their children are rejected as
+        missing_parent)
+    """
+    by_values = {}
+    for row in target_rows:
+        by_values.setdefault(tuple(row[1:]), row[0])
+    mapping = {}
+    unmatched = 0
+    for row in legacy_rows:
+        new_id = by_values.get(tuple(spec.transform(row)))
+        if new_id is None:
+            unmatched += 1
+        else:
+            mapping[row[0]] = new_id
+    if unmatched:
+        logger.warning("{} {} rows have no match in {}; run a full import to add them".format(
+            unmatched, spec.key, spec.target))
+    return mapping
+
+
+def shared_select_sql(spec):
+    """SELECT of (id, columns...) of a shared table in the new database, lowest id first."""
+    return 'SELECT {} FROM {} ORDER BY {}'.format(
+        ', '.join(quote_ident(column) for column in ['id'] + list(spec.columns)),
+        quote_ident(spec.target), quote_ident('id'))
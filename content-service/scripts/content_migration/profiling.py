@@ -0,0 +1,306 @@
+"""
+Opt-in profiling of the migration hot loops (--profile)
+
+Profiler times the phases of each table import and can sample its Python
+stacks (folded stacks) or run cProfile. Disabled, it changes nothing.
+"""
+
+import os
+import signal
+import logging
+import cProfile
+import threading
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('read', 'parse', 'transform', 'write', 'format', 'spawn', 'server', 'commit')
+
+MODES = ('sample', 'cprofile')
+
+# Seconds of process CPU time between stack samples
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class _Phases(object):
+    """Exclusive wall-clock time per phase; entering a phase pauses the current one."""
+
+    def __init__(self, outer):
+        self.totals = {}
+        self._stack = [outer]
+        self._since = perf_counter()
+
+    def enter(self, phase):
+        now = perf_counter()
+        current = self._stack[-1]
+        self.totals[current] = self.totals.get(current, 0.0) + now - self._since
+        self._stack.append(phase)
+        self._since = now
+
+    def exit(self):
+        now = perf_counter()
+        phase = self._stack.pop()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - self._since
+        self._since = now
+
+    def exit_split(self, phase, seconds):
+        """Leave the current phase, counting up to seconds of its time as phase instead."""
+        now = perf_counter()
+        current = self._stack.pop()
+        elapsed = now - self._since
+        seconds = min(max(seconds, 0.0), elapsed)
+        self.totals[current] = self.totals.get(current, 0.0) + elapsed - seconds
+        self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+        self._since = now
+
+
+class _Sampler(object):
+    """SIGPROF-driven stack sampler of the main thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = {}
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        names.reverse()
+        stack = ';'.join(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("Profiling: stack sampling only works in the main thread; phase timers only")
+            return False
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, count))
+
+
+class _PhaseContext(object):
+    def __init__(self, phases, phase):
+        self.phases = phases
+        self.phase = phase
+
+    def __enter__(self):
+        self.phases.enter(self.phase)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.phases.exit()
+
+
+class TableProfile(object):
+    """Profiling of one table; use as a context manager around the table's loop."""
+
+    def __init__(self, profiler, progress, name=None):
+        self.profiler = profiler
+        self.progress = progress
+        self.name = name or progress.key
+        self._phases = None
+        self._sampler = None
+        self._cprofile = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        self._phases = _Phases('transform')
+        if profiler.mode == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            sampler = _Sampler(profiler.interval)
+            if sampler.start():
+                self._sampler = sampler
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._phases.exit()
+        for phase, seconds in self._phases.totals.items():
+            if seconds:
+                self.progress.add_phase(phase, seconds)
+        directory = self.profiler.directory
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(os.path.join(directory, '{}.prof'.format(self.name)))
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.write(os.path.join(directory, '{}.folded'.format(self.name)))
+        self.profiler.tables.append(self.progress)
+
+    def phase(self, phase):
+        """Context manager timing a block as phase."""
+        return _PhaseContext(self._phases, phase)
+
+    def wrap(self, phase, func):
+        """Return func timed as phase."""
+        enter = self._phases.enter
+        exit = self._phases.exit
+
+        def timed(*args, **kwargs):
+            enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                exit()
+        return timed
+
+    def read(self, iterable):
+        """Iterate iterable, timing each next() as read."""
+        iterator = iter(iterable)
+        enter = self._phases.enter
+        exit = self._phases.exit
+        while True:
+            enter('read')
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                exit()
+            yield item
+
+    def batch(self, batch):
+        """Time a batch's execute/finish as write and its commits as commit.
+
+        A psql batch's script building is timed as format and its psql runs
+        as spawn and server.
+        """
+        if hasattr(batch, 'server_seconds'):
+            batch.timing = True
+            batch._script = self.wrap('format', batch._script)
+            batch.run = self._psql_run(batch.run, batch.server_seconds)
+        batch.execute = self.wrap('write', batch.execute)
+        batch.finish = self.wrap('write', batch.finish)
+        if hasattr(batch, 'commit'):
+            batch.commit = self.wrap('commit', batch.commit)
+        return batch
+
+    def _psql_run(self, run, server_seconds):
+        """Return run(script) timed as spawn, less the server time psql reports."""
+        phases = self._phases
+
+        def timed(script):
+            phases.enter('spawn')
+            try:
+                result = run(script)
+            except Exception:
+                phases.exit_split('server', float('inf'))
+                raise
+            phases.exit_split('server', server_seconds(result[0]))
+            return result
+        return timed
+
+    def cursor(self, cursor):
+        """Time a cursor's execute as write."""
+        cursor.execute = self.wrap('write', cursor.execute)
+        return cursor
+
+
+class _NoProfile(object):
+    """Stand-in for TableProfile when profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def phase(self, phase):
+        return self
+
+    def wrap(self, phase, func):
+        return func
+
+    def read(self, iterable):
+        return iterable
+
+    def batch(self, batch):
+        return batch
+
+    def cursor(self, cursor):
+        return cursor
+
+
+_NO_PROFILE = _NoProfile()
+
+
+class Profiler(object):
+    """Creates TableProfiles for one run; a no-op unless given a directory."""
+
+    def __init__(self, directory=None, mode='sample', interval=DEFAULT_SAMPLE_INTERVAL):
+        """Initialize profiler
+
+        Args:
+            directory: Output directory for stacks and the summary (None
+                disables profiling)
+            mode: 'sample' (collapsed stacks) or 'cprofile' (pstats dumps)
+            interval: Seconds of CPU time between samples in 'sample' mode
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown profile mode {!r} (expected one of {})".format(mode, ', '.join(MODES)))
+        self.directory = directory
+        self.mode = mode
+        self.interval = interval
+        self.tables = []
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def settings(self):
+        """Arguments for re-creating this profiler in a worker process."""
+        return (self.directory, self.mode, self.interval)
+
+    def table(self, progress, name=None):
+        """Profile the table tracked by progress (name: output file stem, default the table key)."""
+        if not self.enabled:
+            return _NO_PROFILE
+        return TableProfile(self, progress, name)
+
+    def add(self, progress):
+        """Include a table profiled in shard workers (phases merged into progress) in the summary."""
+        if self.enabled:
+            self.tables.append(progress)
+
+    def summary_lines(self):
+        # Only the phases some table has (format/spawn/server are psql only)
+        phases = [phase for phase in PHASES if any(progress.phases.get(phase) for progress in self.tables)]
+        header = '{:<24}'.format('table') + ''.join('{:>14}'.format(phase) for phase in phases)
+        header += '{:>10}{:>10}'.format('db', 'total')
+        lines = [header, '-' * len(header)]
+        for progress in self.tables:
+            total = sum(progress.phases.values())
+            line = '{:<24}'.format(progress.key)
+            for phase in phases:
+                seconds = progress.phases.get(phase, 0.0)
+                line += '{:>8.1f}s{:>4.0f}%'.format(seconds, 100.0 * seconds / total if total else 0)
+            lines.append(line + '{:>9.1f}s{:>9.1f}s'.format(progress.db_seconds, total))
+        return lines
+
+    def close(self):
+        """Log the phase summary and write it to <directory>/summary.txt."""
+        if not self.enabled or not self.tables:
+            return
+        lines = self.summary_lines()
+        logger.info("Profile (exclusive seconds per phase; db is the measured round-trip time, "
+                    "part of write or spawn and server):")
+        for line in lines:
+            logger.info(line)
+        with open(os.path.join(self.directory, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        logger.info("Profile: {} files written to {}".format(
+            'collapsed stacks (.folded)' if self.mode == 'sample' else 'cProfile (.prof)', self.directory))
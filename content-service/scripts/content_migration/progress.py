@@ -0,0 +1,223 @@
+"""
+Per-table progress telemetry for the migration scripts
+
+Rows, bytes, throughput, ETA, round-trip latency and error counts per
+table, written as JSON lines and closed by a `run_finish` record.
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Seconds between periodic 'table_progress' records
+DEFAULT_INTERVAL = 5.0
+
+
+class TimedCursor(object):
+    """DB-API cursor proxy that records execute() latency on a TableProgress."""
+
+    def __init__(self, cursor, progress):
+        self._cursor = cursor
+        self._progress = progress
+
+    def execute(self, *args, **kwargs):
+        return self._progress.call(self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._progress.call(self._cursor.executemany, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class TableProgress(object):
+    """Counters for one table of a migration run."""
+
+    def __init__(self, reporter, key, total_rows=None, total_bytes=None):
+        self.reporter = reporter
+        self.key = key
+        self.total_rows = total_rows
+        self.total_bytes = total_bytes
+        self.rows = 0
+        self.bytes_read = 0
+        self.errors = {}
+        self.db_calls = 0
+        self.db_seconds = 0.0
+        self.db_max_seconds = 0.0
+        # Exclusive seconds per phase (read, parse, ...), filled by --profile
+        self.phases = {}
+        self.started = time.perf_counter()
+        self.finished = None
+        self._next_emit = self.started + reporter.interval
+
+    def advance(self, rows=1, bytes_read=0):
+        """Count processed rows (and optionally bytes read)."""
+        self.rows += rows
+        self.bytes_read += bytes_read
+        self._maybe_emit()
+
+    def add_bytes(self, bytes_read):
+        self.bytes_read += bytes_read
+
+    def error(self, error):
+        """Count a failed row; error is an exception or an error class name."""
+        kind = error if isinstance(error, str) else type(error).__name__
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        self._maybe_emit()
+
+    def record_db(self, seconds):
+        """Record one database round trip."""
+        self.db_calls += 1
+        self.db_seconds += seconds
+        if seconds > self.db_max_seconds:
+            self.db_max_seconds = seconds
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def call(self, func, *args, **kwargs):
+        """Call func (a database round trip) and record its latency."""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record_db(time.perf_counter() - start)
+
+    def cursor(self, cursor):
+        """Wrap a DB-API cursor so every execute() is timed."""
+        return TimedCursor(cursor, self)
+
+    def counters(self):
+        """Raw counters, for handing a worker process's totals to the coordinator."""
+        return {
+            'rows': self.rows,
+            'bytes_read': self.bytes_read,
+            'errors': dict(self.errors),
+            'db_calls': self.db_calls,
+            'db_seconds': self.db_seconds,
+            'db_max_seconds': self.db_max_seconds,
+            'phases': dict(self.phases),
+        }
+
+    def merge(self, counters):
+        """Add the counters() of another TableProgress (e.g. one import shard)."""
+        self.rows += counters['rows']
+        self.bytes_read += counters['bytes_read']
+        for kind, count in counters['errors'].items():
+            self.errors[kind] = self.errors.get(kind, 0) + count
+        self.db_calls += counters['db_calls']
+        self.db_seconds += counters['db_seconds']
+        self.db_max_seconds = max(self.db_max_seconds, counters['db_max_seconds'])
+        for phase, seconds in counters.get('phases', {}).items():
+            self.add_phase(phase, seconds)
+        self._maybe_emit()
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def eta_seconds(self):
+        """Remaining seconds, by row count if known, else by bytes read."""
+        elapsed = self.elapsed()
+        if self.total_rows and self.rows:
+            remaining = max(self.total_rows - self.rows, 0)
+            return elapsed * remaining / float(self.rows)
+        if self.total_bytes and self.bytes_read:
+            remaining = max(self.total_bytes - self.bytes_read, 0)
+            return elapsed * remaining / float(self.bytes_read)
+        return None
+
+    def snapshot(self):
+        elapsed = self.elapsed()
+        eta = self.eta_seconds()
+        snapshot = {
+            'table': self.key,
+            'rows': self.rows,
+            'total_rows': self.total_rows,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed > 0 else None,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'db_calls': self.db_calls,
+            'db_latency_ms_avg': round(1000.0 * self.db_seconds / self.db_calls, 3) if self.db_calls else None,
+            'db_latency_ms_max': round(1000.0 * self.db_max_seconds, 3) if self.db_calls else None,
+            'errors': dict(self.errors),
+            'error_count': sum(self.errors.values()),
+        }
+        if self.phases:
+            snapshot['phase_seconds'] = dict((phase, round(seconds, 3)) for phase, seconds in self.phases.items())
+        return snapshot
+
+    def _maybe_emit(self):
+        now = time.perf_counter()
+        if now >= self._next_emit:
+            self._next_emit = now + self.reporter.interval
+            self.reporter.emit('table_progress', self.snapshot())
+
+    def finish(self):
+        """Mark the table as done and emit its totals."""
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        snapshot = self.snapshot()
+        self.reporter.emit('table_finish', snapshot)
+        logger.info("{}: {} rows in {:.1f}s ({} rows/s, {} errors, db avg {} ms)".format(
+            self.key, self.rows, snapshot['elapsed_seconds'], snapshot['rows_per_second'],
+            snapshot['error_count'], snapshot['db_latency_ms_avg']
+        ))
+
+
+class ProgressReporter(object):
+    """Collects TableProgress instances of one run and writes the JSON line stream."""
+
+    def __init__(self, path=None, interval=DEFAULT_INTERVAL, run_id=None, source=None):
+        """Initialize reporter
+
+        Args:
+            path: JSON lines file to append to (None keeps metrics in memory only)
+            interval: Seconds between periodic progress records per table
+            run_id: Identifier stamped on every record (default: timestamp-pid)
+            source: Name of the migration script / route
+        """
+        self.path = path
+        self.interval = interval
+        self.run_id = run_id or '{}-{}'.format(datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.source = source
+        self.tables = []
+        self._stream = open(path, 'a', encoding='utf-8') if path else None
+        self.emit('run_start', {'source': source})
+
+    def table(self, key, total_rows=None, total_bytes=None):
+        """Start tracking a table and return its TableProgress."""
+        progress = TableProgress(self, key, total_rows=total_rows, total_bytes=total_bytes)
+        self.tables.append(progress)
+        self.emit('table_start', {'table': key, 'total_rows': total_rows, 'total_bytes': total_bytes})
+        return progress
+
+    def emit(self, event, fields):
+        if self._stream is None:
+            return
+        record = {'ts': round(time.time(), 3), 'run_id': self.run_id, 'event': event}
+        record.update(fields)
+        self._stream.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + '\n')
+        self._stream.flush()
+
+    def summary(self):
+        return [progress.snapshot() for progress in self.tables]
+
+    def close(self, status='ok'):
+        """Finish open tables and write the run_finish record."""
+        for progress in self.tables:
+            if progress.finished is None:
+                progress.finish()
+        self.emit('run_finish', {'status': status, 'source': self.source, 'tables': self.summary()})
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,126 @@
+"""
+Memory-mapped reader for storagebox export files
+
+ExportFile yields the stripped data lines as bytes and splits a file into
+line-aligned byte ranges for shard workers.
+"""
+
+import os
+import mmap
+from array import array
+
+
+class ExportFile(object):
+    """Read-only, mmap-backed view of one export file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._offsets = None
+        self._file = open(path, 'rb')
+        if self.size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap cannot map an empty file
+            self._data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def lines(self, start=0, end=None, progress=None, offsets=False):
+        """Yield the stripped data lines in [start, end) as bytes.
+
+        Args:
+            start: Byte offset of a line start (0 or a shard range start)
+            end: Byte offset where reading stops (default: end of file);
+                must be a line start or the end of the file
+            progress: Optional TableProgress credited with the bytes read
+            offsets: Yield (line offset, line) pairs instead of lines
+        """
+        data = self._data
+        find = data.find
+        end = self.size if end is None else end
+        pos = start
+        while pos < end:
+            newline = find(b'\n', pos, end)
+            stop = end if newline < 0 else newline + 1
+            raw = data[pos:stop].strip()
+            if progress is not None:
+                progress.add_bytes(stop - pos)
+            if raw and not raw.startswith(b'--'):
+                yield (pos, raw) if offsets else raw
+            pos = stop
+
+    def line_stop(self, offset, end=None):
+        """Offset just past the line starting at offset (the next line's start, or end)."""
+        end = self.size if end is None else end
+        newline = self._data.find(b'\n', offset, end)
+        return end if newline < 0 else newline + 1
+
+    def line(self, offset, stop):
+        """The stripped line in [offset, stop), as lines() yields it."""
+        return self._data[offset:stop].strip()
+
+    def index(self):
+        """Return the byte offsets of all data lines (built once, then cached)."""
+        if self._offsets is not None:
+            return self._offsets
+        offsets = array('q')
+        data = self._data
+        find = data.find
+        size = self.size
+        pos = 0
+        while pos < size:
+            newline = find(b'\n', pos)
+            stop = size if newline < 0 else newline + 1
+            first = pos
+            # Skip leading whitespace the same way lines() strips it
+            while first < stop and data[first:first + 1].isspace():
+                first += 1
+            if first < stop and data[first:first + 2] != b'--':
+                offsets.append(pos)
+            pos = stop
+        self._offsets = offsets
+        return offsets
+
+    def __len__(self):
+        """Number of data lines (builds the index)."""
+        return len(self.index())
+
+    def row_offset(self, row):
+        """Byte offset of the row-th data line."""
+        return self.index()[row]
+
+    def shard_ranges(self, count):
+        """Split the file into at most count line-aligned byte ranges.
+
+        Ranges hold (nearly) equal numbers of data lines; comment lines fall
+        into whichever range surrounds them and are skipped by lines().
+
+        Returns:
+            List of (start, end) byte offsets covering the whole file
+        """
+        offsets = self.index()
+        rows = len(offsets)
+        count = max(1, min(count, rows))
+        if rows == 0:
+            return [(0, self.size)]
+        ranges = []
+        for shard in range(count):
+            first = rows * shard // count
+            last = rows * (shard + 1) // count
+            start = 0 if shard == 0 else offsets[first]
+            end = self.size if last >= rows else offsets[last]
+            ranges.append((start, end))
+        return ranges
@@ -0,0 +1,201 @@
+"""
+Bounded rejection sink for skipped and failed rows
+
+RejectSink writes rejected rows to a capped per-table TSV file, counts them
+by error class and logs a sample instead of every row.
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS = 100000
+
+# Rejections logged individually per table and error class
+DEFAULT_LOG_FIRST = 5
+
+# Seconds between sampled log lines per table after that
+DEFAULT_LOG_INTERVAL = 30.0
+
+# Rows whose offsets are remembered until the database accepts or rejects
+# them; must cover the largest in-flight batch
+DEFAULT_EXPECT_WINDOW = 10000
+
+_MESSAGE_CHARS = 300
+_LINE_CHARS = 1000
+
+# PostgreSQL error text -> condition name, for errors that only arrive as
+# text (psql stderr) or as generic driver exceptions
+_ERROR_PATTERNS = (
+    ('duplicate key value', 'unique_violation'),
+    ('violates foreign key constraint', 'foreign_key_violation'),
+    ('violates not-null constraint', 'not_null_violation'),
+    ('violates check constraint', 'check_violation'),
+    ('value too long', 'string_data_right_truncation'),
+    ('invalid input syntax', 'invalid_text_representation'),
+    ('out of range', 'numeric_value_out_of_range'),
+)
+
+
+def error_class(error):
+    """Short class name for an error (exception or string)."""
+    if isinstance(error, str):
+        return error
+    message = str(error).lower()
+    for pattern, name in _ERROR_PATTERNS:
+        if pattern in message:
+            return name
+    return type(error).__name__
+
+
+def _field(value, limit):
+    text = '' if value is None else str(value)
+    if len(text) > limit:
+        text = text[:limit] + '...'
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class TableRejects(object):
+    """Rejections of one table."""
+
+    def __init__(self, sink, progress, name=None):
+        self.sink = sink
+        self.progress = progress
+        self.key = progress.key
+        self.name = name or progress.key
+        self.path = None
+        self.written = 0
+        self.counts = {}
+        self._stream = None
+        self._expected = OrderedDict()
+        self._unlogged = 0
+        self._next_log = 0.0
+        self._finished = False
+
+    def expect(self, key, offset=None, line=None):
+        """Remember where a queued row came from, in case the database rejects it."""
+        expected = self._expected
+        expected[key] = (offset, line)
+        if len(expected) > self.sink.expect_window:
+            expected.popitem(last=False)
+
+    def reject(self, key, error, offset=None, line=None):
+        """Record one rejected row.
+
+        Args:
+            key: Row identifier (usually the legacy id)
+            error: Exception or error class name (e.g. 'missing_parent')
+            offset: Source offset; defaults to the one given to expect()
+            line: Source line (str, bytes or a callable returning one, called
+                only if the row is written out); defaults to the one given
+                to expect()
+        """
+        expected = self._expected.pop(key, None)
+        if expected is not None:
+            offset = expected[0] if offset is None else offset
+            line = expected[1] if line is None else line
+        kind = error_class(error)
+        self.progress.error(kind)
+        count = self.counts[kind] = self.counts.get(kind, 0) + 1
+        self._write(offset, key, kind, error, line)
+        self._log(key, kind, count, error)
+
+    def _write(self, offset, key, kind, error, line):
+        sink = self.sink
+        if sink.directory is None or self.written >= sink.max_rows:
+            return
+        if self._stream is None:
+            self.path = os.path.join(sink.directory, '{}.rejects.tsv'.format(self.name))
+            self._stream = open(self.path, 'w', encoding='utf-8')
+            self._stream.write('# offset\tkey\terror\tmessage\tline\n')
+        if callable(line):
+            line = line()
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        self._stream.write('\t'.join((
+            _field(offset, 20), _field(key, 100), kind,
+            _field('' if isinstance(error, str) else error, _MESSAGE_CHARS),
+            _field(line, _LINE_CHARS),
+        )) + '\n')
+        self.written += 1
+        if self.written == sink.max_rows:
+            logger.warning("{}: rejects file {} reached {} rows; further rejects are only counted".format(
+                self.key, self.path, sink.max_rows))
+
+    def _log(self, key, kind, count, error):
+        if count <= self.sink.log_first:
+            if isinstance(error, str):
+                logger.warning("{}: rejected {} ({})".format(self.key, key, kind))
+            else:
+                logger.warning("{}: rejected {} ({}): {}".format(self.key, key, kind, _field(error, _MESSAGE_CHARS)))
+            return
+        self._unlogged += 1
+        now = time.time()
+        if now >= self._next_log:
+            self._next_log = now + self.sink.log_interval
+            logger.warning("{}: {} more rows rejected ({})".format(self.key, self._unlogged, self._summary()))
+            self._unlogged = 0
+
+    def _summary(self):
+        return ', '.join('{}: {}'.format(kind, count) for kind, count in sorted(self.counts.items()))
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def finish(self):
+        """Close the rejects file and log the per-class totals."""
+        if self._finished:
+            return
+        self._finished = True
+        self._expected.clear()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self.counts:
+            logger.warning("{}: {} rows rejected ({}){}".format(
+                self.key, self.total(), self._summary(),
+                '; details in {}'.format(self.path) if self.path else ''))
+
+
+class RejectSink(object):
+    """Creates TableRejects for the tables of one run."""
+
+    def __init__(self, directory=None, max_rows=DEFAULT_MAX_ROWS, log_first=DEFAULT_LOG_FIRST,
+                 log_interval=DEFAULT_LOG_INTERVAL, expect_window=DEFAULT_EXPECT_WINDOW):
+        """Initialize sink
+
+        Args:
+            directory: Directory for the per-table rejects files (None: only
+                count and log)
+            max_rows: Rows written per rejects file
+            log_first: Rejections logged individually per table and class
+            log_interval: Seconds between sampled log lines per table
+            expect_window: Queued rows whose offsets are remembered
+        """
+        self.directory = directory
+        self.max_rows = max_rows
+        self.log_first = log_first
+        self.log_interval = log_interval
+        self.expect_window = expect_window
+        self.tables = []
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def table(self, progress, name=None):
+        """Start collecting rejects for the table tracked by progress.
+
+        Args:
+            progress: TableProgress of the table
+            name: Rejects file name stem (default: the table key); shard
+                workers pass a per-shard name so their files do not collide
+        """
+        rejects = TableRejects(self, progress, name)
+        self.tables.append(rejects)
+        return rejects
+
+    def close(self):
+        for rejects in self.tables:
+            rejects.finish()
@@ -0,0 +1,188 @@
+"""
+Target schema from prisma/schema.prisma
+
+load_schema() reads the content service's Prisma models, so the engine can
+check the table specs against them and type prepared statements. Only the
+subset of the Prisma language used by schema.prisma is understood.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+DEFAULT_SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'prisma', 'schema.prisma')
+
+# Prisma scalar type -> PostgreSQL type (without a @db.* native type)
+SCALAR_TYPES = {
+    'Int': 'integer',
+    'BigInt': 'bigint',
+    'Float': 'double precision',
+    'Decimal': 'numeric(65,30)',
+    'String': 'text',
+    'Boolean': 'boolean',
+    'DateTime': 'timestamp(3)',
+    'Json': 'jsonb',
+    'Bytes': 'bytea',
+}
+
+# @db.<name>(args) -> PostgreSQL type
+_NATIVE_TYPES = {
+    'VarChar': 'varchar',
+    'Char': 'char',
+    'Text': 'text',
+    'Integer': 'integer',
+    'SmallInt': 'smallint',
+    'BigInt': 'bigint',
+    'Timestamp': 'timestamp',
+    'Uuid': 'uuid',
+}
+
+_MODEL_RE = re.compile(r'^model\s+(\w+)\s*\{(.*?)^\}', re.MULTILINE | re.DOTALL)
+_FIELD_RE = re.compile(r'^(\w+)\s+(\w+)(\[\])?(\?)?\s*(.*)$')
+_NATIVE_RE = re.compile(r'@db\.(\w+)(?:\(([^)]*)\))?')
+_RELATION_FIELDS_RE = re.compile(r'@relation\([^)]*fields:\s*\[([^\]]*)\]')
+_BLOCK_RE = re.compile(r'^@@(unique|index)\(\s*\[([^\]]*)\]')
+
+
+def _names(text):
+    return tuple(name.strip() for name in text.split(',') if name.strip())
+
+
+class PrismaField(object):
+    """One field of a Prisma model."""
+
+    def __init__(self, name, type_name, optional=False, is_list=False, attributes=''):
+        self.name = name
+        self.type_name = type_name
+        self.optional = optional
+        self.is_list = is_list
+        self.attributes = attributes
+
+    @property
+    def is_scalar(self):
+        return self.type_name in SCALAR_TYPES and not self.is_list
+
+    @property
+    def is_id(self):
+        return '@id' in self.attributes
+
+    @property
+    def has_default(self):
+        return '@default(' in self.attributes or '@updatedAt' in self.attributes
+
+    @property
+    def required(self):
+        """Whether an INSERT must supply a value."""
+        return self.is_scalar and not self.optional and not self.has_default and not self.is_id
+
+    @property
+    def db_type(self):
+        """PostgreSQL type of the column."""
+        match = _NATIVE_RE.search(self.attributes)
+        if match and match.group(1) in _NATIVE_TYPES:
+            db_type = _NATIVE_TYPES[match.group(1)]
+            if match.group(2):
+                db_type += '({})'.format(match.group(2).replace(' ', ''))
+            return db_type
+        return SCALAR_TYPES.get(self.type_name)
+
+
+class PrismaModel(object):
+    """A Prisma model: its fields, foreign keys and unique keys."""
+
+    def __init__(self, name):
+        self.name = name
+        self.fields = OrderedDict()
+        # Foreign key column -> referenced model
+        self.foreign_keys = {}
+        # Column tuples with a unique index (single-column @unique included)
+        self.unique = []
+        self.indexes = []
+
+    @property
+    def columns(self):
+        return [field.name for field in self.fields.values() if field.is_scalar]
+
+    def field(self, name):
+        return self.fields.get(name)
+
+
+def parse_schema(text):
+    """Parse the models of a Prisma schema.
+
+    Returns:
+        OrderedDict of model name -> PrismaModel
+    """
+    models = OrderedDict()
+    for match in _MODEL_RE.finditer(text):
+        model = PrismaModel(match.group(1))
+        for line in match.group(2).splitlines():
+            line = line.split('//', 1)[0].strip()
+            if not line:
+                continue
+            block = _BLOCK_RE.match(line)
+            if block:
+                (model.unique if block.group(1) == 'unique' else model.indexes).append(_names(block.group(2)))
+                continue
+            field_match = _FIELD_RE.match(line)
+            if field_match is None:
+                continue
+            name, type_name, is_list, optional, attributes = field_match.groups()
+            field = PrismaField(name, type_name, bool(optional), bool(is_list), attributes)
+            model.fields[name] = field
+            if '@unique' in attributes:
+                model.unique.append((name,))
+            relation = _RELATION_FIELDS_RE.search(attributes)
+            if relation:
+                for column in _names(relation.group(1)):
+                    model.foreign_keys[column] = type_name
+        models[model.name] = model
+    return models
+
+
+def load_schema(path=DEFAULT_SCHEMA_PATH):
+    """Parse the Prisma schema file at path (see parse_schema)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_schema(f.read())
+
+
+def check_tables(models, tables):
+    """Check TableSpecs against the Prisma models.
+
+    Args:
+        models: Result of load_schema()
+        tables: TableSpecs to check
+
+    Returns:
+        List of problem descriptions (empty if the specs match the schema)
+    """
+    problems = []
+    targets = dict((spec.key, spec.target) for spec in tables)
+    for spec in tables:
+        model = models.get(spec.target)
+        if model is None:
+            problems.append("{}: no model {} in the schema".format(spec.key, spec.target))
+            continue
+        for column in spec.columns:
+            field = model.field(column)
+            if field is None or not field.is_scalar:
+                problems.append("{}: {} has no column {}".format(spec.key, spec.target, column))
+        for field in model.fields.values():
+            if field.required and field.name not in spec.columns:
+                problems.append("{}: required column {}.{} is not migrated".format(
+                    spec.key, spec.target, field.name))
+        for column, parent_key in spec.foreign_keys.items():
+            referenced = model.foreign_keys.get(column)
+            if referenced is None:
+                problems.append("{}: {}.{} is not a foreign key".format(spec.key, spec.target, column))
+            elif parent_key in targets and targets[parent_key] != referenced:
+                problems.append("{}: {}.{} references {}, not {} ({})".format(
+                    spec.key, spec.target, column, referenced, targets[parent_key], parent_key))
+    return problems
+
+
+def column_types(models, spec):
+    """PostgreSQL types of spec.columns, in INSERT parameter order."""
+    model = models[spec.target]
+    return [model.field(column).db_type for column in spec.columns]
@@ -0,0 +1,189 @@
+"""
+Shadow-schema load with an atomic swap
+
+ShadowSchema builds the content tables in content_shadow, finishes their
+indexes and foreign keys after the load, and swaps them with the live
+tables in one transaction. The old tables stay in content_previous.
+"""
+
+import os
+import re
+import glob
+import time
+import logging
+from urllib.parse import quote
+
+from .bulkload import DEFAULT_REBUILD_WORKERS, _quote_literal, quote_ident, run_parallel
+from .importbatch import move_schemas_sql
+from .schema import DEFAULT_SCHEMA_PATH
+from .tables import TABLES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIGRATIONS_DIR = os.path.join(os.path.dirname(DEFAULT_SCHEMA_PATH), 'migrations')
+
+SHADOW_SCHEMA = 'content_shadow'
+PREVIOUS_SCHEMA = 'content_previous'
+LIVE_SCHEMA = 'public'
+
+DEFAULT_LOCK_TIMEOUT = '5s'
+DEFAULT_SWAP_ATTEMPTS = 5
+
+_FOREIGN_KEY_RE = re.compile(r'ALTER TABLE ("(?:[^"]|"")+") ADD CONSTRAINT ("(?:[^"]|"")+") FOREIGN KEY')
+
+
+def migration_statements(directory=DEFAULT_MIGRATIONS_DIR):
+    """SQL statements of the Prisma migrations in directory, in migration order."""
+    statements = []
+    for path in sorted(glob.glob(os.path.join(directory, '*', 'migration.sql'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            text = '\n'.join(line for line in f.read().splitlines() if not line.lstrip().startswith('--'))
+        statements.extend(statement.strip() for statement in re.split(r';\s*\n', text + '\n')
+                          if statement.strip())
+    if not statements:
+        raise ValueError("No Prisma migrations found in {}".format(directory))
+    return statements
+
+
+def shadow_url(database_url, schema=SHADOW_SCHEMA):
+    """database_url with the session's search_path set to schema (libpq options)."""
+    option = quote('-c search_path={}'.format(schema))
+    if re.search(r'[?&]options=', database_url):
+        return re.sub(r'([?&]options=)([^&]*)', lambda m: '{}{}%20{}'.format(m.group(1), m.group(2), option),
+                      database_url, count=1)
+    return '{}{}options={}'.format(database_url, '&' if '?' in database_url else '?', option)
+
+
+class ShadowSchema(object):
+    """Build the content tables in a shadow schema and swap them in."""
+
+    def __init__(self, query, execute, statements, tables=TABLES, workers=DEFAULT_REBUILD_WORKERS,
+                 lock_timeout=DEFAULT_LOCK_TIMEOUT, attempts=DEFAULT_SWAP_ATTEMPTS):
+        """Initialize shadow schema
+
+        Args:
+            query: Callable running a SELECT and returning its single value
+                (see bulkload.psycopg2_runners / psql_runners)
+            execute: Callable running SQL in its own autocommit session;
+                called from several threads at once
+            statements: Prisma migration statements (migration_statements())
+            tables: TableSpecs of the content tables
+            workers: Parallel sessions for the index builds and FK checks
+            lock_timeout: How long the swap waits for the live tables' locks
+            attempts: Swap attempts before giving up
+        """
+        self.query = query
+        self.execute = execute
+        self.tables = [spec.target for spec in tables]
+        self.workers = max(1, workers)
+        self.lock_timeout = lock_timeout
+        self.attempts = max(1, attempts)
+        self.create_statements = []
+        self.index_statements = []
+        self.foreign_keys = []
+        for statement in statements:
+            match = _FOREIGN_KEY_RE.match(statement)
+            if match:
+                self.foreign_keys.append((match.group(1), match.group(2), statement))
+            elif statement.startswith('CREATE INDEX '):
+                self.index_statements.append(statement)
+            else:
+                self.create_statements.append(statement)
+
+    def _in_shadow(self, statement):
+        return 'SET search_path TO {}; {}'.format(quote_ident(SHADOW_SCHEMA), statement)
+
+    def create(self):
+        """(Re)create the shadow schema with unlogged tables, primary keys and unique indexes."""
+        logger.info("Shadow load: creating schema {}".format(SHADOW_SCHEMA))
+        # Import batches recorded for the dropped shadow tables go with them
+        self.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; {1}'.format(
+            quote_ident(SHADOW_SCHEMA), move_schemas_sql([(SHADOW_SCHEMA, None)])))
+        for statement in self.create_statements:
+            self.execute(self._in_shadow(re.sub(r'^CREATE TABLE ', 'CREATE UNLOGGED TABLE ', statement)))
+
+    def counts(self, schema):
+        """Dict of table -> row count in schema."""
+        counts = {}
+        for table in self.tables:
+            counts[table] = int(self.query('SELECT count(*) FROM {}.{}'.format(
+                quote_ident(schema), quote_ident(table))))
+        return counts
+
+    def finish(self, expected):
+        """Validate the load, then make the tables logged and build the deferred indexes and FKs.
+
+        Args:
+            expected: Dict of table -> rows the import reported as written
+
+        Raises:
+            ValueError: If a table's row count differs from expected
+            RuntimeError: If an index or foreign key cannot be built
+        """
+        counts = self.counts(SHADOW_SCHEMA)
+        problems = ['{}: {} rows, {} imported'.format(table, counts[table], rows)
+                    for table, rows in sorted(expected.items()) if counts.get(table) != rows]
+        if problems:
+            raise ValueError("Shadow load does not match the import:\n  {}".format('\n  '.join(problems)))
+
+        logger.info("Shadow load: making {} tables logged".format(len(self.tables)))
+        failures = run_parallel(self.execute, [
+            'ALTER TABLE {}.{} SET LOGGED'.format(quote_ident(SHADOW_SCHEMA), quote_ident(table))
+            for table in self.tables], self.workers, 'Shadow load')
+        logger.info("Shadow load: building {} indexes on {} sessions".format(
+            len(self.index_statements), self.workers))
+        failures.extend(run_parallel(self.execute, [self._in_shadow(statement)
+                                                    for statement in self.index_statements],
+                                     self.workers, 'Shadow load'))
+        if failures:
+            raise RuntimeError("Shadow load: {} statements failed".format(len(failures)))
+
+        # Adding a foreign key locks both tables, so they are added one at a time
+        # and validated (the table scans) in parallel
+        for _, _, statement in self.foreign_keys:
+            self.execute(self._in_shadow('{} NOT VALID'.format(statement)))
+        logger.info("Shadow load: validating {} foreign keys".format(len(self.foreign_keys)))
+        failures = run_parallel(self.execute, [
+            self._in_shadow('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(table, name))
+            for table, name, _ in self.foreign_keys], self.workers, 'Shadow load')
+        failures.extend(run_parallel(self.execute, [
+            'ANALYZE {}.{}'.format(quote_ident(SHADOW_SCHEMA), quote_ident(table))
+            for table in self.tables], self.workers, 'Shadow load'))
+        if failures:
+            raise RuntimeError("Shadow load: {} statements failed".format(len(failures)))
+        return counts
+
+    def swap(self):
+        """Move the live tables to the previous schema and the shadow tables live, atomically.
+
+        Raises:
+            RuntimeError: If the live tables' locks cannot be taken within
+                lock_timeout after every attempt
+        """
+        statements = [
+            'BEGIN',
+            'SET LOCAL lock_timeout = {}'.format(_quote_literal(self.lock_timeout)),
+            'DROP SCHEMA IF EXISTS {} CASCADE'.format(quote_ident(PREVIOUS_SCHEMA)),
+            'CREATE SCHEMA {}'.format(quote_ident(PREVIOUS_SCHEMA)),
+        ]
+        statements.extend('ALTER TABLE {}.{} SET SCHEMA {}'.format(
+            quote_ident(LIVE_SCHEMA), quote_ident(table), quote_ident(PREVIOUS_SCHEMA)) for table in self.tables)
+        statements.extend('ALTER TABLE {}.{} SET SCHEMA {}'.format(
+            quote_ident(SHADOW_SCHEMA), quote_ident(table), quote_ident(LIVE_SCHEMA)) for table in self.tables)
+        # Recorded import batches follow their tables, so --rollback deletes from the right schema
+        statements.append(move_schemas_sql([(PREVIOUS_SCHEMA, None), (LIVE_SCHEMA, PREVIOUS_SCHEMA),
+                                            (SHADOW_SCHEMA, LIVE_SCHEMA)]))
+        statements.append('COMMIT')
+        script = '; '.join(statements)
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.execute(script)
+                break
+            except Exception as e:
+                if attempt == self.attempts:
+                    raise RuntimeError("Shadow load: swap failed after {} attempts: {}".format(attempt, e))
+                logger.warning("Shadow load: swap attempt {} failed ({}); retrying".format(attempt, e))
+                time.sleep(attempt)
+        logger.info("Shadow load: swapped {} tables into {}; previous tables kept in {}".format(
+            len(self.tables), LIVE_SCHEMA, PREVIOUS_SCHEMA))
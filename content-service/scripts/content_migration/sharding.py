@@ -0,0 +1,93 @@
+"""
+Multiprocess, byte-range sharded import of one export file
+
+run_sharded() hands line-aligned byte ranges of an export file to forked
+worker processes and yields a ShardResult per range.
+"""
+
+import logging
+import multiprocessing
+from array import array
+
+from .progress import ProgressReporter
+from .reader import ExportFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 1
+
+# More shards than workers keeps the pool busy when shards run unevenly and
+# lets the coordinator report progress while the import runs
+SHARDS_PER_WORKER = 4
+
+# Task and context inherited by the forked workers (set by the pool initializer)
+_worker_task = None
+_worker_context = None
+
+
+class ShardResult(object):
+    """Outcome of one shard, sent from a worker back to the coordinator."""
+
+    def __init__(self, start, end, counters, keys=None, values=None, succeeded=0, failed=0, skipped=0):
+        self.start = start
+        self.end = end
+        self.counters = counters
+        self.keys = keys if keys is not None else array('q')
+        self.values = values if values is not None else array('q')
+        self.succeeded = succeeded
+        self.failed = failed
+        self.skipped = skipped
+
+
+def shard_progress(key):
+    """Local TableProgress for a worker; its counters() go back in the ShardResult."""
+    return ProgressReporter(source='shard').table(key)
+
+
+def _init_worker(task, context):
+    global _worker_task, _worker_context
+    _worker_task = task
+    _worker_context = context
+
+
+def _run_shard(job):
+    path, start, end = job
+    return _worker_task(_worker_context, path, start, end)
+
+
+def run_sharded(path, task, context, workers, progress=None, shards_per_worker=SHARDS_PER_WORKER):
+    """Import path in byte-range shards on a pool of worker processes.
+
+    Args:
+        path: Export file to import
+        task: Function task(context, path, start, end) that imports the
+            data lines in [start, end) and returns a ShardResult
+        context: Object passed to every task call; task and context are
+            inherited by the forked workers, not pickled
+        workers: Number of worker processes
+        progress: Optional TableProgress that shard counters are merged into
+        shards_per_worker: Shards handed out per worker
+
+    Yields:
+        ShardResult per shard, in completion order
+
+    Raises:
+        Whatever a task raised; the remaining workers are terminated.
+    """
+    with ExportFile(path) as export:
+        ranges = export.shard_ranges(workers * shards_per_worker)
+    logger.info("Importing {} in {} shards on {} workers".format(path, len(ranges), workers))
+
+    pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker, initargs=(task, context))
+    try:
+        jobs = [(path, start, end) for start, end in ranges]
+        for result in pool.imap_unordered(_run_shard, jobs):
+            if progress is not None:
+                progress.merge(result.counters)
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,210 @@
+"""
+Synthetic storagebox export files for benchmarking the importers
+
+generate_dataset() writes reproducible export files scaled by the number
+of words, with quotes, commas, Cyrillic text, NULLs and duplicate words.
+"""
+
+import os
+import random
+import logging
+from datetime import datetime
+
+from .export import ExportWriter
+from .tables import TABLES
+
+logger = logging.getLogger(__name__)
+
+SCALES = {'10k': 10000, '1M': 1000000, '10M': 10000000}
+
+DEFAULT_SEED = 20260127
+
+# Fraction of words repeating an earlier (word, language, translation)
+DEFAULT_DUPLICATE_RATE = 0.005
+
+# Fraction of nullable values exported as NULL
+NULL_RATE = 0.2
+
+LANGUAGES = 20
+GRAMMAR_LESSONS_PER_COURSE = 40
+PHONETICS_LESSONS_PER_COURSE = 30
+SONGS_LESSONS_PER_COURSE = 25
+WORDS_PER_THEME = 250
+RELATIONS_PER_WORD = 1.5
+
+_LATIN = ('time', 'person', 'year', 'way', 'day', 'thing', 'world', 'life', 'hand', 'part',
+          'child', 'eye', 'woman', 'place', 'work', 'week', 'case', 'point', 'number', 'group')
+_CYRILLIC = ('время', 'человек', 'год', 'путь', 'день', 'вещь', 'мир', 'жизнь', 'рука', 'часть',
+             'ребёнок', 'глаз', 'женщина', 'место', 'работа', 'неделя', 'случай', 'точка', 'число', 'группа')
+_TRANSCRIPTIONS = ('[taɪm]', '[ˈpɜːsn]', '[jɪə]', '[weɪ]', '[deɪ]', '[θɪŋ]', '[wɜːld]', '[laɪf]')
+_LANGUAGE_CODES = ('en', 'de', 'fr', 'es', 'it', 'pt', 'nl', 'sv', 'no', 'da',
+                   'fi', 'pl', 'cs', 'sk', 'hu', 'ro', 'bg', 'el', 'tr', 'zh')
+
+
+def parse_scale(value):
+    """Number of words for a scale name ('10k', '1M', '10M') or a plain integer."""
+    if value in SCALES:
+        return SCALES[value]
+    return int(value)
+
+
+class _Text(object):
+    """Seeded generator of the text values in a dataset."""
+
+    def __init__(self, rng, commas=True):
+        self.rng = rng
+        self.commas = commas
+
+    def word(self, cyrillic=False):
+        return self.rng.choice(_CYRILLIC if cyrillic else _LATIN)
+
+    def phrase(self, words=3, cyrillic=None):
+        rng = self.rng
+        parts = [self.word(rng.random() < 0.5 if cyrillic is None else cyrillic) for _ in range(words)]
+        roll = rng.random()
+        if roll < 0.05:
+            # Apostrophes are exported as ''
+            parts[0] = "it's " + parts[0]
+        elif roll < 0.10 and self.commas:
+            parts[-1] = parts[-1] + ', ' + self.word(True)
+        elif roll < 0.12:
+            parts[0] = "l'" + parts[0]
+        return ' '.join(parts)
+
+    def nullable(self, value):
+        return None if self.rng.random() < NULL_RATE else value
+
+
+def _rows_languages(text):
+    for i in range(LANGUAGES):
+        code = _LANGUAGE_CODES[i]
+        yield (i + 1, code, 'language_{}'.format(code), text.phrase(2), text.nullable('flags/{}.png'.format(code)),
+               i, text.nullable(text.phrase(1, cyrillic=True)))
+
+
+def _rows_courses(text, id_offset):
+    for i in range(LANGUAGES):
+        yield (id_offset + i + 1, text.phrase(3), text.rng.choice(('ru', 'en')), text.nullable(text.phrase(4)),
+               text.nullable(text.phrase(8)), i + 1)
+
+
+def _rows_songs_courses(text, id_offset):
+    for i in range(LANGUAGES):
+        yield (id_offset + i + 1, text.phrase(3), text.rng.choice(('ru', 'en')), i + 1)
+
+
+def _rows_grammar_lessons(text, course_offset):
+    lesson_id = 0
+    for course in range(LANGUAGES):
+        for order in range(GRAMMAR_LESSONS_PER_COURSE):
+            lesson_id += 1
+            yield (lesson_id, text.phrase(4), course_offset + course + 1, 'grammar/lesson.html',
+                   text.nullable('lesson-{}'.format(lesson_id)), '/grammar/{}/'.format(lesson_id),
+                   text.nullable(text.phrase(1)), text.nullable(text.phrase(12)), order,
+                   text.nullable(text.phrase(4)), text.nullable(text.phrase(8)))
+
+
+def _rows_phonetics_lessons(text, course_offset):
+    lesson_id = 0
+    for course in range(LANGUAGES):
+        for order in range(PHONETICS_LESSONS_PER_COURSE):
+            lesson_id += 1
+            yield (lesson_id, text.phrase(3), course_offset + course + 1, order,
+                   text.nullable(text.phrase(4)), text.nullable(text.phrase(8)))
+
+
+def _rows_songs_lessons(text, course_offset):
+    lesson_id = 0
+    for course in range(LANGUAGES):
+        for order in range(SONGS_LESSONS_PER_COURSE):
+            lesson_id += 1
+            yield (lesson_id, text.phrase(3), course_offset + course + 1, order)
+
+
+def _rows_words(text, words, duplicate_rate):
+    rng = text.rng
+    recent = []
+    for word_id in range(1, words + 1):
+        if recent and rng.random() < duplicate_rate:
+            word, translation, language_id = rng.choice(recent)
+        else:
+            language_id = rng.randint(1, LANGUAGES)
+            # The id suffix keeps generated words unique unless duplicated on purpose
+            word = '{} {}'.format(text.phrase(rng.randint(1, 2), cyrillic=False), word_id)
+            translation = text.nullable(text.phrase(rng.randint(1, 3), cyrillic=True))
+            if len(recent) < 1000:
+                recent.append((word, translation, language_id))
+            else:
+                recent[rng.randrange(1000)] = (word, translation, language_id)
+        yield (word_id, word, text.nullable(rng.choice(_TRANSCRIPTIONS)), translation, language_id)
+
+
+def _rows_word_themes(text, themes):
+    for theme_id in range(1, themes + 1):
+        yield (theme_id, text.phrase(2), text.nullable('dictionary.themes.Theme{}'.format(theme_id % 7)), theme_id)
+
+
+def _rows_word_theme_relations(text, relations, words, themes):
+    rng = text.rng
+    for relation_id in range(1, relations + 1):
+        yield (relation_id, rng.randint(1, words), rng.randint(1, themes), relation_id % 50)
+
+
+def dataset_counts(words):
+    """Rows per table key for a dataset of the given number of words."""
+    themes = max(10, words // WORDS_PER_THEME)
+    return {
+        'languages': LANGUAGES,
+        'grammar_courses': LANGUAGES,
+        'phonetics_courses': LANGUAGES,
+        'songs_courses': LANGUAGES,
+        'grammar_lessons': LANGUAGES * GRAMMAR_LESSONS_PER_COURSE,
+        'phonetics_lessons': LANGUAGES * PHONETICS_LESSONS_PER_COURSE,
+        'songs_lessons': LANGUAGES * SONGS_LESSONS_PER_COURSE,
+        'words': words,
+        'word_themes': themes,
+        'word_theme_relations': int(words * RELATIONS_PER_WORD),
+    }
+
+
+def generate_dataset(directory, words, seed=DEFAULT_SEED, commas=True, duplicate_rate=DEFAULT_DUPLICATE_RATE):
+    """Write a synthetic export of every content table into directory.
+
+    Args:
+        directory: Output directory (created if missing), laid out like
+            <storagebox>/content-migration
+        words: Number of Word rows; the other tables scale with it
+        seed: Random seed; the same arguments give the same files
+        commas: Include commas inside quoted values
+        duplicate_rate: Fraction of words duplicating an earlier word
+
+    Returns:
+        Dict of table key -> rows written
+    """
+    os.makedirs(directory, exist_ok=True)
+    text = _Text(random.Random(seed), commas=commas)
+    counts = dataset_counts(words)
+    # Course ids are offset per type so a course id mix-up shows up as a missing parent
+    rows = {
+        'languages': lambda: _rows_languages(text),
+        'grammar_courses': lambda: _rows_courses(text, 0),
+        'phonetics_courses': lambda: _rows_courses(text, 100),
+        'songs_courses': lambda: _rows_songs_courses(text, 200),
+        'grammar_lessons': lambda: _rows_grammar_lessons(text, 0),
+        'phonetics_lessons': lambda: _rows_phonetics_lessons(text, 100),
+        'songs_lessons': lambda: _rows_songs_lessons(text, 200),
+        'words': lambda: _rows_words(text, words, duplicate_rate),
+        'word_themes': lambda: _rows_word_themes(text, counts['word_themes']),
+        'word_theme_relations': lambda: _rows_word_theme_relations(
+            text, counts['word_theme_relations'], words, counts['word_themes']),
+    }
+
+    written = {}
+    for spec in TABLES:
+        path = os.path.join(directory, spec.filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("-- {} synthetic export ({} words, seed {})\n".format(spec.key, words, seed))
+            f.write("-- Generated: {}\n\n".format(datetime.now().isoformat()))
+            written[spec.key] = ExportWriter(f, chunk_rows=10000).write_all(rows[spec.key]())
+        logger.info("Generated {} {} rows in {}".format(written[spec.key], spec.key, path))
+    return written
@@ -0,0 +1,400 @@
+"""
+Content table specifications
+
+Export fields, target table and columns, and row normalization of the ten
+content tables.
+"""
+
+DEFAULT_SPEAKER = 'носитель'
+DEFAULT_MATERIAL_LANGUAGE = 'ru'
+
+
+class TableSpec(object):
+    """Mapping of one legacy content table onto its Prisma counterpart."""
+
+    def __init__(self, key, target, export_fields, columns, transform,
+                 foreign_keys=None, returns_id=False, legacy_table=None, unique=None):
+        """Initialize table spec
+
+        Args:
+            key: Table key used in stats and export file names (e.g. 'words')
+            target: Prisma table name (e.g. 'Word')
+            export_fields: Legacy field names in export file column order
+            columns: Target column names in INSERT parameter order
+            transform: Callable turning an exported row into INSERT parameters
+            foreign_keys: Dict of target column -> parent table key
+            returns_id: Whether importers need the new id (legacy -> new map)
+            legacy_table: Legacy database table (Django db_table) for
+                reading without the ORM
+            unique: Target columns of the table's unique key (@@unique);
+                rows repeating a key are dropped before the import
+        """
+        self.key = key
+        self.target = target
+        self.export_fields = export_fields
+        self.columns = columns
+        self.transform = transform
+        self.foreign_keys = foreign_keys or {}
+        self.returns_id = returns_id
+        self.legacy_table = legacy_table
+        self.unique = unique
+
+    @property
+    def filename(self):
+        return '{}.sql'.format(self.key)
+
+    def insert_sql(self, returning=None, numbered=False):
+        """Build a parameterized INSERT statement.
+
+        Args:
+            returning: Append RETURNING id (default: returns_id)
+            numbered: Use $1..$n placeholders (PREPARE) instead of psycopg2's %s
+        """
+        if returning is None:
+            returning = self.returns_id
+        if numbered:
+            placeholders = ['${}'.format(position) for position in range(1, len(self.columns) + 1)]
+        else:
+            placeholders = ['%s'] * len(self.columns)
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            self.target,
+            ', '.join('"{}"'.format(column) for column in self.columns),
+            ', '.join(placeholders)
+        )
+        if returning:
+            sql += ' RETURNING id'
+        return sql
+
+    def unique_key(self, params):
+        """Values of the unique key's columns in INSERT parameters."""
+        return tuple(params[self.columns.index(column)] for column in self.unique)
+
+    def resolve(self, params, id_mappings):
+        """Replace legacy foreign key ids in params with new ids.
+
+        Returns:
+            Resolved parameter tuple, or None if a parent id is not mapped
+        """
+        if not self.foreign_keys:
+            return params
+        resolved = list(params)
+        for column, parent_key in self.foreign_keys.items():
+            position = self.columns.index(column)
+            new_id = id_mappings.get(parent_key, {}).get(resolved[position])
+            if new_id is None:
+                return None
+            resolved[position] = new_id
+        return tuple(resolved)
+
+
+def _int_or(value, default):
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def _language_params(row):
+    return (
+        row[1],
+        row[2],
+        row[3],
+        row[4] or '',
+        _int_or(row[5], 0),
+        row[6] if len(row) > 6 and row[6] else DEFAULT_SPEAKER,
+    )
+
+
+def _course_params(row):
+    return (
+        row[1],
+        row[2] or DEFAULT_MATERIAL_LANGUAGE,
+        row[3] or None,
+        row[4] or None,
+        int(row[5]),
+    )
+
+
+def _grammar_lesson_params(row):
+    return (
+        row[1],
+        int(row[2]),
+        row[3],
+        row[4] or None,
+        row[5],
+        row[6] or None,
+        row[7] or None,
+        _int_or(row[8], 0),
+        row[9] or None,
+        row[10] or None,
+    )
+
+
+def _phonetics_lesson_params(row):
+    return (
+        row[1],
+        int(row[2]),
+        int(row[3]),
+        row[4] or None,
+        row[5] or None,
+    )
+
+
+def _songs_course_params(row):
+    return (
+        row[1],
+        row[2] or DEFAULT_MATERIAL_LANGUAGE,
+        int(row[3]),
+    )
+
+
+def _songs_lesson_params(row):
+    return (
+        row[1],
+        int(row[2]),
+        int(row[3]),
+    )
+
+
+def _word_params(row):
+    return (
+        row[1],
+        row[2] or None,
+        row[3] or None,
+        int(row[4]),
+    )
+
+
+def _word_theme_params(row):
+    return (
+        row[1],
+        row[2] or '',
+        _int_or(row[3], 0),
+    )
+
+
+def _word_theme_relation_params(row):
+    return (
+        int(row[1]),
+        int(row[2]),
+        _int_or(row[3], 0),
+    )
+
+
+COURSE_EXPORT_FIELDS = ['id', 'title', 'material_language', 'meta_keywords', 'meta_description', 'language_id']
+COURSE_COLUMNS = ['title', 'materialLanguage', 'metaKeywords', 'metaDescription', 'languageId']
+
+# Import order preserves referential integrity: parents always come first.
+TABLES = [
+    TableSpec(
+        'languages', 'Language',
+        ['id', 'code', 'machine_name', 'name', 'icon', 'order', 'speaker'],
+        ['code', 'machineName', 'name', 'iconPath', 'order', 'speaker'],
+        _language_params,
+        returns_id=True,
+        legacy_table='language_language',
+    ),
+    TableSpec(
+        'grammar_courses', 'GrammarCourse',
+        COURSE_EXPORT_FIELDS, COURSE_COLUMNS, _course_params,
+        foreign_keys={'languageId': 'languages'},
+        returns_id=True,
+        legacy_table='grammar_grammarcourse',
+    ),
+    TableSpec(
+        'phonetics_courses', 'PhoneticsCourse',
+        COURSE_EXPORT_FIELDS, COURSE_COLUMNS, _course_params,
+        foreign_keys={'languageId': 'languages'},
+        returns_id=True,
+        legacy_table='phonetics_phoneticscourse',
+    ),
+    TableSpec(
+        'songs_courses', 'SongsCourse',
+        ['id', 'title', 'material_language', 'language_id'],
+        ['title', 'materialLanguage', 'languageId'],
+        _songs_course_params,
+        foreign_keys={'languageId': 'languages'},
+        returns_id=True,
+        legacy_table='songs_songscourse',
+    ),
+    TableSpec(
+        'grammar_lessons', 'GrammarLesson',
+        ['id', 'title', 'course_id', 'template', 'alias', 'url', 'section',
+         'teaser', 'order', 'meta_keywords', 'meta_description'],
+        ['title', 'courseId', 'template', 'alias', 'url', 'section',
+         'teaser', 'order', 'metaKeywords', 'metaDescription'],
+        _grammar_lesson_params,
+        foreign_keys={'courseId': 'grammar_courses'},
+        legacy_table='grammar_grammarlesson',
+    ),
+    TableSpec(
+        'phonetics_lessons', 'PhoneticsLesson',
+        ['id', 'title', 'course_id', 'order', 'meta_keywords', 'meta_description'],
+        ['title', 'courseId', 'order', 'metaKeywords', 'metaDescription'],
+        _phonetics_lesson_params,
+        foreign_keys={'courseId': 'phonetics_courses'},
+        legacy_table='phonetics_phoneticslesson',
+    ),
+    TableSpec(
+        'songs_lessons', 'SongsLesson',
+        ['id', 'title', 'course_id', 'order'],
+        ['title', 'courseId', 'order'],
+        _songs_lesson_params,
+        foreign_keys={'courseId': 'songs_courses'},
+        legacy_table='songs_songslesson',
+    ),
+    TableSpec(
+        'words', 'Word',
+        ['id', 'word', 'transcription', 'translation', 'language_id'],
+        ['word', 'transcription', 'translation', 'languageId'],
+        _word_params,
+        foreign_keys={'languageId': 'languages'},
+        returns_id=True,
+        legacy_table='dictionary_word',
+        unique=('word', 'languageId', 'translation'),
+    ),
+    TableSpec(
+        'word_themes', 'WordTheme',
+        ['id', 'name', 'module_class', 'order'],
+        ['name', 'moduleClass', 'order'],
+        _word_theme_params,
+        returns_id=True,
+        legacy_table='dictionary_wordtheme',
+    ),
+    TableSpec(
+        'word_theme_relations', 'WordThemeRelation',
+        ['id', 'word_id', 'theme_id', 'order'],
+        ['wordId', 'themeId', 'order'],
+        _word_theme_relation_params,
+        foreign_keys={'wordId': 'words', 'themeId': 'word_themes'},
+        legacy_table='dictionary_wordthemerelation',
+        unique=('wordId', 'themeId', 'order'),
+    ),
+]
+
+TABLES_BY_KEY = dict((spec.key, spec) for spec in TABLES)
+
+
+def get_table(key):
+    """Return the TableSpec for a table key."""
+    try:
+        return TABLES_BY_KEY[key]
+    except KeyError:
+        raise ValueError("Unknown content table: {}".format(key))
+
+
+def row_from_instance(obj, fields):
+    """Read export fields from a legacy model instance.
+
+    File fields (e.g. Language.icon) are converted to their path string,
+    matching what the storagebox export writes.
+    """
+    row = []
+    for field in fields:
+        value = getattr(obj, field, None)
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        row.append(value)
+    return row
+
+
+def format_export_value(value):
+    """Format one value for a storagebox export file."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'{}'".format(value.replace("'", "''"))
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return str(value)
+
+
+def format_export_line(row):
+    """Format an exported row as one storagebox export line (with newline)."""
+    return ','.join(format_export_value(value) for value in row) + '\n'
+
+
+def _scalar(token):
+    if token == 'NULL':
+        return None
+    if token == 'TRUE':
+        return True
+    if token == 'FALSE':
+        return False
+    try:
+        return int(token)
+    except ValueError:
+        return token
+
+
+def parse_export_line(line):
+    """Parse one line of a storagebox export file.
+
+    Export lines are comma separated; strings are single quoted with quotes
+    doubled, NULL is unquoted. Unlike a plain split(','), commas inside
+    quoted strings are preserved.
+
+    Returns:
+        List of values (str, int, bool or None), or None for comments and
+        blank lines
+
+    Raises:
+        ValueError: If the line is malformed
+    """
+    line = line.rstrip('\r\n')
+    if not line or line.startswith('--'):
+        return None
+
+    values = []
+    length = len(line)
+    pos = 0
+    while True:
+        if pos < length and line[pos] == "'":
+            chunks = []
+            start = pos + 1
+            while True:
+                quote = line.find("'", start)
+                if quote == -1:
+                    raise ValueError("Unterminated quoted field at offset {}".format(pos))
+                if quote + 1 < length and line[quote + 1] == "'":
+                    chunks.append(line[start:quote + 1])
+                    start = quote + 2
+                    continue
+                chunks.append(line[start:quote])
+                pos = quote + 1
+                break
+            values.append(''.join(chunks))
+        else:
+            comma = line.find(',', pos)
+            if comma == -1:
+                comma = length
+            values.append(_scalar(line[pos:comma].strip()))
+            pos = comma
+
+        if pos >= length:
+            return values
+        if line[pos] != ',':
+            raise ValueError("Expected ',' at offset {}".format(pos))
+        pos += 1
+
+
+def count_export_rows(path):
+    """Count data lines (not comments or blank lines) in an export file."""
+    count = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip() and not line.startswith(b'--'):
+                count += 1
+    return count
+
+
+def iter_export_lines(f, progress=None):
+    """Yield the decoded lines of an export file opened in binary mode.
+
+    Args:
+        f: Export file object opened with 'rb'
+        progress: Optional TableProgress credited with the raw bytes read
+    """
+    for raw in f:
+        if progress is not None:
+            progress.add_bytes(len(raw))
+        yield raw.decode('utf-8')
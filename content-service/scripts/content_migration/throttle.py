@@ -0,0 +1,147 @@
+"""
+Adaptive throttling of an import against a shared database server
+
+AdaptiveThrottle shrinks the batches and pauses between them while commit
+latency, active sessions or replication lag say the server is busy.
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Commit latency (seconds) above which the server counts as busy
+DEFAULT_TARGET_LATENCY = 0.05
+
+# Batch duration (seconds) the batch size grows towards
+DEFAULT_BATCH_SECONDS = 1.0
+
+DEFAULT_MIN_BATCH_SIZE = 50
+DEFAULT_MAX_BATCH_SIZE = 5000
+
+# Longest pause (seconds) before a batch
+DEFAULT_MAX_PAUSE = 10.0
+_MIN_PAUSE = 0.05
+
+# Seconds between server probes
+DEFAULT_PROBE_INTERVAL = 5.0
+
+# Weight of the newest sample in the moving averages
+_SMOOTHING = 0.3
+
+PROBE_SQL = (
+    "SELECT (SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND pid <> pg_backend_pid()) "
+    "|| ':' || coalesce((SELECT max(extract(epoch FROM replay_lag)) FROM pg_stat_replication), 0)"
+)
+
+
+def server_probe(query):
+    """probe() -> (other active sessions, replication lag in seconds) over a query runner.
+
+    Args:
+        query: Callable running a SELECT and returning its single value
+            (see bulkload.psycopg2_runners / psql_runners)
+    """
+    def probe():
+        active, lag = str(query(PROBE_SQL)).strip().split(':')
+        return int(active), float(lag)
+    return probe
+
+
+def _average(current, sample):
+    return sample if current is None else current + _SMOOTHING * (sample - current)
+
+
+class AdaptiveThrottle(object):
+    """Pick batch sizes and pauses that keep the import below a latency target."""
+
+    def __init__(self, target_latency=DEFAULT_TARGET_LATENCY, batch_seconds=DEFAULT_BATCH_SECONDS,
+                 min_batch_size=DEFAULT_MIN_BATCH_SIZE, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_pause=DEFAULT_MAX_PAUSE, probe=None,
+                 probe_interval=DEFAULT_PROBE_INTERVAL, max_active=None, max_lag=None):
+        """Initialize throttle
+
+        Args:
+            target_latency: Commit latency (seconds) to stay below
+            batch_seconds: Batch duration the batch size grows towards
+            min_batch_size: Smallest batch size
+            max_batch_size: Largest batch size
+            max_pause: Longest pause (seconds) before a batch
+            probe: Optional probe() -> (active sessions, replication lag),
+                see server_probe()
+            probe_interval: Seconds between probes
+            max_active: Other active sessions above which the server counts
+                as busy (None: ignore)
+            max_lag: Replication lag (seconds) above which the server counts
+                as busy (None: ignore)
+        """
+        self.target_latency = target_latency
+        self.batch_seconds = batch_seconds
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.max_pause = max_pause
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.max_active = max_active
+        self.max_lag = max_lag
+        self.pause = 0.0
+        self.commit_latency = None
+        self.row_seconds = None
+        self.busy = False
+        self.paused_seconds = 0.0
+        self._server_busy = False
+        self._probed_at = None
+
+    def wait(self):
+        """Sleep for the current pause; called before each batch."""
+        if self.pause:
+            time.sleep(self.pause)
+            self.paused_seconds += self.pause
+
+    def observe_commit(self, seconds):
+        """Record the latency of one COMMIT."""
+        self.commit_latency = _average(self.commit_latency, seconds)
+
+    def observe_batch(self, seconds, rows, batch_size):
+        """Record one batch of rows that took seconds; returns the next batch size."""
+        if rows:
+            self.row_seconds = _average(self.row_seconds, seconds / rows)
+
+        busy = self._busy()
+        if busy != self.busy:
+            logger.info("Throttle: server {} (commit {}, pause {:.2f}s, batch size {})".format(
+                'busy, backing off' if busy else 'idle again, speeding up',
+                '{:.3f}s'.format(self.commit_latency) if self.commit_latency is not None else 'n/a',
+                self.pause, batch_size))
+            self.busy = busy
+
+        if busy:
+            self.pause = min(self.max_pause, max(_MIN_PAUSE, self.pause * 2))
+            size = batch_size // 2
+        else:
+            self.pause = self.pause / 2 if self.pause > _MIN_PAUSE else 0.0
+            size = batch_size * 2
+            if self.row_seconds:
+                size = min(size, int(self.batch_seconds / self.row_seconds))
+        return max(self.min_batch_size, min(self.max_batch_size, size))
+
+    def _busy(self):
+        if self.commit_latency is not None and self.commit_latency > self.target_latency:
+            return True
+        return self._probe()
+
+    def _probe(self):
+        if self.probe is None or (self.max_active is None and self.max_lag is None):
+            return False
+        now = time.time()
+        if self._probed_at is not None and now - self._probed_at < self.probe_interval:
+            return self._server_busy
+        self._probed_at = now
+        try:
+            active, lag = self.probe()
+        except Exception as e:
+            logger.warning("Throttle: server probe failed: {}".format(e))
+            return self._server_busy
+        self._server_busy = ((self.max_active is not None and active > self.max_active) or
+                             (self.max_lag is not None and lag > self.max_lag))
+        return self._server_busy
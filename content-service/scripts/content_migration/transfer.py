@@ -0,0 +1,266 @@
+"""
+Delta transfer of export files to the storagebox
+
+DeltaTransfer stores export files as content-defined chunks plus a
+<file>.chunks index and writes only the chunks the storagebox lacks.
+materialize() reassembles chunked files for the importers.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+AVG_CHUNK_SIZE = 16 * 1024
+MIN_CHUNK_SIZE = 2 * 1024
+MAX_CHUNK_SIZE = 128 * 1024
+
+DEFAULT_TRANSFER_WORKERS = 4
+
+TRANSFER_MODES = ('copy', 'delta')
+
+INDEX_SUFFIX = '.chunks'
+CHUNK_DIR = 'chunks'
+
+# Digests the indexes referenced when the previous export run was pruned
+PREVIOUS_RUN_CHUNKS = 'previous-run.chunklist'
+
+_INDEX_VERSION = 1
+
+# A line ends a chunk when crc32(line) < len(line) * _CUT_SCALE
+_CUT_SCALE = (1 << 32) // AVG_CHUNK_SIZE
+
+
+def iter_chunks(path):
+    """Yield (offset, length, sha256 hex) of the content-defined chunks of a file."""
+    crc32 = zlib.crc32
+    cut_scale = _CUT_SCALE
+    offset = 0
+    length = 0
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for line in f:
+            digest.update(line)
+            length += len(line)
+            if length >= MAX_CHUNK_SIZE or (length >= MIN_CHUNK_SIZE and crc32(line) < len(line) * cut_scale):
+                yield offset, length, digest.hexdigest()
+                offset += length
+                length = 0
+                digest = hashlib.sha256()
+    if length:
+        yield offset, length, digest.hexdigest()
+
+
+def index_path(directory, filename):
+    return os.path.join(directory, filename + INDEX_SUFFIX)
+
+
+def load_index(directory, filename):
+    """Chunk index of filename in directory, or None."""
+    path = index_path(directory, filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    return index if index.get('version') == _INDEX_VERSION else None
+
+
+def stored_size(directory, filename):
+    """Size of filename on the storagebox, chunked or plain (None if absent)."""
+    index = load_index(directory, filename)
+    if index is not None:
+        return index['size']
+    path = os.path.join(directory, filename)
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def _replace(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class DeltaTransfer(object):
+    """Push export files to a storagebox directory as deduplicated chunks."""
+
+    def __init__(self, directory, workers=DEFAULT_TRANSFER_WORKERS):
+        """Initialize transfer
+
+        Args:
+            directory: Export directory on the storagebox
+            workers: Chunks written in parallel
+        """
+        self.directory = directory
+        self.workers = max(1, workers)
+        self._known = None
+
+    def chunk_path(self, digest):
+        return os.path.join(self.directory, CHUNK_DIR, digest[:2], digest)
+
+    def known_chunks(self):
+        """Digests referenced by the indexes already in the directory."""
+        if self._known is None:
+            self._known = set()
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(INDEX_SUFFIX):
+                        index = load_index(self.directory, name[:-len(INDEX_SUFFIX)])
+                        if index is not None:
+                            self._known.update(digest for digest, _ in index['chunks'])
+        return self._known
+
+    def push(self, path):
+        """Store the file at path in the directory; returns (bytes written, file size)."""
+        filename = os.path.basename(path)
+        known = self.known_chunks()
+        chunks = []
+        missing = {}
+        for offset, length, digest in iter_chunks(path):
+            chunks.append((digest, length))
+            if digest not in known and digest not in missing:
+                missing[digest] = (offset, length)
+
+        def write(item):
+            digest, (offset, length) = item
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            chunk_path = self.chunk_path(digest)
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            _replace(chunk_path, data)
+            return length
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            written = sum(pool.map(write, missing.items()))
+        known.update(missing)
+
+        size = sum(length for _, length in chunks)
+        index = {'version': _INDEX_VERSION, 'size': size, 'sha256': _sha256(path), 'chunks': chunks}
+        _replace(index_path(self.directory, filename), json.dumps(index).encode('utf-8'))
+        # A plain copy from an earlier export would shadow the index
+        plain = os.path.join(self.directory, filename)
+        if os.path.exists(plain):
+            os.remove(plain)
+        logger.info("Transferred {}: {} of {} bytes in {} new chunks ({} chunks)".format(
+            filename, written, size, len(missing), len(chunks)))
+        return written, size
+
+    def prune(self):
+        """Remove chunks no index of this or the previous run references; returns the number removed."""
+        self._known = None
+        known = self.known_chunks()
+        previous_path = os.path.join(self.directory, PREVIOUS_RUN_CHUNKS)
+        retained = set()
+        if os.path.exists(previous_path):
+            with open(previous_path, 'r', encoding='utf-8') as f:
+                retained.update(json.load(f))
+        removed = 0
+        root = os.path.join(self.directory, CHUNK_DIR)
+        if os.path.isdir(root):
+            for prefix in os.listdir(root):
+                for digest in os.listdir(os.path.join(root, prefix)):
+                    if digest not in known and digest not in retained:
+                        os.remove(os.path.join(root, prefix, digest))
+                        removed += 1
+        _replace(previous_path, json.dumps(sorted(known)).encode('utf-8'))
+        return removed
+
+
+class Publisher(object):
+    """Put export files on the storagebox, whole ('copy') or as chunks ('delta')."""
+
+    def __init__(self, directory, mode='copy', workers=DEFAULT_TRANSFER_WORKERS):
+        if mode not in TRANSFER_MODES:
+            raise ValueError("Unknown transfer mode {!r} (expected one of {})".format(
+                mode, ', '.join(TRANSFER_MODES)))
+        self.directory = directory
+        self.delta = DeltaTransfer(directory, workers) if mode == 'delta' else None
+
+    def publish(self, path):
+        """Store the file at path in the directory under its own name."""
+        filename = os.path.basename(path)
+        if self.delta is not None:
+            self.delta.push(path)
+            return
+        shutil.copy2(path, os.path.join(self.directory, filename))
+        # A chunk index from an earlier delta export would shadow the copy
+        if os.path.exists(index_path(self.directory, filename)):
+            os.remove(index_path(self.directory, filename))
+
+    def finish(self):
+        """Prune chunks unreferenced since the previous run (delta mode)."""
+        if self.delta is not None:
+            logger.info("Removed {} unreferenced chunks".format(self.delta.prune()))
+
+
+def default_local_dir():
+    return os.path.join(tempfile.gettempdir(), 'content-migration-import')
+
+
+def materialize(directory, filenames, target_dir=None):
+    """Reassemble the chunked files among filenames into target_dir.
+
+    Files already reassembled by an earlier run are kept when they match
+    their index.
+
+    Args:
+        directory: Export directory on the storagebox
+        filenames: Export file names to make available
+        target_dir: Local directory (default: content-migration-import in
+            the temp directory)
+
+    Returns:
+        The directory to read the files from: target_dir if any file in
+        directory is chunked (plain files and manifest.json are copied
+        along), otherwise directory itself.
+
+    Raises:
+        ValueError: If a reassembled file does not match its index
+    """
+    if not any(load_index(directory, filename) is not None for filename in filenames):
+        return directory
+    target_dir = target_dir or default_local_dir()
+    os.makedirs(target_dir, exist_ok=True)
+    for filename in filenames:
+        index = load_index(directory, filename)
+        target = os.path.join(target_dir, filename)
+        if index is None:
+            source = os.path.join(directory, filename)
+            if os.path.exists(source):
+                shutil.copy2(source, target)
+            continue
+        if os.path.exists(target) and os.path.getsize(target) == index['size'] and _sha256(target) == index['sha256']:
+            continue
+        # Per process: importers sharing the local directory may run at once
+        temp_path = '{}.tmp.{}'.format(target, os.getpid())
+        whole = hashlib.sha256()
+        with open(temp_path, 'wb') as out:
+            for digest, _ in index['chunks']:
+                with open(os.path.join(directory, CHUNK_DIR, digest[:2], digest), 'rb') as f:
+                    data = f.read()
+                whole.update(data)
+                out.write(data)
+        if whole.hexdigest() != index['sha256']:
+            os.remove(temp_path)
+            raise ValueError("Reassembled {} does not match its chunk index".format(filename))
+        os.replace(temp_path, target)
+        logger.info("Reassembled {} ({} bytes, {} chunks)".format(filename, index['size'], len(index['chunks'])))
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            shutil.copy2(os.path.join(directory, name), os.path.join(target_dir, name))
+    return target_dir
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -2,6 +2,12 @@
 """
 Import content data from storagebox CSV files using psql
 Does not require psycopg2 or Django - uses subprocess to call psql
+
+Environment Variables:
+    MIGRATION_BATCH_SIZE - Rows per psql call (default 500)
+    MIGRATION_PROGRESS_FILE - Append per-table progress records as JSON lines
+    MIGRATION_REJECTS_DIR - Write rejected rows to <table>.rejects.tsv files
+    MIGRATION_PROFILE_DIR, MIGRATION_PROFILE_MODE - Profile each table
 """
 
 import os
@@ -10,6 +16,15 @@ import subprocess
 import logging
 from urllib.parse import urlparse
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from content_migration.batching import DEFAULT_BATCH_SIZE, PreparedPsqlBatch
+from content_migration.profiling import Profiler
+from content_migration.progress import ProgressReporter
+from content_migration.rejects import RejectSink
+from content_migration.tables import TABLES, iter_export_lines
+from content_migration.transfer import materialize
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -26,8 +41,8 @@ def parse_db_url(db_url):
     }
 
 
-def run_psql(db_config, sql_command):
-    """Execute SQL command using psql."""
+def run_psql_script(db_config, script):
+    """Feed a psql script on stdin; returns (stdout, stderr)."""
     env = os.environ.copy()
     if db_config['password']:
         env['PGPASSWORD'] = db_config['password']
@@ -37,18 +52,26 @@ def run_psql(db_config, sql_command):
         '-h', db_config['host'],
         '-p', str(db_config['port']),
         '-U', db_config['user'],
-        '-d', db_config['database'],
-        '-c', sql_command
+        '-d', db_config['database']
     ]
     
-    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    result = subprocess.run(cmd, env=env, input=script, capture_output=True, text=True)
     if result.returncode != 0:
-        logger.error("psql error: {}".format(result.stderr))
         raise RuntimeError("psql failed: {}".format(result.stderr))
-    return result.stdout
+    return result.stdout, result.stderr
+
+
+def psql_batch(db_config, statement, progress, batch_size, on_success, on_error):
+    """PreparedPsqlBatch for statement ($1..$n placeholders) run through run_psql_script."""
+    def run(script):
+        return run_psql_script(db_config, script)
 
+    return PreparedPsqlBatch(run, statement, on_success=on_success, on_error=on_error, batch_size=batch_size,
+                             progress=progress)
 
-def import_languages(migration_dir, db_config):
+
+def import_languages(migration_dir, db_config, reporter, batch_size=DEFAULT_BATCH_SIZE, reject_sink=None,
+                     profiler=None):
     """Import languages from CSV file."""
     logger.info("Importing Languages...")
     csv_file = os.path.join(migration_dir, 'languages.sql')
@@ -58,10 +81,24 @@ def import_languages(migration_dir, db_config):
         return {}
     
     id_mapping = {}
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
+    progress = reporter.table('languages', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = (reject_sink if reject_sink is not None else RejectSink()).table(progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """, progress, batch_size, imported, rejects.reject)
+
+    profile = (profiler if profiler is not None else Profiler()).table(progress)
+    with profile, open(csv_file, 'rb') as f:
+        batch = profile.batch(batch)
+        for line_num, line in enumerate(profile.read(iter_export_lines(f, progress)), 1):
             if line.strip().startswith('--') or not line.strip():
                 continue
             
@@ -78,33 +115,16 @@ def import_languages(migration_dir, db_config):
             order_val = parts[5] if parts[5] != 'NULL' else '0'
             speaker = parts[6].strip("'") if len(parts) > 6 and parts[6] != 'NULL' else 'носитель'
             
-            # Escape single quotes in SQL
-            code = code.replace("'", "''")
-            machine_name = machine_name.replace("'", "''")
-            name = name.replace("'", "''")
-            icon_path = icon_path.replace("'", "''")
-            speaker = speaker.replace("'", "''")
-            
-            sql = """
-                INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
-                VALUES ('{}', '{}', '{}', '{}', {}, '{}')
-                RETURNING id
-            """.format(code, machine_name, name, icon_path, order_val, speaker)
-            
-            try:
-                result = run_psql(db_config, sql)
-                # Extract ID from result (format: " id \n----\n  1 \n(1 row)\n")
-                new_id = int(result.split('\n')[2].strip())
-                id_mapping[legacy_id] = new_id
-                count += 1
-            except Exception as e:
-                logger.warning("Failed to import language {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} languages".format(count))
+            batch.execute((code, machine_name, name, icon_path, order_val, speaker), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} languages".format(batch.succeeded))
     return id_mapping
 
 
-def import_grammar_courses(migration_dir, db_config, language_id_mapping):
+def import_grammar_courses(migration_dir, db_config, language_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                           reject_sink=None, profiler=None):
     """Import grammar courses."""
     logger.info("Importing Grammar Courses...")
     csv_file = os.path.join(migration_dir, 'grammar_courses.sql')
@@ -114,10 +134,24 @@ def import_grammar_courses(migration_dir, db_config, language_id_mapping):
         return {}
     
     id_mapping = {}
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
+    progress = reporter.table('grammar_courses', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = (reject_sink if reject_sink is not None else RejectSink()).table(progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+        VALUES ($1, $2, $3, $4, $5)
+    """, progress, batch_size, imported, rejects.reject)
+
+    profile = (profiler if profiler is not None else Profiler()).table(progress)
+    with profile, open(csv_file, 'rb') as f:
+        batch = profile.batch(batch)
+        for line in profile.read(iter_export_lines(f, progress)):
             if line.strip().startswith('--') or not line.strip():
                 continue
             
@@ -129,33 +163,20 @@ def import_grammar_courses(migration_dir, db_config, language_id_mapping):
             legacy_lang_id = int(parts[5])
             
             if legacy_lang_id not in language_id_mapping:
+                rejects.reject(legacy_id, 'missing_parent', line=line)
                 continue
             
-            title = parts[1].strip("'").replace("'", "''")
+            title = parts[1].strip("'")
             material_lang = parts[2].strip("'") if parts[2] != 'NULL' else 'ru'
-            meta_keywords = parts[3].strip("'").replace("'", "''") if parts[3] != 'NULL' else 'NULL'
-            meta_description = parts[4].strip("'").replace("'", "''") if parts[4] != 'NULL' else 'NULL'
-            
-            sql = """
-                INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                VALUES ('{}', '{}', {}, {}, {})
-                RETURNING id
-            """.format(
-                title, material_lang,
-                "'{}'".format(meta_keywords) if meta_keywords != 'NULL' else 'NULL',
-                "'{}'".format(meta_description) if meta_description != 'NULL' else 'NULL',
-                language_id_mapping[legacy_lang_id]
-            )
+            meta_keywords = parts[3].strip("'") if parts[3] != 'NULL' else None
+            meta_description = parts[4].strip("'") if parts[4] != 'NULL' else None
             
-            try:
-                result = run_psql(db_config, sql)
-                new_id = int(result.split('\n')[2].strip())
-                id_mapping[legacy_id] = new_id
-                count += 1
-            except Exception as e:
-                logger.warning("Failed to import grammar course {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} grammar courses".format(count))
+            batch.execute((title, material_lang, meta_keywords, meta_description,
+                           language_id_mapping[legacy_lang_id]), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} grammar courses".format(batch.succeeded))
     return id_mapping
 
 
@@ -175,9 +196,26 @@ def main():
     logger.info("Importing from: {}".format(migration_dir))
     logger.info("Database: {}:{}".format(db_config['host'], db_config['port']))
     
+    batch_size = int(os.getenv('MIGRATION_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    
     # Import in order
-    language_id_mapping = import_languages(migration_dir, db_config)
-    grammar_course_id_mapping = import_grammar_courses(migration_dir, db_config, language_id_mapping)
+    reporter = ProgressReporter(os.getenv('MIGRATION_PROGRESS_FILE'), source='import-from-storagebox-psql')
+    reject_sink = RejectSink(os.getenv('MIGRATION_REJECTS_DIR'))
+    profiler = Profiler(os.getenv('MIGRATION_PROFILE_DIR'), os.getenv('MIGRATION_PROFILE_MODE', 'sample'))
+    try:
+        # Chunked exports (--transfer delta) are reassembled locally first
+        migration_dir = materialize(migration_dir, [spec.filename for spec in TABLES])
+        language_id_mapping = import_languages(migration_dir, db_config, reporter, batch_size, reject_sink, profiler)
+        grammar_course_id_mapping = import_grammar_courses(migration_dir, db_config, language_id_mapping, reporter,
+                                                           batch_size, reject_sink, profiler)
+    except Exception:
+        reject_sink.close()
+        profiler.close()
+        reporter.close('error')
+        raise
+    reject_sink.close()
+    profiler.close()
+    reporter.close()
     
     logger.info("Import completed!")
     return 0
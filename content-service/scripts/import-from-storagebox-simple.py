@@ -2,18 +2,62 @@
 """
 Simple import script using docker exec psql
 Reads CSV files from storagebox and imports to database
+
+Usage:
+    python3 import-from-storagebox-simple.py [--progress-file PATH] [--batch-size N]
+                                             [--bulk-load [--rebuild-workers N]] [--workers N]
+                                             [--rejects-dir DIR] [--profile DIR [--profile-mode MODE]]
+                                             [--force] [--follow [--poll-interval S] [--follow-timeout S]]
+                                             [--throttle [--target-latency MS] [--max-active N]
+                                                         [--max-replication-lag S]]
+                                             [--parse-cache DIR] [--batch-id ID]
+    python3 import-from-storagebox-simple.py --rollback BATCH | --list-batches
+
+    Options are described in --help and STORAGEBOX_MIGRATION_GUIDE.md.
 """
 
 import os
 import sys
+import argparse
 import subprocess
 import logging
 import csv
+from array import array
 from urllib.parse import urlparse, unquote
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from content_migration.batching import DEFAULT_BATCH_SIZE, PreparedPsqlBatch
+from content_migration.dedup import KeyDeduplicator, key_hash, word_key
+from content_migration.bulkload import (
+    DEFAULT_REBUILD_WORKERS, BulkLoad, default_state_path
+)
+from content_migration.idmap import IdMapping
+from content_migration.importbatch import ImportBatch, insert_table, list_batches, rollback as rollback_batch
+from content_migration.manifest import DEFAULT_POLL_INTERVAL, ExportManifest, ImportState, ManifestFollower
+from content_migration.parsecache import ParseCache, parse_lines
+from content_migration.profiling import MODES as PROFILE_MODES, Profiler
+from content_migration.progress import ProgressReporter
+from content_migration.reader import ExportFile
+from content_migration.rejects import RejectSink
+from content_migration.sharding import DEFAULT_WORKERS, ShardResult, run_sharded, shard_progress
+from content_migration.tables import TABLES, get_table
+from content_migration.throttle import DEFAULT_TARGET_LATENCY, AdaptiveThrottle, server_probe
+from content_migration.transfer import load_index, materialize
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# AdaptiveThrottle of the run (--throttle); forked shard workers inherit a copy
+_throttle = None
+
+# ParseCache of the run (--parse-cache); forked shard workers inherit it
+_parse_cache = None
+
+# ImportBatch the run's new rows are tagged with; forked shard workers inherit
+# a copy and flush what they recorded before they return
+_import_batch = None
+
 
 def parse_db_url(db_url):
     """Parse DATABASE_URL into components."""
@@ -28,8 +72,11 @@ def parse_db_url(db_url):
     }
 
 
-def run_psql_docker(db_config, sql_command, input_data=None):
-    """Execute SQL command using docker exec psql."""
+def run_psql_docker(db_config, sql_command, input_data=None, with_stderr=False, log_errors=True):
+    """Execute SQL command using docker exec psql.
+
+    With with_stderr the result is (stdout, stderr) instead of stdout.
+    """
     env = os.environ.copy()
     if db_config['password']:
         env['PGPASSWORD'] = db_config['password']
@@ -59,16 +106,92 @@ def run_psql_docker(db_config, sql_command, input_data=None):
         stdout, stderr = process.stdout, process.stderr
     
     if process.returncode != 0:
-        logger.error("psql error: {}".format(stderr))
+        if log_errors:
+            logger.error("psql error: {}".format(stderr))
         raise RuntimeError("psql failed: {}".format(stderr))
+    if with_stderr:
+        return stdout, stderr
     return stdout
 
 
-def escape_sql_string(value):
-    """Escape single quotes for SQL."""
-    if value is None or value == 'NULL':
-        return 'NULL'
-    return "'{}'".format(str(value).replace("'", "''"))
+def psql_batch(db_config, statement, progress, batch_size, on_success, on_error):
+    """PreparedPsqlBatch for statement ($1..$n placeholders) that sends each batch to run_psql_docker.
+
+    The new rows are recorded in the run's import batch.
+    """
+    def run(script):
+        # A failed batch is retried row by row, so its error is not logged here
+        return run_psql_docker(db_config, None, input_data=script, with_stderr=True, log_errors=False)
+
+    if _import_batch is not None:
+        on_success = _import_batch.recorder(insert_table(statement), on_success)
+
+    return PreparedPsqlBatch(run, statement, on_success=on_success, on_error=on_error, batch_size=batch_size,
+                             progress=progress, throttle=_throttle)
+
+
+def flush_import_batch():
+    """Write the rows recorded so far to the import batch table (no-op without a batch)."""
+    if _import_batch is not None:
+        _import_batch.flush()
+
+
+def psql_runners(db_config):
+    """(query, execute) callables that each run in their own psql session."""
+    def query(sql):
+        script = '\\set QUIET on\n\\pset format unaligned\n\\pset tuples_only on\n{};\n'.format(sql)
+        return run_psql_docker(db_config, None, input_data=script).strip()
+
+    def execute(sql):
+        run_psql_docker(db_config, sql)
+
+    return query, execute
+
+
+def psql_bulk_load(db_config, workers):
+    """BulkLoad whose statements each run in their own psql session."""
+    query, execute = psql_runners(db_config)
+    return BulkLoad(query, execute, default_state_path(db_config['database']), workers=workers)
+
+
+def table_profile(profiler, progress, name=None):
+    """TableProfile for the table of progress (a no-op when profiler is None)."""
+    return (profiler if profiler is not None else Profiler()).table(progress, name)
+
+
+def profile_settings(profiler):
+    """Profiler settings for shard workers (profiling disabled when profiler is None)."""
+    return profiler.settings() if profiler is not None else ()
+
+
+def table_rejects(reject_sink, progress):
+    """TableRejects for the table of progress (counted and logged only when reject_sink is None)."""
+    return (reject_sink if reject_sink is not None else RejectSink()).table(progress)
+
+
+def export_rows(export, parse, start=0, end=None, progress=None):
+    """(offset, raw line, row) of the data lines of export[start:end] that parse (from the parse cache if set)."""
+    if _parse_cache is not None:
+        return _parse_cache.rows(export, parse, start, end, progress)
+    return parse_lines(export, parse, start, end, progress)
+
+
+def register_export_digest(migration_dir, path, entry):
+    """Key the parse cache of the export file at path by its metadata, so it is not hashed.
+
+    A chunked file's index holds the SHA-256 of the file; a plain file is
+    described by its manifest entry (fingerprint and size) while its size
+    matches. Without either, the parse cache hashes the file.
+    """
+    if not os.path.exists(path):
+        return
+    size = os.path.getsize(path)
+    index = load_index(migration_dir, os.path.basename(path))
+    if index is not None:
+        if index['size'] == size:
+            _parse_cache.register(path, 'sha256:{}'.format(index['sha256']))
+    elif entry is not None and entry.get('size') == size:
+        _parse_cache.register(path, 'manifest:{}:{}'.format(entry['fingerprint'], size))
 
 
 def parse_csv_line(line):
@@ -98,7 +221,8 @@ def parse_csv_line(line):
         return None
 
 
-def import_languages(migration_dir, db_config):
+def import_languages(migration_dir, db_config, reporter, batch_size=DEFAULT_BATCH_SIZE, reject_sink=None,
+                     profiler=None):
     """Import languages from CSV file."""
     logger.info("Importing Languages...")
     csv_file = os.path.join(migration_dir, 'languages.sql')
@@ -120,13 +244,26 @@ def import_languages(migration_dir, db_config):
     logger.info("Found {} existing languages".format(len(existing_by_code)))
     
     id_mapping = {}
-    count = 0
     skipped = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            row = parse_csv_line(line)
-            if not row or len(row) < 7:
+    progress = reporter.table('languages', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 7:
                 continue
             
             legacy_id = int(row[0])
@@ -144,36 +281,23 @@ def import_languages(migration_dir, db_config):
                 logger.debug("Language {} already exists (id={})".format(code, existing_by_code[code]))
                 continue
             
-            sql = """
-                INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
-                VALUES ({}, {}, {}, {}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(code),
-                escape_sql_string(machine_name),
-                escape_sql_string(name),
-                escape_sql_string(icon_path),
+            batch.execute((
+                code,
+                machine_name,
+                name,
+                icon_path,
                 order_val,
-                escape_sql_string(speaker)
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                # Extract ID from result
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        break
-            except Exception as e:
-                logger.warning("Failed to import language {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} languages ({} already existed)".format(count, skipped))
+                speaker
+            ), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} languages ({} already existed)".format(batch.succeeded, skipped))
     return id_mapping
 
 
-def import_grammar_courses(migration_dir, db_config, language_id_mapping):
+def import_grammar_courses(migration_dir, db_config, language_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                           reject_sink=None, profiler=None):
     """Import grammar courses."""
     logger.info("Importing Grammar Courses...")
     csv_file = os.path.join(migration_dir, 'grammar_courses.sql')
@@ -183,22 +307,32 @@ def import_grammar_courses(migration_dir, db_config, language_id_mapping):
         return {}
     
     id_mapping = {}
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 6:
+    progress = reporter.table('grammar_courses', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+        VALUES ($1, $2, $3, $4, $5)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 6:
                 continue
             
             legacy_id = int(row[0])
             legacy_lang_id = int(row[5])
             
             if legacy_lang_id not in language_id_mapping:
-                logger.warning("Skipping grammar course {}: language_id {} not found".format(legacy_id, legacy_lang_id))
+                rejects.reject(legacy_id, 'missing_parent', offset, line)
                 continue
             
             title = row[1]
@@ -206,34 +340,22 @@ def import_grammar_courses(migration_dir, db_config, language_id_mapping):
             meta_keywords = row[3] if row[3] != 'NULL' else None
             meta_description = row[4] if row[4] != 'NULL' else None
             
-            sql = """
-                INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                VALUES ({}, {}, {}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(title),
-                escape_sql_string(material_lang),
-                escape_sql_string(meta_keywords),
-                escape_sql_string(meta_description),
+            batch.execute((
+                title,
+                material_lang,
+                meta_keywords,
+                meta_description,
                 language_id_mapping[legacy_lang_id]
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        break
-            except Exception as e:
-                logger.warning("Failed to import grammar course {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} grammar courses".format(count))
+            ), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} grammar courses".format(batch.succeeded))
     return id_mapping
 
 
-def import_grammar_lessons(migration_dir, db_config, course_id_mapping):
+def import_grammar_lessons(migration_dir, db_config, course_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                           reject_sink=None, profiler=None):
     """Import grammar lessons."""
     logger.info("Importing Grammar Lessons...")
     csv_file = os.path.join(migration_dir, 'grammar_lessons.sql')
@@ -242,19 +364,33 @@ def import_grammar_lessons(migration_dir, db_config, course_id_mapping):
         logger.error("File not found: {}".format(csv_file))
         return
     
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 11:
+    progress = reporter.table('grammar_lessons', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        progress.advance()
+        if progress.rows % 100 == 0:
+            logger.info("Imported {} grammar lessons...".format(progress.rows))
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "GrammarLesson" (
+            title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 11:
                 continue
             
             legacy_course_id = int(row[2])
             if legacy_course_id not in course_id_mapping:
+                rejects.reject(row[0], 'missing_parent', offset, line)
                 continue
             
             title = row[1]
@@ -267,36 +403,26 @@ def import_grammar_lessons(migration_dir, db_config, course_id_mapping):
             meta_keywords = row[9] if row[9] != 'NULL' else None
             meta_description = row[10] if row[10] != 'NULL' else None
             
-            sql = """
-                INSERT INTO "GrammarLesson" (
-                    title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
-                )
-                VALUES ({}, {}, {}, {}, {}, {}, {}, {}, {}, {});
-            """.format(
-                escape_sql_string(title),
+            batch.execute((
+                title,
                 course_id_mapping[legacy_course_id],
-                escape_sql_string(template),
-                escape_sql_string(alias),
-                escape_sql_string(url),
-                escape_sql_string(section),
-                escape_sql_string(teaser),
+                template,
+                alias,
+                url,
+                section,
+                teaser,
                 order_val,
-                escape_sql_string(meta_keywords),
-                escape_sql_string(meta_description)
-            )
-            
-            try:
-                run_psql_docker(db_config, sql)
-                count += 1
-                if count % 100 == 0:
-                    logger.info("Imported {} grammar lessons...".format(count))
-            except Exception as e:
-                logger.warning("Failed to import grammar lesson: {}".format(e))
-    
-    logger.info("Imported {} grammar lessons".format(count))
+                meta_keywords,
+                meta_description
+            ), row[0])
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} grammar lessons".format(batch.succeeded))
 
 
-def import_phonetics_courses(migration_dir, db_config, language_id_mapping):
+def import_phonetics_courses(migration_dir, db_config, language_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                             reject_sink=None, profiler=None):
     """Import phonetics courses."""
     logger.info("Importing Phonetics Courses...")
     csv_file = os.path.join(migration_dir, 'phonetics_courses.sql')
@@ -306,21 +432,32 @@ def import_phonetics_courses(migration_dir, db_config, language_id_mapping):
         return {}
     
     id_mapping = {}
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 6:
+    progress = reporter.table('phonetics_courses', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+        VALUES ($1, $2, $3, $4, $5)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 6:
                 continue
             
             legacy_id = int(row[0])
             legacy_lang_id = int(row[5])
             
             if legacy_lang_id not in language_id_mapping:
+                rejects.reject(legacy_id, 'missing_parent', offset, line)
                 continue
             
             title = row[1]
@@ -328,34 +465,22 @@ def import_phonetics_courses(migration_dir, db_config, language_id_mapping):
             meta_keywords = row[3] if row[3] != 'NULL' else None
             meta_description = row[4] if row[4] != 'NULL' else None
             
-            sql = """
-                INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                VALUES ({}, {}, {}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(title),
-                escape_sql_string(material_lang),
-                escape_sql_string(meta_keywords),
-                escape_sql_string(meta_description),
+            batch.execute((
+                title,
+                material_lang,
+                meta_keywords,
+                meta_description,
                 language_id_mapping[legacy_lang_id]
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        break
-            except Exception as e:
-                logger.warning("Failed to import phonetics course {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} phonetics courses".format(count))
+            ), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} phonetics courses".format(batch.succeeded))
     return id_mapping
 
 
-def import_phonetics_lessons(migration_dir, db_config, course_id_mapping):
+def import_phonetics_lessons(migration_dir, db_config, course_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                             reject_sink=None, profiler=None):
     """Import phonetics lessons."""
     logger.info("Importing Phonetics Lessons...")
     csv_file = os.path.join(migration_dir, 'phonetics_lessons.sql')
@@ -364,19 +489,29 @@ def import_phonetics_lessons(migration_dir, db_config, course_id_mapping):
         logger.error("File not found: {}".format(csv_file))
         return
     
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 6:
+    progress = reporter.table('phonetics_lessons', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
+        VALUES ($1, $2, $3, $4, $5)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 6:
                 continue
             
             legacy_course_id = int(row[2])
             if legacy_course_id not in course_id_mapping:
+                rejects.reject(row[0], 'missing_parent', offset, line)
                 continue
             
             title = row[1]
@@ -384,27 +519,21 @@ def import_phonetics_lessons(migration_dir, db_config, course_id_mapping):
             meta_keywords = row[4] if row[4] != 'NULL' else None
             meta_description = row[5] if row[5] != 'NULL' else None
             
-            sql = """
-                INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
-                VALUES ({}, {}, {}, {}, {});
-            """.format(
-                escape_sql_string(title),
+            batch.execute((
+                title,
                 course_id_mapping[legacy_course_id],
                 order_val,
-                escape_sql_string(meta_keywords),
-                escape_sql_string(meta_description)
-            )
-            
-            try:
-                run_psql_docker(db_config, sql)
-                count += 1
-            except Exception as e:
-                logger.warning("Failed to import phonetics lesson: {}".format(e))
-    
-    logger.info("Imported {} phonetics lessons".format(count))
+                meta_keywords,
+                meta_description
+            ), row[0])
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} phonetics lessons".format(batch.succeeded))
 
 
-def import_songs_courses(migration_dir, db_config, language_id_mapping):
+def import_songs_courses(migration_dir, db_config, language_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                         reject_sink=None, profiler=None):
     """Import songs courses."""
     logger.info("Importing Songs Courses...")
     csv_file = os.path.join(migration_dir, 'songs_courses.sql')
@@ -414,52 +543,51 @@ def import_songs_courses(migration_dir, db_config, language_id_mapping):
         return {}
     
     id_mapping = {}
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 4:
+    progress = reporter.table('songs_courses', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
+        VALUES ($1, $2, $3)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 4:
                 continue
             
             legacy_id = int(row[0])
             legacy_lang_id = int(row[3])
             
             if legacy_lang_id not in language_id_mapping:
+                rejects.reject(legacy_id, 'missing_parent', offset, line)
                 continue
             
             title = row[1]
             material_lang = row[2] if row[2] != 'NULL' else 'ru'
             
-            sql = """
-                INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
-                VALUES ({}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(title),
-                escape_sql_string(material_lang),
+            batch.execute((
+                title,
+                material_lang,
                 language_id_mapping[legacy_lang_id]
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        break
-            except Exception as e:
-                logger.warning("Failed to import songs course {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} songs courses".format(count))
+            ), legacy_id)
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} songs courses".format(batch.succeeded))
     return id_mapping
 
 
-def import_songs_lessons(migration_dir, db_config, course_id_mapping):
+def import_songs_lessons(migration_dir, db_config, course_id_mapping, reporter, batch_size=DEFAULT_BATCH_SIZE,
+                         reject_sink=None, profiler=None):
     """Import songs lessons."""
     logger.info("Importing Songs Lessons...")
     csv_file = os.path.join(migration_dir, 'songs_lessons.sql')
@@ -468,44 +596,165 @@ def import_songs_lessons(migration_dir, db_config, course_id_mapping):
         logger.error("File not found: {}".format(csv_file))
         return
     
-    count = 0
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 4:
+    progress = reporter.table('songs_lessons', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "SongsLesson" (title, "courseId", "order")
+        VALUES ($1, $2, $3)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 4:
                 continue
             
             legacy_course_id = int(row[2])
             if legacy_course_id not in course_id_mapping:
+                rejects.reject(row[0], 'missing_parent', offset, line)
                 continue
             
             title = row[1]
             order_val = row[3]
             
-            sql = """
-                INSERT INTO "SongsLesson" (title, "courseId", "order")
-                VALUES ({}, {}, {});
-            """.format(
-                escape_sql_string(title),
+            batch.execute((
+                title,
                 course_id_mapping[legacy_course_id],
                 order_val
-            )
-            
-            try:
-                run_psql_docker(db_config, sql)
-                count += 1
-            except Exception as e:
-                logger.warning("Failed to import songs lesson: {}".format(e))
-    
-    logger.info("Imported {} songs lessons".format(count))
+            ), row[0])
+        batch.finish()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} songs lessons".format(batch.succeeded))
+
+
+def _load_words(export, start, end, db_config, language_id_mapping, rejects, profile, batch_size, imported, keep):
+    """Import the Word rows in export[start:end]; returns (batch, skipped).
+
+    keep(key, legacy_id) decides whether a row is sent: it returns False for
+    rows repeating an earlier row's (word, languageId, translation).
+    """
+    progress = rejects.progress
+    batch = profile.batch(psql_batch(db_config, """
+        INSERT INTO "Word" (word, transcription, translation, "languageId")
+        VALUES ($1, $2, $3, $4)
+    """, progress, batch_size, imported, rejects.reject))
+    parse = profile.wrap('parse', parse_csv_line)
+    skipped = 0
+
+    for offset, raw, row in profile.read(export_rows(export, parse, start, end, progress)):
+        if len(row) < 5:
+            continue
+        
+        legacy_id = int(row[0])
+        legacy_lang_id = int(row[4])
+        
+        if legacy_lang_id not in language_id_mapping:
+            skipped += 1
+            rejects.reject(legacy_id, 'missing_parent', offset, raw)
+            continue
+        
+        word = row[1]
+        transcription = row[2] if row[2] != 'NULL' else None
+        translation = row[3] if row[3] != 'NULL' else None
+        if not keep(word_key(word, legacy_lang_id, translation), legacy_id):
+            continue
+        
+        rejects.expect(legacy_id, offset, raw)
+        batch.execute((
+            word,
+            transcription,
+            translation,
+            language_id_mapping[legacy_lang_id]
+        ), legacy_id)
+
+    batch.finish()
+    return batch, skipped
 
 
-def import_words(migration_dir, db_config, language_id_mapping):
-    """Import words."""
+def _word_keys_shard(context, csv_file, start, end):
+    """Worker process: hash the unique keys of one byte range of words.sql.
+
+    Returns a ShardResult whose keys are the legacy ids and values the
+    key_hash() of their (word, languageId, translation), for the rows that
+    would be imported and can collide.
+    """
+    language_id_mapping = context
+    legacy_ids, hashes = array('q'), array('q')
+    with ExportFile(csv_file) as export:
+        for _, _, row in export_rows(export, parse_csv_line, start, end, None):
+            if len(row) < 5:
+                continue
+            legacy_lang_id = int(row[4])
+            translation = row[3] if row[3] != 'NULL' else None
+            if legacy_lang_id not in language_id_mapping or translation is None:
+                continue
+            legacy_ids.append(int(row[0]))
+            hashes.append(key_hash(word_key(row[1], legacy_lang_id, translation)))
+    return ShardResult(start, end, None, legacy_ids, hashes)
+
+
+def _collapse_words(csv_file, language_id_mapping, workers, id_map_dir=None):
+    """Find the repeated words of csv_file before any shard writes.
+
+    The shards hash their keys in parallel; the hashes are then added to one
+    KeyDeduplicator in file order, so the first row of a key survives as in
+    a single-process import, wherever its repeats are.
+
+    Returns:
+        The KeyDeduplicator; its collapsed mapping holds the rows to skip
+    """
+    results = sorted(run_sharded(csv_file, _word_keys_shard, language_id_mapping, workers),
+                     key=lambda result: result.start)
+    if _parse_cache is not None:
+        # The import pass then reads the rows parsed here from the cache
+        _parse_cache.assemble(csv_file, [(result.start, result.end) for result in results])
+    dedup = KeyDeduplicator(id_map_dir)
+    for result in results:
+        add_hash = dedup.add_hash
+        for legacy_id, value in zip(result.keys, result.values):
+            add_hash(value, legacy_id)
+    dedup.collapsed.compact()
+    logger.info("Found {} duplicate words across {} shards".format(dedup.duplicates, len(results)))
+    return dedup
+
+
+def _import_words_shard(context, csv_file, start, end):
+    """Worker process: import one byte range of words.sql, return its partial id mapping."""
+    db_config, language_id_mapping, collapsed, batch_size, rejects_dir, profile_settings = context
+    progress = shard_progress('words')
+    rejects = RejectSink(rejects_dir).table(progress, 'words.{}'.format(start))
+    profile = Profiler(*profile_settings).table(progress, 'words.{}'.format(start))
+    keys, values = array('q'), array('q')
+
+    def imported(legacy_id, new_id):
+        keys.append(legacy_id)
+        values.append(new_id)
+        progress.advance()
+
+    def keep(key, legacy_id):
+        return legacy_id not in collapsed
+
+    try:
+        with profile, ExportFile(csv_file) as export:
+            batch, skipped = _load_words(export, start, end, db_config, language_id_mapping, rejects, profile,
+                                         batch_size, imported, keep)
+    finally:
+        flush_import_batch()
+    rejects.finish()
+    return ShardResult(start, end, progress.counters(), keys, values, batch.succeeded, batch.failed, skipped)
+
+
+def import_words(migration_dir, db_config, language_id_mapping, reporter, id_map_dir=None, batch_size=DEFAULT_BATCH_SIZE,
+                 workers=DEFAULT_WORKERS, reject_sink=None, profiler=None):
+    """Import words (in byte-range shards on `workers` processes if workers > 1)."""
     logger.info("Importing Words...")
     csv_file = os.path.join(migration_dir, 'words.sql')
     
@@ -513,61 +762,61 @@ def import_words(migration_dir, db_config, language_id_mapping):
         logger.error("File not found: {}".format(csv_file))
         return {}
     
-    id_mapping = {}
-    count = 0
-    skipped = 0
+    id_mapping = IdMapping(id_map_dir)
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 5:
-                continue
-            
-            legacy_id = int(row[0])
-            legacy_lang_id = int(row[4])
-            
-            if legacy_lang_id not in language_id_mapping:
-                skipped += 1
-                continue
-            
-            word = row[1]
-            transcription = row[2] if row[2] != 'NULL' else None
-            translation = row[3] if row[3] != 'NULL' else None
-            
-            sql = """
-                INSERT INTO "Word" (word, transcription, translation, "languageId")
-                VALUES ({}, {}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(word),
-                escape_sql_string(transcription),
-                escape_sql_string(translation),
-                language_id_mapping[legacy_lang_id]
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        if count % 1000 == 0:
-                            logger.info("Imported {} words...".format(count))
-                        break
-            except Exception as e:
-                skipped += 1
-                if 'unique' not in str(e).lower():
-                    logger.warning("Failed to import word {}: {}".format(legacy_id, e))
+    progress = reporter.table('words', total_bytes=os.path.getsize(csv_file))
+    if _parse_cache is not None:
+        _parse_cache.prepare(csv_file)
+
+    if workers > 1:
+        # Repeats are found over the whole file first: a repeat's survivor
+        # may be in another shard
+        dedup = _collapse_words(csv_file, language_id_mapping, workers, id_map_dir)
+        succeeded = skipped = 0
+        results = []
+        context = (db_config, language_id_mapping, dedup.collapsed, batch_size,
+                   reject_sink and reject_sink.directory, profile_settings(profiler))
+        for result in run_sharded(csv_file, _import_words_shard, context, workers, progress):
+            results.append(result)
+            succeeded += result.succeeded
+            skipped += result.skipped + result.failed
+            logger.info("Imported {} words...".format(progress.rows))
+        # Extend in file order: the shards' legacy ids then form a few sorted
+        # runs that compact() merges instead of one shuffled column
+        results.sort(key=lambda result: result.start)
+        for result in results:
+            id_mapping.extend(result.keys, result.values)
+        if profiler is not None:
+            profiler.add(progress)
+        if _parse_cache is not None:
+            _parse_cache.assemble(csv_file, [(result.start, result.end) for result in results])
+        del results
+    else:
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+            if progress.rows % 1000 == 0:
+                logger.info("Imported {} words...".format(progress.rows))
+
+        dedup = KeyDeduplicator(id_map_dir)
+        rejects = table_rejects(reject_sink, progress)
+        with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+            batch, skipped = _load_words(export, 0, None, db_config, language_id_mapping, rejects, profile,
+                                         batch_size, imported, dedup.add)
+        rejects.finish()
+        succeeded = batch.succeeded
+        skipped += batch.failed
+    collapsed = dedup.merge_into(id_mapping)
     
-    logger.info("Imported {} words (skipped {} duplicates/errors)".format(count, skipped))
+    id_mapping.compact()
+    progress.finish()
+    logger.info("Imported {} words (collapsed {} duplicates, skipped {} errors)".format(
+        succeeded, collapsed, skipped))
     return id_mapping
 
 
-def import_word_themes(migration_dir, db_config):
+def import_word_themes(migration_dir, db_config, reporter, id_map_dir=None, batch_size=DEFAULT_BATCH_SIZE,
+                       reject_sink=None, profiler=None):
     """Import word themes."""
     logger.info("Importing Word Themes...")
     csv_file = os.path.join(migration_dir, 'word_themes.sql')
@@ -576,16 +825,26 @@ def import_word_themes(migration_dir, db_config):
         logger.error("File not found: {}".format(csv_file))
         return {}
     
-    id_mapping = {}
-    count = 0
+    id_mapping = IdMapping(id_map_dir)
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 4:
+    progress = reporter.table('word_themes', total_bytes=os.path.getsize(csv_file))
+
+    def imported(legacy_id, new_id):
+        id_mapping[legacy_id] = new_id
+        progress.advance()
+
+    rejects = table_rejects(reject_sink, progress)
+
+    batch = psql_batch(db_config, """
+        INSERT INTO "WordTheme" (name, "moduleClass", "order")
+        VALUES ($1, $2, $3)
+    """, progress, batch_size, imported, rejects.reject)
+
+    with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+        batch = profile.batch(batch)
+        parse = profile.wrap('parse', parse_csv_line)
+        for offset, line, row in profile.read(export_rows(export, parse, progress=progress)):
+            if len(row) < 4:
                 continue
             
             legacy_id = int(row[0])
@@ -593,33 +852,86 @@ def import_word_themes(migration_dir, db_config):
             module_class = row[2] if row[2] != 'NULL' else ''
             order_val = row[3] if row[3] != 'NULL' else '0'
             
-            sql = """
-                INSERT INTO "WordTheme" (name, "moduleClass", "order")
-                VALUES ({}, {}, {})
-                RETURNING id;
-            """.format(
-                escape_sql_string(name),
-                escape_sql_string(module_class),
+            batch.execute((
+                name,
+                module_class,
                 order_val
-            )
-            
-            try:
-                result = run_psql_docker(db_config, sql)
-                for line_result in result.split('\n'):
-                    if line_result.strip().isdigit():
-                        new_id = int(line_result.strip())
-                        id_mapping[legacy_id] = new_id
-                        count += 1
-                        break
-            except Exception as e:
-                logger.warning("Failed to import word theme {}: {}".format(legacy_id, e))
-    
-    logger.info("Imported {} word themes".format(count))
+            ), legacy_id)
+        batch.finish()
+    
+    id_mapping.compact()
+    progress.finish()
+    rejects.finish()
+    logger.info("Imported {} word themes".format(batch.succeeded))
     return id_mapping
 
 
-def import_word_theme_relations(migration_dir, db_config, word_id_mapping, theme_id_mapping):
-    """Import word theme relations."""
+def _load_word_theme_relations(export, start, end, db_config, word_id_mapping, theme_id_mapping, rejects, profile,
+                                batch_size, imported):
+    """Import the WordThemeRelation rows in export[start:end]; returns (batch, skipped)."""
+    progress = rejects.progress
+    batch = profile.batch(psql_batch(db_config, """
+        INSERT INTO "WordThemeRelation" ("wordId", "themeId", "order")
+        VALUES ($1, $2, $3)
+    """, progress, batch_size, imported, rejects.reject))
+    parse = profile.wrap('parse', parse_csv_line)
+    skipped = 0
+
+    for offset, raw, row in profile.read(export_rows(export, parse, start, end, progress)):
+        if len(row) < 4:
+            continue
+        
+        legacy_word_id = int(row[1])
+        legacy_theme_id = int(row[2])
+        
+        new_word_id = word_id_mapping.get(legacy_word_id)
+        new_theme_id = theme_id_mapping.get(legacy_theme_id)
+        if new_word_id is None or new_theme_id is None:
+            skipped += 1
+            rejects.reject(row[0], 'missing_parent', offset, raw)
+            continue
+        
+        order_val = row[3] if row[3] != 'NULL' else '0'
+        
+        rejects.expect(row[0], offset, raw)
+        batch.execute((
+            new_word_id,
+            new_theme_id,
+            order_val
+        ), row[0])
+
+    batch.finish()
+    return batch, skipped
+
+
+def _import_word_theme_relations_shard(context, csv_file, start, end):
+    """Worker process: import one byte range of word_theme_relations.sql."""
+    db_config, word_id_mapping, theme_id_mapping, batch_size, rejects_dir, profile_settings = context
+    progress = shard_progress('word_theme_relations')
+    rejects = RejectSink(rejects_dir).table(progress, 'word_theme_relations.{}'.format(start))
+    profile = Profiler(*profile_settings).table(progress, 'word_theme_relations.{}'.format(start))
+
+    def imported(legacy_id, new_id):
+        progress.advance()
+
+    try:
+        with profile, ExportFile(csv_file) as export:
+            batch, skipped = _load_word_theme_relations(export, start, end, db_config, word_id_mapping,
+                                                        theme_id_mapping, rejects, profile, batch_size, imported)
+    finally:
+        flush_import_batch()
+    rejects.finish()
+    return ShardResult(start, end, progress.counters(), succeeded=batch.succeeded, failed=batch.failed,
+                       skipped=skipped)
+
+
+def import_word_theme_relations(migration_dir, db_config, word_id_mapping, theme_id_mapping, reporter,
+                                batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, reject_sink=None, profiler=None):
+    """Import word theme relations (in byte-range shards on `workers` processes if workers > 1).
+
+    Must run after import_words has returned, i.e. once the merged word id
+    mapping is complete; forked workers inherit the mappings as they are.
+    """
     logger.info("Importing Word Theme Relations...")
     csv_file = os.path.join(migration_dir, 'word_theme_relations.sql')
     
@@ -627,86 +939,216 @@ def import_word_theme_relations(migration_dir, db_config, word_id_mapping, theme
         logger.error("File not found: {}".format(csv_file))
         return
     
-    count = 0
-    skipped = 0
-    
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip().startswith('--') or not line.strip():
-                continue
-            
-            row = parse_csv_line(line)
-            if not row or len(row) < 4:
-                continue
-            
-            legacy_word_id = int(row[1])
-            legacy_theme_id = int(row[2])
-            
-            if legacy_word_id not in word_id_mapping or legacy_theme_id not in theme_id_mapping:
-                skipped += 1
-                continue
-            
-            order_val = row[3] if row[3] != 'NULL' else '0'
-            
-            sql = """
-                INSERT INTO "WordThemeRelation" ("wordId", "themeId", "order")
-                VALUES ({}, {}, {});
-            """.format(
-                word_id_mapping[legacy_word_id],
-                theme_id_mapping[legacy_theme_id],
-                order_val
-            )
-            
-            try:
-                run_psql_docker(db_config, sql)
-                count += 1
-                if count % 1000 == 0:
-                    logger.info("Imported {} word theme relations...".format(count))
-            except Exception as e:
-                skipped += 1
-                if 'unique' not in str(e).lower():
-                    logger.warning("Failed to import relation: {}".format(e))
+    progress = reporter.table('word_theme_relations', total_bytes=os.path.getsize(csv_file))
+    if _parse_cache is not None:
+        _parse_cache.prepare(csv_file)
+
+    if workers > 1:
+        succeeded = skipped = 0
+        ranges = []
+        context = (db_config, word_id_mapping, theme_id_mapping, batch_size, reject_sink and reject_sink.directory,
+                   profile_settings(profiler))
+        for result in run_sharded(csv_file, _import_word_theme_relations_shard, context, workers, progress):
+            ranges.append((result.start, result.end))
+            succeeded += result.succeeded
+            skipped += result.skipped + result.failed
+            logger.info("Imported {} word theme relations...".format(progress.rows))
+        if profiler is not None:
+            profiler.add(progress)
+        if _parse_cache is not None:
+            _parse_cache.assemble(csv_file, ranges)
+    else:
+        def imported(legacy_id, new_id):
+            progress.advance()
+            if progress.rows % 1000 == 0:
+                logger.info("Imported {} word theme relations...".format(progress.rows))
+
+        rejects = table_rejects(reject_sink, progress)
+        with table_profile(profiler, progress) as profile, ExportFile(csv_file) as export:
+            batch, skipped = _load_word_theme_relations(export, 0, None, db_config, word_id_mapping, theme_id_mapping,
+                                                        rejects, profile, batch_size, imported)
+        rejects.finish()
+        succeeded = batch.succeeded
+        skipped += batch.failed
     
-    logger.info("Imported {} word theme relations (skipped {} duplicates/errors)".format(count, skipped))
+    progress.finish()
+    logger.info("Imported {} word theme relations (skipped {} duplicates/errors)".format(succeeded, skipped))
 
 
 def main():
+    global _throttle, _parse_cache, _import_batch
+    parser = argparse.ArgumentParser(description='Import content data from storagebox using psql')
+    parser.add_argument('--progress-file', default=os.getenv('MIGRATION_PROGRESS_FILE'),
+                        help='Append per-table progress telemetry as JSON lines to this file')
+    parser.add_argument('--id-map-dir', default=os.getenv('MIGRATION_ID_MAP_DIR'),
+                        help='Spill the word/theme id mappings to mmap files in this directory')
+    parser.add_argument('--batch-size', type=int,
+                        default=int(os.getenv('MIGRATION_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+                        help='Rows per psql call and transaction (default: {})'.format(DEFAULT_BATCH_SIZE))
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Drop secondary indexes and foreign keys during the load and rebuild them afterwards')
+    parser.add_argument('--rebuild-workers', type=int, default=DEFAULT_REBUILD_WORKERS,
+                        help='Parallel sessions for index rebuilds in --bulk-load mode (default: {})'.format(
+                            DEFAULT_REBUILD_WORKERS))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('MIGRATION_WORKERS', DEFAULT_WORKERS)),
+                        help='Processes importing words and word theme relations in parallel shards '
+                             '(default: {})'.format(DEFAULT_WORKERS))
+    parser.add_argument('--rejects-dir', default=os.getenv('MIGRATION_REJECTS_DIR'),
+                        help='Write rejected rows to <table>.rejects.tsv files in this directory')
+    parser.add_argument('--profile', metavar='DIR', default=os.getenv('MIGRATION_PROFILE_DIR'),
+                        help='Profile each table: phase timings, stacks and a summary written to DIR')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='sample',
+                        help='sample: collapsed stacks for flame graphs; cprofile: pstats dumps (default: sample)')
+    parser.add_argument('--force', action='store_true',
+                        help='Import every table, even those already imported from this export')
+    parser.add_argument('--follow', action='store_true',
+                        help='Import while the export is still running, loading each table once it is published')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between manifest checks with --follow (default: {})'.format(
+                            DEFAULT_POLL_INTERVAL))
+    parser.add_argument('--follow-timeout', type=float,
+                        help='Give up after waiting this many seconds for one table with --follow')
+    parser.add_argument('--throttle', action='store_true', default=os.getenv('MIGRATION_THROTTLE') == '1',
+                        help='Adapt batch size and pace to the load on the shared database server')
+    parser.add_argument('--target-latency', type=float, default=DEFAULT_TARGET_LATENCY * 1000,
+                        help='Commit latency in ms above which --throttle backs off (default: {:g})'.format(
+                            DEFAULT_TARGET_LATENCY * 1000))
+    parser.add_argument('--max-active', type=int,
+                        help='With --throttle, back off while more other sessions than this are active')
+    parser.add_argument('--max-replication-lag', type=float,
+                        help='With --throttle, back off while a replica lags more than this many seconds')
+    parser.add_argument('--parse-cache', metavar='DIR', default=os.getenv('MIGRATION_PARSE_CACHE_DIR'),
+                        help='Keep the parsed export rows in DIR so reruns on the same export skip parsing')
+    parser.add_argument('--batch-id', default=os.getenv('MIGRATION_BATCH_ID'),
+                        help='Tag the new rows with this import batch id (default: a new id per run)')
+    parser.add_argument('--rollback', metavar='BATCH',
+                        help='Delete the rows inserted by import batch BATCH and exit')
+    parser.add_argument('--list-batches', action='store_true',
+                        help='List the recorded import batches and exit')
+    args = parser.parse_args()
+
     migration_dir = os.getenv('STORAGEBOX_PATH', '/srv/storagebox') + '/content-migration'
     db_url = os.getenv('DATABASE_URL')
     
     if not db_url:
         logger.error("DATABASE_URL environment variable required")
         return 1
+
+    db_config = parse_db_url(db_url)
+    if args.list_batches:
+        for line in list_batches(psql_runners(db_config)[0]) or ['No import batches recorded']:
+            logger.info(line)
+        return 0
+    if args.rollback:
+        try:
+            rollback_batch(*psql_runners(db_config), batch_id=args.rollback)
+        except (ValueError, RuntimeError) as e:
+            logger.error(str(e))
+            return 1
+        return 0
     
     if not os.path.exists(migration_dir):
         logger.error("Migration directory not found: {}".format(migration_dir))
         return 1
     
-    db_config = parse_db_url(db_url)
+    _import_batch = ImportBatch(*psql_runners(db_config), batch_id=args.batch_id)
     logger.info("=" * 60)
     logger.info("Importing Content Data from Storagebox")
     logger.info("=" * 60)
     logger.info("Migration directory: {}".format(migration_dir))
     logger.info("Database: {}:{}".format(db_config['host'], db_config['port']))
+    logger.info("Import batch: {}".format(_import_batch.batch_id))
     logger.info("=" * 60)
     
+    if args.throttle:
+        query, _ = psql_runners(db_config)
+        _throttle = AdaptiveThrottle(target_latency=args.target_latency / 1000.0, probe=server_probe(query),
+                                     max_active=args.max_active, max_lag=args.max_replication_lag)
+    if args.parse_cache:
+        _parse_cache = ParseCache(args.parse_cache)
+
+    reporter = ProgressReporter(args.progress_file, source='import-from-storagebox-simple')
+    reject_sink = RejectSink(args.rejects_dir)
+    profiler = Profiler(args.profile, args.profile_mode)
+    bulk_load = psql_bulk_load(db_config, args.rebuild_workers) if args.bulk_load else None
     try:
+        if bulk_load is not None:
+            bulk_load.prepare()
+
+        follower = None
+        if args.follow:
+            # Load each table as soon as the running export publishes it
+            follower = ManifestFollower(migration_dir, args.poll_interval, args.follow_timeout)
+            manifest = follower.manifest()
+            import_dir = None
+        else:
+            # Chunked (--transfer delta) exports are reassembled locally first
+            import_dir = materialize(migration_dir, [spec.filename for spec in TABLES])
+            manifest = ExportManifest.load(import_dir)
+            if not manifest.complete:
+                raise ValueError("Export run {} is still in progress; wait for it or import with --follow".format(
+                    manifest.run))
+
+        # Tables already imported from this export are skipped
+        state = ImportState(*psql_runners(db_config))
+        skipped = set() if args.force else state.skipped(manifest, TABLES)
+
+        def load(key, importer, *params, **options):
+            if key in skipped:
+                logger.info("Skipping {}: already imported from this export".format(key))
+                return {}
+            spec = get_table(key)
+            directory = import_dir
+            published = manifest
+            if follower is not None:
+                published = follower.wait(spec)
+                directory = materialize(migration_dir, [spec.filename])
+            if _parse_cache is not None:
+                register_export_digest(migration_dir, os.path.join(directory, spec.filename),
+                                       published.tables.get(spec.key))
+            result = importer(directory, db_config, *params, **options)
+            flush_import_batch()
+            state.record(spec, manifest)
+            return result
+
         # Import in correct order
-        language_id_mapping = import_languages(migration_dir, db_config)
-        grammar_course_id_mapping = import_grammar_courses(migration_dir, db_config, language_id_mapping)
-        phonetics_course_id_mapping = import_phonetics_courses(migration_dir, db_config, language_id_mapping)
-        songs_course_id_mapping = import_songs_courses(migration_dir, db_config, language_id_mapping)
+        language_id_mapping = load('languages', import_languages, reporter, batch_size=args.batch_size,
+                                   reject_sink=reject_sink, profiler=profiler)
+        grammar_course_id_mapping = load('grammar_courses', import_grammar_courses, language_id_mapping, reporter,
+                                         batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
+        phonetics_course_id_mapping = load('phonetics_courses', import_phonetics_courses, language_id_mapping,
+                                           reporter, batch_size=args.batch_size, reject_sink=reject_sink,
+                                           profiler=profiler)
+        songs_course_id_mapping = load('songs_courses', import_songs_courses, language_id_mapping, reporter,
+                                       batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
         
-        import_grammar_lessons(migration_dir, db_config, grammar_course_id_mapping)
-        import_phonetics_lessons(migration_dir, db_config, phonetics_course_id_mapping)
-        import_songs_lessons(migration_dir, db_config, songs_course_id_mapping)
+        load('grammar_lessons', import_grammar_lessons, grammar_course_id_mapping, reporter,
+             batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
+        load('phonetics_lessons', import_phonetics_lessons, phonetics_course_id_mapping, reporter,
+             batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
+        load('songs_lessons', import_songs_lessons, songs_course_id_mapping, reporter,
+             batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
         
-        word_id_mapping = import_words(migration_dir, db_config, language_id_mapping)
-        theme_id_mapping = import_word_themes(migration_dir, db_config)
-        import_word_theme_relations(migration_dir, db_config, word_id_mapping, theme_id_mapping)
+        word_id_mapping = load('words', import_words, language_id_mapping, reporter, args.id_map_dir,
+                               batch_size=args.batch_size, workers=args.workers, reject_sink=reject_sink,
+                               profiler=profiler)
+        theme_id_mapping = load('word_themes', import_word_themes, reporter, args.id_map_dir,
+                                batch_size=args.batch_size, reject_sink=reject_sink, profiler=profiler)
+        load('word_theme_relations', import_word_theme_relations, word_id_mapping, theme_id_mapping, reporter,
+             batch_size=args.batch_size, workers=args.workers, reject_sink=reject_sink, profiler=profiler)
+
+        if bulk_load is not None:
+            bulk_load.restore(analyze_tables=[spec.target for spec in TABLES])
+        reject_sink.close()
+        profiler.close()
+        reporter.close()
         
         logger.info("=" * 60)
         logger.info("Import completed successfully!")
+        logger.info("Import batch {}: {}; undo with --rollback {}".format(
+            _import_batch.batch_id, ', '.join('{} {}'.format(rows, table) for table, rows in
+                                              sorted(_import_batch.tagged().items())) or 'no new rows',
+            _import_batch.batch_id))
         logger.info("=" * 60)
         
         # Validate
@@ -729,7 +1171,21 @@ def main():
         
         return 0
     except Exception as e:
+        reject_sink.close()
+        profiler.close()
+        reporter.close('error')
         logger.error("Import failed: {}".format(e), exc_info=True)
+        try:
+            flush_import_batch()
+            logger.info("Rows committed so far are tagged with import batch {}; undo with --rollback {}".format(
+                _import_batch.batch_id, _import_batch.batch_id))
+        except Exception as flush_error:
+            logger.error("Could not record import batch {}: {}".format(_import_batch.batch_id, flush_error))
+        if bulk_load is not None and bulk_load.prepared:
+            try:
+                bulk_load.restore()
+            except Exception as restore_error:
+                logger.error("Could not restore indexes and foreign keys: {}".format(restore_error))
         return 1
 
 
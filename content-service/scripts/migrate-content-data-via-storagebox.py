@@ -11,10 +11,23 @@ Strategy:
 2. Import data from storagebox SQL files to new database
 
 Usage:
-    python migrate-content-data-via-storagebox.py [--dry-run] [--storagebox-path PATH]
+    python migrate-content-data-via-storagebox.py [--dry-run] [--sample-size N] [--storagebox-path PATH]
+                                                  [--progress-file PATH] [--id-map-dir DIR]
+                                                  [--batch-size N] [--commit-interval N]
+                                                  [--bulk-load [--rebuild-workers N]]
+                                                  [--backend savepoint|pipeline|copy]
+                                                  [--rejects-dir DIR] [--profile DIR [--profile-mode sample|cprofile]]
+                                                  [--legacy-db-url URL | --orm] [--force]
+                                                  [--transfer copy|delta [--transfer-workers N]]
+                                                  [--follow [--poll-interval S] [--follow-timeout S]]
+                                                  [--batch-id ID]
+    python migrate-content-data-via-storagebox.py --rollback BATCH | --list-batches
+
+    Options are described in --help and STORAGEBOX_MIGRATION_GUIDE.md.
 
 Environment Variables:
     STORAGEBOX_PATH - Path to storagebox mount (default: /srv/storagebox)
+    LEGACY_DATABASE_URL - Legacy database connection string (export)
     DATABASE_URL - New Prisma database connection string
 """
 
@@ -24,25 +37,29 @@ import argparse
 import logging
 import subprocess
 from datetime import datetime
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Setup Django environment (only needed for export, not import)
-DJANGO_AVAILABLE = False
-try:
-    import django
-    django.setup()
-    DJANGO_AVAILABLE = True
-    
-    from language.models import Language as LegacyLanguage
-    from grammar.models import GrammarCourse as LegacyGrammarCourse, GrammarLesson as LegacyGrammarLesson
-    from phonetics.models import PhoneticsCourse as LegacyPhoneticsCourse, PhoneticsLesson as LegacyPhoneticsLesson
-    from songs.models import SongsCourse as LegacySongsCourse, SongsLesson as LegacySongsLesson
-    from dictionary.models import Word as LegacyWord, WordTheme as LegacyWordTheme, WordThemeRelation as LegacyWordThemeRelation
-except Exception as e:
-    # Django not available - this is OK for import-only mode
-    if '--import-only' not in sys.argv and 'import' not in sys.argv:
-        print("Warning: Django setup failed: {}".format(e))
-        print("Django is required for export. For import-only, use --import-only flag")
-        # Don't exit - import doesn't need Django
+from content_migration.batching import DEFAULT_BATCH_SIZE, DEFAULT_COMMIT_INTERVAL, PipelineBatch, SavepointBatch
+from content_migration.bulkload import (
+    DEFAULT_REBUILD_WORKERS, BulkLoad, default_state_path, psycopg2_runners
+)
+from content_migration.copyload import CopyBatch
+from content_migration.dedup import KeyDeduplicator, word_key
+from content_migration.estimate import DEFAULT_SAMPLE_SIZE, ThroughputEstimator
+from content_migration.export import ExportWriter, format_export_row
+from content_migration.idmap import IdMapping
+from content_migration.importbatch import ImportBatch, list_batches, rollback as rollback_batch
+from content_migration.legacy import connect_legacy, django_reader
+from content_migration.manifest import DEFAULT_POLL_INTERVAL, ExportManifest, ImportState, ManifestFollower
+from content_migration.profiling import MODES as PROFILE_MODES, Profiler
+from content_migration.progress import ProgressReporter
+from content_migration.reader import ExportFile
+from content_migration.rejects import RejectSink
+from content_migration.tables import TABLES, count_export_rows, get_table, iter_export_lines, parse_export_line
+from content_migration.throttle import DEFAULT_TARGET_LATENCY, AdaptiveThrottle, server_probe
+from content_migration.transfer import DEFAULT_TRANSFER_WORKERS, TRANSFER_MODES, Publisher, materialize
 
 # Configure logging
 logging.basicConfig(
@@ -56,15 +73,59 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _split_fields(raw):
+    return raw.decode('utf-8').split(',')
+
+
+def _split_integer_fields(raw):
+    # Relations are all integers; no need to decode the line
+    return raw.split(b',')
+
+
 class StorageboxMigration:
     """Migrates content data using storagebox as intermediate storage."""
 
-    def __init__(self, storagebox_path=None, new_db_url=None, dry_run=False):
+    def __init__(self, storagebox_path=None, new_db_url=None, dry_run=False,
+                 sample_size=DEFAULT_SAMPLE_SIZE, progress_file=None, id_map_dir=None,
+                 batch_size=DEFAULT_BATCH_SIZE, commit_interval=DEFAULT_COMMIT_INTERVAL,
+                 bulk_load=False, rebuild_workers=DEFAULT_REBUILD_WORKERS, backend='savepoint',
+                 rejects_dir=None, profile_dir=None, profile_mode='sample', legacy_db_url=None, orm=False,
+                 force=False, transfer='copy', transfer_workers=DEFAULT_TRANSFER_WORKERS, follow=False,
+                 poll_interval=DEFAULT_POLL_INTERVAL, follow_timeout=None, throttle=False,
+                 target_latency=DEFAULT_TARGET_LATENCY, max_active=None, max_replication_lag=None, batch_id=None):
         self.dry_run = dry_run
+        self.force = force
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.follow_timeout = follow_timeout
+        self.throttle = throttle
+        self.target_latency = target_latency
+        self.max_active = max_active
+        self.max_replication_lag = max_replication_lag
+        self._throttle = None
+        self.batch_id = batch_id
+        self._import_batch = None
+        self.transfer = transfer
+        self.transfer_workers = transfer_workers
+        self.legacy_db_url = legacy_db_url or os.getenv('LEGACY_DATABASE_URL')
+        self.orm = orm
+        self._legacy = None
+        self.backend = backend
+        self.bulk_load = bulk_load
+        self.rebuild_workers = rebuild_workers
+        self.sample_size = sample_size
+        self.id_map_dir = id_map_dir
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.progress = ProgressReporter(progress_file, source='migrate-content-data-via-storagebox')
+        self.rejects = RejectSink(rejects_dir)
+        self.profiler = Profiler(profile_dir, profile_mode)
         self.storagebox_path = storagebox_path or os.getenv('STORAGEBOX_PATH', '/srv/storagebox')
         # Use temp directory first, then copy to storagebox
         self.temp_dir = '/tmp/content-migration-{}'.format(os.getpid())
         self.migration_dir = os.path.join(self.storagebox_path, 'content-migration')
+        # Where the importers read the export files (local copies of chunked files)
+        self.import_dir = self.migration_dir
         self.start_time = datetime.now()
         self.stats = {
             'languages': {'legacy': 0, 'new': 0},
@@ -91,6 +152,23 @@ class StorageboxMigration:
             logger.info("Temp directory: {}".format(self.temp_dir))
             logger.info("Migration directory: {}".format(self.migration_dir))
 
+    @property
+    def legacy(self):
+        """Reader of the legacy tables, opened on first use (see content_migration/legacy.py).
+
+        Raises:
+            ValueError: If neither a legacy database URL nor ORM mode is given
+        """
+        if self._legacy is None:
+            if self.orm:
+                self._legacy = django_reader()
+            elif self.legacy_db_url:
+                self._legacy = connect_legacy(self.legacy_db_url)
+            else:
+                raise ValueError("Export needs LEGACY_DATABASE_URL (or --legacy-db-url), or --orm to read "
+                                 "through the Django models from the speakasap-portal directory.")
+        return self._legacy
+
     def export_to_sql(self):
         """Export data from legacy database to SQL files on storagebox."""
         logger.info("=" * 60)
@@ -99,158 +177,139 @@ class StorageboxMigration:
 
         if self.dry_run:
             logger.info("DRY RUN: Would export data to storagebox")
+            if (self.orm or self.legacy_db_url) and self.sample_size:
+                self._estimate_export()
             return
-        
-        if not DJANGO_AVAILABLE:
-            raise ValueError("Django is required for export. Run this script from speakasap-portal directory with DJANGO_SETTINGS_MODULE set.")
-
-        # Export Languages
-        logger.info("Exporting Languages...")
-        languages = LegacyLanguage.objects.all().order_by('id')
-        self.stats['languages']['legacy'] = languages.count()
-        self._export_model_to_sql('languages', languages, [
-            'id', 'code', 'machine_name', 'name', 'icon', 'order', 'speaker'
-        ])
-
-        # Export Grammar Courses
-        logger.info("Exporting Grammar Courses...")
-        grammar_courses = LegacyGrammarCourse.objects.all().order_by('id')
-        self.stats['grammar_courses']['legacy'] = grammar_courses.count()
-        self._export_model_to_sql('grammar_courses', grammar_courses, [
-            'id', 'title', 'material_language', 'meta_keywords', 'meta_description', 'language_id'
-        ])
-
-        # Export Grammar Lessons
-        logger.info("Exporting Grammar Lessons...")
-        grammar_lessons = LegacyGrammarLesson.objects.all().order_by('id')
-        self.stats['grammar_lessons']['legacy'] = grammar_lessons.count()
-        self._export_model_to_sql('grammar_lessons', grammar_lessons, [
-            'id', 'title', 'course_id', 'template', 'alias', 'url', 'section', 
-            'teaser', 'order', 'meta_keywords', 'meta_description'
-        ])
-
-        # Export Phonetics Courses
-        logger.info("Exporting Phonetics Courses...")
-        phonetics_courses = LegacyPhoneticsCourse.objects.all().order_by('id')
-        self.stats['phonetics_courses']['legacy'] = phonetics_courses.count()
-        self._export_model_to_sql('phonetics_courses', phonetics_courses, [
-            'id', 'title', 'material_language', 'meta_keywords', 'meta_description', 'language_id'
-        ])
-
-        # Export Phonetics Lessons
-        logger.info("Exporting Phonetics Lessons...")
-        phonetics_lessons = LegacyPhoneticsLesson.objects.all().order_by('id')
-        self.stats['phonetics_lessons']['legacy'] = phonetics_lessons.count()
-        self._export_model_to_sql('phonetics_lessons', phonetics_lessons, [
-            'id', 'title', 'course_id', 'order', 'meta_keywords', 'meta_description'
-        ])
-
-        # Export Songs Courses
-        logger.info("Exporting Songs Courses...")
-        songs_courses = LegacySongsCourse.objects.all().order_by('id')
-        self.stats['songs_courses']['legacy'] = songs_courses.count()
-        self._export_model_to_sql('songs_courses', songs_courses, [
-            'id', 'title', 'material_language', 'language_id'
-        ])
-
-        # Export Songs Lessons
-        logger.info("Exporting Songs Lessons...")
-        songs_lessons = LegacySongsLesson.objects.all().order_by('id')
-        self.stats['songs_lessons']['legacy'] = songs_lessons.count()
-        self._export_model_to_sql('songs_lessons', songs_lessons, [
-            'id', 'title', 'course_id', 'order'
-        ])
-
-        # Export Words
-        logger.info("Exporting Words...")
-        words = LegacyWord.objects.all().order_by('id')
-        self.stats['words']['legacy'] = words.count()
-        self._export_model_to_sql('words', words, [
-            'id', 'word', 'transcription', 'translation', 'language_id'
-        ])
-
-        # Export Word Themes
-        logger.info("Exporting Word Themes...")
-        word_themes = LegacyWordTheme.objects.all().order_by('id')
-        self.stats['word_themes']['legacy'] = word_themes.count()
-        self._export_model_to_sql('word_themes', word_themes, [
-            'id', 'name', 'module_class', 'order'
-        ])
-
-        # Export Word Theme Relations
-        logger.info("Exporting Word Theme Relations...")
-        word_theme_relations = LegacyWordThemeRelation.objects.all().order_by('id')
-        self.stats['word_theme_relations']['legacy'] = word_theme_relations.count()
-        self._export_model_to_sql('word_theme_relations', word_theme_relations, [
-            'id', 'word_id', 'theme_id', 'order'
-        ])
-
-        # Copy files to storagebox
-        logger.info("Copying files to storagebox...")
+
+        legacy = self.legacy
+        manifest = ExportManifest() if self.force else ExportManifest.load(self.migration_dir)
+        fingerprints = {}
+        for spec in TABLES:
+            fingerprint = legacy.fingerprint(spec)
+            self.stats[spec.key]['legacy'] = fingerprint.rows
+            if manifest.unchanged(spec, fingerprint, self.migration_dir):
+                logger.info("Skipping {}: unchanged since the last export ({})".format(spec.key, fingerprint))
+            else:
+                fingerprints[spec.key] = fingerprint
+                manifest.expect(spec, fingerprint)
+        manifest.start()
+
+        # Each table is published to storagebox as soon as it is exported, so
+        # an import following the manifest can start on it straight away
+        publisher = None
         try:
             os.makedirs(self.migration_dir, exist_ok=True)
-            import shutil
-            for filename in os.listdir(self.temp_dir):
-                if filename.endswith('.sql'):
-                    shutil.copy2(
-                        os.path.join(self.temp_dir, filename),
-                        os.path.join(self.migration_dir, filename)
-                    )
-            logger.info("✓ Files copied to: {}".format(self.migration_dir))
+            publisher = Publisher(self.migration_dir, self.transfer, self.transfer_workers)
+            manifest.save(self.migration_dir)
+            logger.info("Export run {} publishing to storagebox ({} transfer)".format(manifest.run, self.transfer))
         except PermissionError:
+            publisher = None
             logger.warning("⚠ Cannot write to storagebox (permission denied)")
+
+        for spec in TABLES:
+            if spec.key not in fingerprints:
+                continue
+            logger.info("Exporting {}...".format(spec.key.replace('_', ' ').title()))
+            self._export_table(spec, legacy.rows(spec))
+            sql_file = os.path.join(self.temp_dir, spec.filename)
+            manifest.record(spec, fingerprints[spec.key], sql_file)
+            if publisher is not None:
+                try:
+                    publisher.publish(sql_file)
+                    manifest.save(self.migration_dir)
+                except PermissionError:
+                    publisher = None
+                    logger.warning("⚠ Cannot write to storagebox (permission denied)")
+
+        manifest.complete = True
+        manifest.save(self.temp_dir)
+        if publisher is not None:
+            manifest.save(self.migration_dir)
+            publisher.finish()
+            logger.info("✓ Files copied to: {}".format(self.migration_dir))
+        else:
             logger.warning("Files are in: {}".format(self.temp_dir))
             logger.warning("Please copy manually: sudo cp -r {}/* {}".format(self.temp_dir, self.migration_dir))
         
         logger.info("Export completed. Files saved to: {}".format(self.migration_dir))
 
-    def _export_model_to_sql(self, model_name, queryset, fields):
-        """Export a model queryset to SQL INSERT statements."""
+    def _export_table(self, spec, rows):
+        """Export a table's rows (tuples of spec.export_fields) through the chunked writer."""
+        model_name = spec.key
         sql_file = os.path.join(self.temp_dir, '{}.sql'.format(model_name))
         
-        with open(sql_file, 'w', encoding='utf-8') as f:
+        progress = self.progress.table('export:{}'.format(model_name), total_rows=self.stats[model_name]['legacy'])
+
+        # Profile phases: read is the legacy cursor, transform the formatting
+        with self.profiler.table(progress, 'export-{}'.format(model_name)) as profile, \
+                open(sql_file, 'w', encoding='utf-8') as f:
             f.write("-- {} data export\n".format(model_name))
             f.write("-- Generated: {}\n\n".format(datetime.now().isoformat()))
-            
-            count = 0
-            for obj in queryset:
-                values = []
-                for field in fields:
-                    value = getattr(obj, field, None)
-                    if value is None:
-                        values.append('NULL')
-                    elif isinstance(value, str):
-                        # Escape single quotes
-                        escaped = value.replace("'", "''")
-                        values.append("'{}'".format(escaped))
-                    elif isinstance(value, bool):
-                        values.append('TRUE' if value else 'FALSE')
-                    else:
-                        values.append(str(value))
-                
-                # Write as CSV-like format for easier import
-                f.write(','.join(values) + '\n')
-                count += 1
-                
-                if count % 1000 == 0:
-                    logger.info("Exported {} {} records...".format(count, model_name))
-                    f.flush()
 
+            def written(count):
+                logger.info("Exported {} {} records...".format(count, model_name))
+
+            # Write as CSV-like format for easier import
+            writer = ExportWriter(f, progress, on_chunk=written)
+            writer.flush = profile.wrap('write', writer.flush)
+            count = writer.write_all(profile.read(rows))
+
+        progress.finish()
         logger.info("Exported {} {} records to {}".format(count, model_name, sql_file))
 
-    def import_from_sql(self):
-        """Import data from storagebox SQL files to new database."""
-        logger.info("=" * 60)
-        logger.info("Importing Data from Storagebox")
-        logger.info("=" * 60)
+    def _estimate_export(self):
+        """Sample every legacy table through the export path and log projections."""
+        estimator = ThroughputEstimator(sample_size=self.sample_size)
+        legacy = self.legacy
+        for spec in TABLES:
+            self.stats[spec.key]['legacy'] = legacy.count(spec)
+            estimator.estimate_table(
+                spec, self.stats[spec.key]['legacy'],
+                legacy.rows(spec, limit=self.sample_size),
+                serialize=format_export_row,
+                transform=False,
+            )
+        estimator.log_report()
 
-        if self.dry_run:
-            logger.info("DRY RUN: Would import data from storagebox")
-            return
+    def _estimate_import(self):
+        """Sample every export file through the import path and log projections.
 
+        Sample inserts are only timed when DATABASE_URL is set; they run in
+        one transaction that is rolled back.
+        """
         new_db_url = os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL')
-        if not new_db_url:
-            raise ValueError("DATABASE_URL or NEW_DATABASE_URL environment variable required")
+        conn = self._connect(new_db_url) if new_db_url else None
+        estimator = ThroughputEstimator(conn, sample_size=self.sample_size)
+        self.import_dir = materialize(self.migration_dir, [spec.filename for spec in TABLES])
+        try:
+            for spec in TABLES:
+                sql_file = os.path.join(self.import_dir, spec.filename)
+                if not os.path.exists(sql_file):
+                    logger.warning("Skipping {} estimate: {} not found".format(spec.key, sql_file))
+                    continue
+                with open(sql_file, 'r', encoding='utf-8') as f:
+                    lines = (line for line in f if line.strip() and not line.startswith('--'))
+                    estimator.estimate_table(
+                        spec, count_export_rows(sql_file), lines, to_row=parse_export_line
+                    )
+        finally:
+            estimator.finish()
+            if conn is not None:
+                conn.close()
+        estimator.log_report()
+
+    def _connect(self, new_db_url):
+        """Open a connection to the new database (autocommit off).
+
+        psycopg 3 for the pipeline backend, psycopg2 otherwise.
+        """
+        if self.backend == 'pipeline':
+            try:
+                import psycopg
+            except ImportError:
+                logger.error('psycopg 3 not available. Please install: pip3 install --user "psycopg[binary]"')
+                raise
+            return psycopg.connect(new_db_url, autocommit=False)
 
         # Try to import psycopg2, add user site-packages to path if needed
         try:
@@ -269,69 +328,194 @@ class StorageboxMigration:
 
         conn = psycopg2.connect(new_db_url)
         conn.autocommit = False
+        return conn
+
+    def import_from_sql(self):
+        """Import data from storagebox SQL files to new database."""
+        logger.info("=" * 60)
+        logger.info("Importing Data from Storagebox")
+        logger.info("=" * 60)
+
+        if self.dry_run:
+            logger.info("DRY RUN: Would import data from storagebox")
+            if self.sample_size:
+                self._estimate_import()
+            return
+
+        new_db_url = os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL')
+        if not new_db_url:
+            raise ValueError("DATABASE_URL or NEW_DATABASE_URL environment variable required")
+
+        query, execute = psycopg2_runners(lambda: self._connect(new_db_url))
+        if self.throttle:
+            self._throttle = AdaptiveThrottle(target_latency=self.target_latency, probe=server_probe(query),
+                                              max_active=self.max_active, max_lag=self.max_replication_lag)
+        self._import_batch = ImportBatch(query, execute, batch_id=self.batch_id)
+        logger.info("Import batch: {}".format(self._import_batch.batch_id))
+        bulk_load = None
+        if self.bulk_load:
+            bulk_load = BulkLoad(query, execute, default_state_path(urlparse(new_db_url).path.lstrip('/')),
+                                 workers=self.rebuild_workers)
+            bulk_load.prepare()
+
+        follower = None
+        if self.follow:
+            # Load each table as soon as the running export publishes it
+            follower = ManifestFollower(self.migration_dir, self.poll_interval, self.follow_timeout)
+            manifest = follower.manifest()
+        else:
+            self.import_dir = materialize(self.migration_dir, [spec.filename for spec in TABLES])
+            manifest = ExportManifest.load(self.import_dir)
+            if not manifest.complete:
+                raise ValueError("Export run {} is still in progress; wait for it or import with --follow".format(
+                    manifest.run))
+
+        # Tables already imported from these export files are skipped
+        state = ImportState(query, execute)
+        skipped = set() if self.force else state.skipped(manifest, TABLES)
+
+        conn = self._connect(new_db_url)
         cursor = conn.cursor()
 
+        def load(key, method, *args):
+            if key in skipped:
+                logger.info("Skipping {}: already imported from this export".format(key))
+                return {}
+            if follower is not None:
+                spec = get_table(key)
+                follower.wait(spec)
+                self.import_dir = materialize(self.migration_dir, [spec.filename])
+            result = method(cursor, *args)
+            self._import_batch.flush()
+            return result
+
         try:
             # Import in correct order to preserve referential integrity
-            language_id_mapping = self._import_languages(cursor)
-            grammar_course_id_mapping = self._import_grammar_courses(cursor, language_id_mapping)
-            phonetics_course_id_mapping = self._import_phonetics_courses(cursor, language_id_mapping)
-            songs_course_id_mapping = self._import_songs_courses(cursor, language_id_mapping)
+            language_id_mapping = load('languages', self._import_languages)
+            grammar_course_id_mapping = load('grammar_courses', self._import_grammar_courses, language_id_mapping)
+            phonetics_course_id_mapping = load('phonetics_courses', self._import_phonetics_courses,
+                                               language_id_mapping)
+            songs_course_id_mapping = load('songs_courses', self._import_songs_courses, language_id_mapping)
             
-            self._import_grammar_lessons(cursor, grammar_course_id_mapping)
-            self._import_phonetics_lessons(cursor, phonetics_course_id_mapping)
-            self._import_songs_lessons(cursor, songs_course_id_mapping)
+            load('grammar_lessons', self._import_grammar_lessons, grammar_course_id_mapping)
+            load('phonetics_lessons', self._import_phonetics_lessons, phonetics_course_id_mapping)
+            load('songs_lessons', self._import_songs_lessons, songs_course_id_mapping)
             
-            word_id_mapping = self._import_words(cursor, language_id_mapping)
-            theme_id_mapping = self._import_word_themes(cursor)
-            self._import_word_theme_relations(cursor, word_id_mapping, theme_id_mapping)
+            word_id_mapping = load('words', self._import_words, language_id_mapping)
+            theme_id_mapping = load('word_themes', self._import_word_themes)
+            load('word_theme_relations', self._import_word_theme_relations, word_id_mapping, theme_id_mapping)
 
             conn.commit()
+            for spec in TABLES:
+                if spec.key not in skipped:
+                    state.record(spec, manifest)
             logger.info("Import completed successfully")
+            logger.info("Import batch {}: {}; undo with --rollback {}".format(
+                self._import_batch.batch_id, ', '.join('{} {}'.format(rows, table) for table, rows in
+                                                       sorted(self._import_batch.tagged().items())) or 'no new rows',
+                self._import_batch.batch_id))
 
         except Exception as e:
             conn.rollback()
             logger.error("Import failed: {}".format(e), exc_info=True)
-            raise
-        finally:
+            if self.commit_interval:
+                logger.error("Batches committed before the failure remain in the database")
+                try:
+                    self._import_batch.flush()
+                    logger.info("They are tagged with import batch {}; undo with --rollback {}".format(
+                        self._import_batch.batch_id, self._import_batch.batch_id))
+                except Exception as flush_error:
+                    logger.error("Could not record import batch {}: {}".format(
+                        self._import_batch.batch_id, flush_error))
             cursor.close()
             conn.close()
+            if bulk_load is not None:
+                try:
+                    bulk_load.restore()
+                except Exception as restore_error:
+                    logger.error("Could not restore indexes and foreign keys: {}".format(restore_error))
+            raise
+
+        cursor.close()
+        conn.close()
+        if bulk_load is not None:
+            # After the import connection is closed, so the rebuild does not
+            # wait on its locks
+            bulk_load.restore(analyze_tables=[spec.target for spec in TABLES])
+
+    def _runners(self):
+        """(query, execute) runners on the new database."""
+        new_db_url = os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL')
+        if not new_db_url:
+            raise ValueError("DATABASE_URL or NEW_DATABASE_URL environment variable required")
+        return psycopg2_runners(lambda: self._connect(new_db_url))
+
+    def list_import_batches(self):
+        """Log the import batches recorded in the new database."""
+        for line in list_batches(self._runners()[0]) or ['No import batches recorded']:
+            logger.info(line)
+
+    def rollback_import_batch(self, batch_id):
+        """Delete the rows inserted by import batch batch_id from the new database."""
+        rollback_batch(*self._runners(), batch_id=batch_id)
+
+    def _batch(self, cursor, rejects, on_success, table):
+        """Batch for one table; rows the database rejects go to the table's rejects.
+
+        The new rows of table are recorded in the run's import batch.
+        """
+        batch_class = {'pipeline': PipelineBatch, 'copy': CopyBatch}.get(self.backend, SavepointBatch)
+        if self._import_batch is not None:
+            on_success = self._import_batch.recorder(table, on_success)
+        return batch_class(cursor, on_success, rejects.reject, batch_size=self.batch_size,
+                           commit_interval=self.commit_interval, progress=rejects.progress,
+                           throttle=self._throttle)
 
     def _import_languages(self, cursor):
         """Import languages and return ID mapping."""
         logger.info("Importing Languages...")
-        sql_file = os.path.join(self.migration_dir, 'languages.sql')
+        sql_file = os.path.join(self.import_dir, 'languages.sql')
         id_mapping = {}
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                if line.strip().startswith('--') or not line.strip():
-                    continue
+        progress = self.progress.table('languages', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+            if len(id_mapping) % 10 == 0:
+                logger.info("Imported {} languages...".format(len(id_mapping)))
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'Language'))
+
+            with open(sql_file, 'rb') as f:
+                for line_num, line in enumerate(profile.read(iter_export_lines(f, progress)), 1):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                parts = line.strip().split(',')
-                if len(parts) < 7:
-                    continue
+                    parts = line.strip().split(',')
+                    if len(parts) < 7:
+                        continue
                 
-                legacy_id = int(parts[0])
-                code = parts[1].strip("'")
-                machine_name = parts[2].strip("'")
-                name = parts[3].strip("'")
-                icon_path = parts[4].strip("'") if parts[4] != 'NULL' else ''
-                order_val = int(parts[5]) if parts[5] != 'NULL' else 0
-                speaker = parts[6].strip("'") if len(parts) > 6 and parts[6] != 'NULL' else 'носитель'
-                
-                cursor.execute("""
-                    INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (code, machine_name, name, icon_path, order_val, speaker))
-                
-                new_id = cursor.fetchone()[0]
-                id_mapping[legacy_id] = new_id
-                
-                if len(id_mapping) % 10 == 0:
-                    logger.info("Imported {} languages...".format(len(id_mapping)))
+                    legacy_id = int(parts[0])
+                    code = parts[1].strip("'")
+                    machine_name = parts[2].strip("'")
+                    name = parts[3].strip("'")
+                    icon_path = parts[4].strip("'") if parts[4] != 'NULL' else ''
+                    order_val = int(parts[5]) if parts[5] != 'NULL' else 0
+                    speaker = parts[6].strip("'") if len(parts) > 6 and parts[6] != 'NULL' else 'носитель'
+                
+                    batch.execute("""
+                        INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (code, machine_name, name, icon_path, order_val, speaker), legacy_id)
         
+            batch.finish()
+        progress.finish()
+        rejects.finish()
         self.stats['languages']['new'] = len(id_mapping)
         logger.info("Imported {} languages".format(len(id_mapping)))
         return id_mapping
@@ -339,39 +523,50 @@ class StorageboxMigration:
     def _import_grammar_courses(self, cursor, language_id_mapping):
         """Import grammar courses and return ID mapping."""
         logger.info("Importing Grammar Courses...")
-        sql_file = os.path.join(self.migration_dir, 'grammar_courses.sql')
+        sql_file = os.path.join(self.import_dir, 'grammar_courses.sql')
         id_mapping = {}
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 6:
-                    continue
+        progress = self.progress.table('grammar_courses', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'GrammarCourse'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                legacy_id = int(parts[0])
-                legacy_lang_id = int(parts[5])
+                    parts = line.strip().split(',')
+                    if len(parts) < 6:
+                        continue
                 
-                if legacy_lang_id not in language_id_mapping:
-                    logger.warning("Skipping grammar course {}: language_id {} not found".format(legacy_id, legacy_lang_id))
-                    continue
+                    legacy_id = int(parts[0])
+                    legacy_lang_id = int(parts[5])
                 
-                title = parts[1].strip("'")
-                material_lang = parts[2].strip("'") if parts[2] != 'NULL' else 'ru'
-                meta_keywords = parts[3].strip("'") if parts[3] != 'NULL' else None
-                meta_description = parts[4].strip("'") if parts[4] != 'NULL' else None
+                    if legacy_lang_id not in language_id_mapping:
+                        rejects.reject(legacy_id, 'missing_parent', line=line)
+                        continue
                 
-                cursor.execute("""
-                    INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (title, material_lang, meta_keywords, meta_description, language_id_mapping[legacy_lang_id]))
+                    title = parts[1].strip("'")
+                    material_lang = parts[2].strip("'") if parts[2] != 'NULL' else 'ru'
+                    meta_keywords = parts[3].strip("'") if parts[3] != 'NULL' else None
+                    meta_description = parts[4].strip("'") if parts[4] != 'NULL' else None
                 
-                new_id = cursor.fetchone()[0]
-                id_mapping[legacy_id] = new_id
+                    batch.execute("""
+                        INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (title, material_lang, meta_keywords, meta_description, language_id_mapping[legacy_lang_id]), legacy_id)
         
+            batch.finish()
+        progress.finish()
+        rejects.finish()
         self.stats['grammar_courses']['new'] = len(id_mapping)
         logger.info("Imported {} grammar courses".format(len(id_mapping)))
         return id_mapping
@@ -379,83 +574,107 @@ class StorageboxMigration:
     def _import_grammar_lessons(self, cursor, course_id_mapping):
         """Import grammar lessons."""
         logger.info("Importing Grammar Lessons...")
-        sql_file = os.path.join(self.migration_dir, 'grammar_lessons.sql')
-        count = 0
+        sql_file = os.path.join(self.import_dir, 'grammar_lessons.sql')
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 11:
-                    continue
+        progress = self.progress.table('grammar_lessons', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            progress.advance()
+            if progress.rows % 100 == 0:
+                logger.info("Imported {} grammar lessons...".format(progress.rows))
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'GrammarLesson'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                legacy_course_id = int(parts[2])
-                if legacy_course_id not in course_id_mapping:
-                    continue
+                    parts = line.strip().split(',')
+                    if len(parts) < 11:
+                        continue
                 
-                cursor.execute("""
-                    INSERT INTO "GrammarLesson" (
-                        title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    parts[1].strip("'"),
-                    course_id_mapping[legacy_course_id],
-                    parts[3].strip("'"),
-                    parts[4].strip("'") if parts[4] != 'NULL' else None,
-                    parts[5].strip("'"),
-                    parts[6].strip("'") if parts[6] != 'NULL' else None,
-                    parts[7].strip("'") if parts[7] != 'NULL' else None,
-                    int(parts[8]) if parts[8] != 'NULL' else 0,
-                    parts[9].strip("'") if parts[9] != 'NULL' else None,
-                    parts[10].strip("'") if parts[10] != 'NULL' else None,
-                ))
-                count += 1
+                    legacy_course_id = int(parts[2])
+                    if legacy_course_id not in course_id_mapping:
+                        rejects.reject(parts[0], 'missing_parent', line=line)
+                        continue
                 
-                if count % 100 == 0:
-                    logger.info("Imported {} grammar lessons...".format(count))
+                    batch.execute("""
+                        INSERT INTO "GrammarLesson" (
+                            title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
+                        )
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        course_id_mapping[legacy_course_id],
+                        parts[3].strip("'"),
+                        parts[4].strip("'") if parts[4] != 'NULL' else None,
+                        parts[5].strip("'"),
+                        parts[6].strip("'") if parts[6] != 'NULL' else None,
+                        parts[7].strip("'") if parts[7] != 'NULL' else None,
+                        int(parts[8]) if parts[8] != 'NULL' else 0,
+                        parts[9].strip("'") if parts[9] != 'NULL' else None,
+                        parts[10].strip("'") if parts[10] != 'NULL' else None,
+                    ), parts[0])
         
-        self.stats['grammar_lessons']['new'] = count
-        logger.info("Imported {} grammar lessons".format(count))
+            batch.finish()
+        progress.finish()
+        rejects.finish()
+        self.stats['grammar_lessons']['new'] = batch.succeeded
+        logger.info("Imported {} grammar lessons".format(batch.succeeded))
 
     def _import_phonetics_courses(self, cursor, language_id_mapping):
         """Import phonetics courses and return ID mapping."""
         logger.info("Importing Phonetics Courses...")
-        sql_file = os.path.join(self.migration_dir, 'phonetics_courses.sql')
+        sql_file = os.path.join(self.import_dir, 'phonetics_courses.sql')
         id_mapping = {}
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 6:
-                    continue
+        progress = self.progress.table('phonetics_courses', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'PhoneticsCourse'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                legacy_id = int(parts[0])
-                legacy_lang_id = int(parts[5])
+                    parts = line.strip().split(',')
+                    if len(parts) < 6:
+                        continue
                 
-                if legacy_lang_id not in language_id_mapping:
-                    continue
+                    legacy_id = int(parts[0])
+                    legacy_lang_id = int(parts[5])
                 
-                cursor.execute("""
-                    INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    parts[1].strip("'"),
-                    parts[2].strip("'") if parts[2] != 'NULL' else 'ru',
-                    parts[3].strip("'") if parts[3] != 'NULL' else None,
-                    parts[4].strip("'") if parts[4] != 'NULL' else None,
-                    language_id_mapping[legacy_lang_id]
-                ))
+                    if legacy_lang_id not in language_id_mapping:
+                        rejects.reject(legacy_id, 'missing_parent', line=line)
+                        continue
                 
-                new_id = cursor.fetchone()[0]
-                id_mapping[legacy_id] = new_id
+                    batch.execute("""
+                        INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        parts[2].strip("'") if parts[2] != 'NULL' else 'ru',
+                        parts[3].strip("'") if parts[3] != 'NULL' else None,
+                        parts[4].strip("'") if parts[4] != 'NULL' else None,
+                        language_id_mapping[legacy_lang_id]
+                    ), legacy_id)
         
+            batch.finish()
+        progress.finish()
+        rejects.finish()
         self.stats['phonetics_courses']['new'] = len(id_mapping)
         logger.info("Imported {} phonetics courses".format(len(id_mapping)))
         return id_mapping
@@ -463,71 +682,96 @@ class StorageboxMigration:
     def _import_phonetics_lessons(self, cursor, course_id_mapping):
         """Import phonetics lessons."""
         logger.info("Importing Phonetics Lessons...")
-        sql_file = os.path.join(self.migration_dir, 'phonetics_lessons.sql')
-        count = 0
+        sql_file = os.path.join(self.import_dir, 'phonetics_lessons.sql')
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
+        progress = self.progress.table('phonetics_lessons', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'PhoneticsLesson'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                parts = line.strip().split(',')
-                if len(parts) < 6:
-                    continue
+                    parts = line.strip().split(',')
+                    if len(parts) < 6:
+                        continue
                 
-                legacy_course_id = int(parts[2])
-                if legacy_course_id not in course_id_mapping:
-                    continue
+                    legacy_course_id = int(parts[2])
+                    if legacy_course_id not in course_id_mapping:
+                        rejects.reject(parts[0], 'missing_parent', line=line)
+                        continue
                 
-                cursor.execute("""
-                    INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    parts[1].strip("'"),
-                    course_id_mapping[legacy_course_id],
-                    int(parts[3]),
-                    parts[4].strip("'") if parts[4] != 'NULL' else None,
-                    parts[5].strip("'") if parts[5] != 'NULL' else None,
-                ))
-                count += 1
+                    batch.execute("""
+                        INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        course_id_mapping[legacy_course_id],
+                        int(parts[3]),
+                        parts[4].strip("'") if parts[4] != 'NULL' else None,
+                        parts[5].strip("'") if parts[5] != 'NULL' else None,
+                    ), parts[0])
         
-        self.stats['phonetics_lessons']['new'] = count
-        logger.info("Imported {} phonetics lessons".format(count))
+            batch.finish()
+        progress.finish()
+        rejects.finish()
+        self.stats['phonetics_lessons']['new'] = batch.succeeded
+        logger.info("Imported {} phonetics lessons".format(batch.succeeded))
 
     def _import_songs_courses(self, cursor, language_id_mapping):
         """Import songs courses and return ID mapping."""
         logger.info("Importing Songs Courses...")
-        sql_file = os.path.join(self.migration_dir, 'songs_courses.sql')
+        sql_file = os.path.join(self.import_dir, 'songs_courses.sql')
         id_mapping = {}
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 4:
-                    continue
+        progress = self.progress.table('songs_courses', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'SongsCourse'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                legacy_id = int(parts[0])
-                legacy_lang_id = int(parts[3])
+                    parts = line.strip().split(',')
+                    if len(parts) < 4:
+                        continue
                 
-                if legacy_lang_id not in language_id_mapping:
-                    continue
+                    legacy_id = int(parts[0])
+                    legacy_lang_id = int(parts[3])
                 
-                cursor.execute("""
-                    INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                """, (
-                    parts[1].strip("'"),
-                    parts[2].strip("'") if parts[2] != 'NULL' else 'ru',
-                    language_id_mapping[legacy_lang_id]
-                ))
+                    if legacy_lang_id not in language_id_mapping:
+                        rejects.reject(legacy_id, 'missing_parent', line=line)
+                        continue
                 
-                new_id = cursor.fetchone()[0]
-                id_mapping[legacy_id] = new_id
+                    batch.execute("""
+                        INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
+                        VALUES (%s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        parts[2].strip("'") if parts[2] != 'NULL' else 'ru',
+                        language_id_mapping[legacy_lang_id]
+                    ), legacy_id)
         
+            batch.finish()
+        progress.finish()
+        rejects.finish()
         self.stats['songs_courses']['new'] = len(id_mapping)
         logger.info("Imported {} songs courses".format(len(id_mapping)))
         return id_mapping
@@ -535,114 +779,155 @@ class StorageboxMigration:
     def _import_songs_lessons(self, cursor, course_id_mapping):
         """Import songs lessons."""
         logger.info("Importing Songs Lessons...")
-        sql_file = os.path.join(self.migration_dir, 'songs_lessons.sql')
-        count = 0
+        sql_file = os.path.join(self.import_dir, 'songs_lessons.sql')
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
+        progress = self.progress.table('songs_lessons', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'SongsLesson'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                parts = line.strip().split(',')
-                if len(parts) < 4:
-                    continue
+                    parts = line.strip().split(',')
+                    if len(parts) < 4:
+                        continue
                 
-                legacy_course_id = int(parts[2])
-                if legacy_course_id not in course_id_mapping:
-                    continue
+                    legacy_course_id = int(parts[2])
+                    if legacy_course_id not in course_id_mapping:
+                        rejects.reject(parts[0], 'missing_parent', line=line)
+                        continue
                 
-                cursor.execute("""
-                    INSERT INTO "SongsLesson" (title, "courseId", "order")
-                    VALUES (%s, %s, %s)
-                """, (
-                    parts[1].strip("'"),
-                    course_id_mapping[legacy_course_id],
-                    int(parts[3])
-                ))
-                count += 1
+                    batch.execute("""
+                        INSERT INTO "SongsLesson" (title, "courseId", "order")
+                        VALUES (%s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        course_id_mapping[legacy_course_id],
+                        int(parts[3])
+                    ), parts[0])
         
-        self.stats['songs_lessons']['new'] = count
-        logger.info("Imported {} songs lessons".format(count))
+            batch.finish()
+        progress.finish()
+        rejects.finish()
+        self.stats['songs_lessons']['new'] = batch.succeeded
+        logger.info("Imported {} songs lessons".format(batch.succeeded))
 
     def _import_words(self, cursor, language_id_mapping):
         """Import words and return ID mapping."""
         logger.info("Importing Words...")
-        sql_file = os.path.join(self.migration_dir, 'words.sql')
-        id_mapping = {}
+        sql_file = os.path.join(self.import_dir, 'words.sql')
+        id_mapping = IdMapping(self.id_map_dir)
+        dedup = KeyDeduplicator(self.id_map_dir)
         skipped = 0
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
+        progress = self.progress.table('words', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+            if progress.rows % 1000 == 0:
+                logger.info("Imported {} words...".format(progress.rows))
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'Word'))
+            parse = profile.wrap('parse', _split_fields)
+
+            with ExportFile(sql_file) as export:
+                for offset, raw in profile.read(export.lines(progress=progress, offsets=True)):
+                    parts = parse(raw)
+                    if len(parts) < 5:
+                        continue
                 
-                parts = line.strip().split(',')
-                if len(parts) < 5:
-                    continue
+                    legacy_id = int(parts[0])
+                    legacy_lang_id = int(parts[4])
                 
-                legacy_id = int(parts[0])
-                legacy_lang_id = int(parts[4])
+                    if legacy_lang_id not in language_id_mapping:
+                        skipped += 1
+                        rejects.reject(legacy_id, 'missing_parent', offset, raw)
+                        continue
                 
-                if legacy_lang_id not in language_id_mapping:
-                    skipped += 1
-                    continue
+                    word = parts[1].strip("'")
+                    translation = parts[3].strip("'") if parts[3] != 'NULL' else None
+                    if not dedup.add(word_key(word, legacy_lang_id, translation), legacy_id):
+                        continue
                 
-                try:
-                    cursor.execute("""
+                    rejects.expect(legacy_id, offset, raw)
+                    batch.execute("""
                         INSERT INTO "Word" (word, transcription, translation, "languageId")
                         VALUES (%s, %s, %s, %s)
                         RETURNING id
                     """, (
-                        parts[1].strip("'"),
+                        word,
                         parts[2].strip("'") if parts[2] != 'NULL' else None,
-                        parts[3].strip("'") if parts[3] != 'NULL' else None,
+                        translation,
                         language_id_mapping[legacy_lang_id]
-                    ))
-                    
-                    new_id = cursor.fetchone()[0]
-                    id_mapping[legacy_id] = new_id
-                    
-                    if len(id_mapping) % 1000 == 0:
-                        logger.info("Imported {} words...".format(len(id_mapping)))
-                except Exception as e:
-                    skipped += 1
-                    if 'unique' not in str(e).lower():
-                        logger.warning("Error importing word {}: {}".format(legacy_id, e))
+                    ), legacy_id)
         
+            batch.finish()
+        skipped += batch.failed
         self.stats['words']['new'] = len(id_mapping)
-        logger.info("Imported {} words (skipped {} duplicates/errors)".format(len(id_mapping), skipped))
+        collapsed = dedup.merge_into(id_mapping)
+        id_mapping.compact()
+        progress.finish()
+        rejects.finish()
+        logger.info("Imported {} words (collapsed {} duplicates, skipped {} errors)".format(
+            self.stats['words']['new'], collapsed, skipped))
         return id_mapping
 
     def _import_word_themes(self, cursor):
         """Import word themes and return ID mapping."""
         logger.info("Importing Word Themes...")
-        sql_file = os.path.join(self.migration_dir, 'word_themes.sql')
-        id_mapping = {}
+        sql_file = os.path.join(self.import_dir, 'word_themes.sql')
+        id_mapping = IdMapping(self.id_map_dir)
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 4:
-                    continue
+        progress = self.progress.table('word_themes', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            id_mapping[legacy_id] = new_id
+            progress.advance()
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'WordTheme'))
+
+            with open(sql_file, 'rb') as f:
+                for line in profile.read(iter_export_lines(f, progress)):
+                    if line.strip().startswith('--') or not line.strip():
+                        continue
                 
-                legacy_id = int(parts[0])
+                    parts = line.strip().split(',')
+                    if len(parts) < 4:
+                        continue
                 
-                cursor.execute("""
-                    INSERT INTO "WordTheme" (name, "moduleClass", "order")
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                """, (
-                    parts[1].strip("'"),
-                    parts[2].strip("'") if parts[2] != 'NULL' else '',
-                    int(parts[3]) if parts[3] != 'NULL' else 0
-                ))
+                    legacy_id = int(parts[0])
                 
-                new_id = cursor.fetchone()[0]
-                id_mapping[legacy_id] = new_id
+                    batch.execute("""
+                        INSERT INTO "WordTheme" (name, "moduleClass", "order")
+                        VALUES (%s, %s, %s)
+                        RETURNING id
+                    """, (
+                        parts[1].strip("'"),
+                        parts[2].strip("'") if parts[2] != 'NULL' else '',
+                        int(parts[3]) if parts[3] != 'NULL' else 0
+                    ), legacy_id)
         
+            batch.finish()
+        # After finish(): its last batch's assignments land in the mapping too
+        id_mapping.compact()
+        progress.finish()
+        rejects.finish()
         self.stats['word_themes']['new'] = len(id_mapping)
         logger.info("Imported {} word themes".format(len(id_mapping)))
         return id_mapping
@@ -650,46 +935,57 @@ class StorageboxMigration:
     def _import_word_theme_relations(self, cursor, word_id_mapping, theme_id_mapping):
         """Import word theme relations."""
         logger.info("Importing Word Theme Relations...")
-        sql_file = os.path.join(self.migration_dir, 'word_theme_relations.sql')
-        count = 0
+        sql_file = os.path.join(self.import_dir, 'word_theme_relations.sql')
         skipped = 0
         
-        with open(sql_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip().startswith('--') or not line.strip():
-                    continue
-                
-                parts = line.strip().split(',')
-                if len(parts) < 4:
-                    continue
+        progress = self.progress.table('word_theme_relations', total_bytes=os.path.getsize(sql_file))
+        cursor = progress.cursor(cursor)
+
+        def imported(legacy_id, new_id):
+            progress.advance()
+            if progress.rows % 1000 == 0:
+                logger.info("Imported {} word theme relations...".format(progress.rows))
+
+        rejects = self.rejects.table(progress)
+        with self.profiler.table(progress) as profile:
+            batch = profile.batch(self._batch(cursor, rejects, imported, 'WordThemeRelation'))
+            parse = profile.wrap('parse', _split_integer_fields)
+
+            with ExportFile(sql_file) as export:
+                for offset, raw in profile.read(export.lines(progress=progress, offsets=True)):
+                    parts = parse(raw)
+                    if len(parts) < 4:
+                        continue
                 
-                legacy_word_id = int(parts[1])
-                legacy_theme_id = int(parts[2])
+                    legacy_id = int(parts[0])
+                    legacy_word_id = int(parts[1])
+                    legacy_theme_id = int(parts[2])
                 
-                if legacy_word_id not in word_id_mapping or legacy_theme_id not in theme_id_mapping:
-                    skipped += 1
-                    continue
+                    new_word_id = word_id_mapping.get(legacy_word_id)
+                    new_theme_id = theme_id_mapping.get(legacy_theme_id)
+                    if new_word_id is None or new_theme_id is None:
+                        skipped += 1
+                        rejects.reject(legacy_id, 'missing_parent', offset, raw)
+                        continue
                 
-                try:
-                    cursor.execute("""
+                    rejects.expect(legacy_id, offset, raw)
+                    batch.execute("""
                         INSERT INTO "WordThemeRelation" ("wordId", "themeId", "order")
                         VALUES (%s, %s, %s)
+                        RETURNING id
                     """, (
-                        word_id_mapping[legacy_word_id],
-                        theme_id_mapping[legacy_theme_id],
-                        int(parts[3]) if parts[3] != 'NULL' else 0
-                    ))
-                    count += 1
-                    
-                    if count % 1000 == 0:
-                        logger.info("Imported {} word theme relations...".format(count))
-                except Exception as e:
-                    skipped += 1
-                    if 'unique' not in str(e).lower():
-                        logger.warning("Error importing relation: {}".format(e))
+                        new_word_id,
+                        new_theme_id,
+                        int(parts[3]) if parts[3] != b'NULL' else 0
+                    ), legacy_id)
         
-        self.stats['word_theme_relations']['new'] = count
-        logger.info("Imported {} word theme relations (skipped {} duplicates/errors)".format(count, skipped))
+            batch.finish()
+        skipped += batch.failed
+        progress.finish()
+        rejects.finish()
+        self.stats['word_theme_relations']['new'] = batch.succeeded
+        logger.info("Imported {} word theme relations (skipped {} duplicates/errors)".format(
+            batch.succeeded, skipped))
 
     def run(self):
         """Execute the full migration process."""
@@ -708,12 +1004,11 @@ class StorageboxMigration:
             logger.info("NOTE: Import step should be run on statex server")
             logger.info("=" * 60)
             
-            if not self.dry_run:
-                # Only import if DATABASE_URL is set (for statex server)
-                if os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL'):
-                    self.import_from_sql()
-                else:
-                    logger.info("Skipping import (DATABASE_URL not set - run import on statex server)")
+            # Only import if DATABASE_URL is set (for statex server)
+            if os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL'):
+                self.import_from_sql()
+            else:
+                logger.info("Skipping import (DATABASE_URL not set - run import on statex server)")
             
             # Print summary
             duration = datetime.now() - self.start_time
@@ -731,6 +1026,15 @@ class StorageboxMigration:
             logger.error("Migration failed: {}".format(e), exc_info=True)
             raise
 
+    def close(self, status='ok'):
+        """Close the legacy reader and write the final progress record of this run."""
+        if self._legacy is not None:
+            self._legacy.close()
+            self._legacy = None
+        self.rejects.close()
+        self.profiler.close()
+        self.progress.close(status)
+
 
 def main():
     parser = argparse.ArgumentParser(description='Migrate content data via storagebox')
@@ -738,20 +1042,103 @@ def main():
     parser.add_argument('--import-only', action='store_true', help='Import only (skip export)')
     parser.add_argument('--export-only', action='store_true', help='Export only (skip import)')
     parser.add_argument('--storagebox-path', help='Path to storagebox mount (default: /srv/storagebox)')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help='Records sampled per table for the --dry-run estimate (0 disables, default: {})'.format(
+                            DEFAULT_SAMPLE_SIZE))
+    parser.add_argument('--progress-file', help='Append per-table progress telemetry as JSON lines to this file')
+    parser.add_argument('--id-map-dir', help="Spill the word/theme id mappings to mmap'ed files in this directory")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows per savepoint-protected batch (default: {})'.format(DEFAULT_BATCH_SIZE))
+    parser.add_argument('--commit-interval', type=int, default=DEFAULT_COMMIT_INTERVAL,
+                        help='Commit every N rows; 0 imports in one transaction (default: {})'.format(
+                            DEFAULT_COMMIT_INTERVAL))
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Drop secondary indexes and foreign keys during the import and rebuild them afterwards')
+    parser.add_argument('--rebuild-workers', type=int, default=DEFAULT_REBUILD_WORKERS,
+                        help='Parallel sessions for index rebuilds in --bulk-load mode (default: {})'.format(
+                            DEFAULT_REBUILD_WORKERS))
+    parser.add_argument('--backend', choices=('savepoint', 'pipeline', 'copy'), default='savepoint',
+                        help='savepoint: psycopg2, one round trip per row; pipeline: psycopg 3 '
+                             'pipeline mode, one round trip per batch; copy: pre-allocated ids '
+                             'and COPY per batch (default: savepoint)')
+    parser.add_argument('--rejects-dir',
+                        help='Write rejected rows to <table>.rejects.tsv files in this directory')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Profile each table: phase timings, stacks and a summary written to DIR')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='sample',
+                        help='sample: collapsed stacks for flame graphs; cprofile: pstats dumps (default: sample)')
+    legacy = parser.add_mutually_exclusive_group()
+    legacy.add_argument('--legacy-db-url',
+                        help='Legacy database URL to export from (default: LEGACY_DATABASE_URL)')
+    legacy.add_argument('--orm', action='store_true',
+                        help='Export through the legacy Django models instead (needs DJANGO_SETTINGS_MODULE)')
+    parser.add_argument('--force', action='store_true',
+                        help='Export and import every table, even those unchanged since the last run')
+    parser.add_argument('--transfer', choices=TRANSFER_MODES, default='copy',
+                        help='copy: whole files to storagebox; delta: content-defined chunks, writing only '
+                             'chunks not already on storagebox (default: copy)')
+    parser.add_argument('--transfer-workers', type=int, default=DEFAULT_TRANSFER_WORKERS,
+                        help='Chunks written to storagebox in parallel with --transfer delta (default: {})'.format(
+                            DEFAULT_TRANSFER_WORKERS))
+    parser.add_argument('--follow', action='store_true',
+                        help='Import while the export is still running, loading each table once it is published')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between manifest checks with --follow (default: {})'.format(
+                            DEFAULT_POLL_INTERVAL))
+    parser.add_argument('--follow-timeout', type=float,
+                        help='Give up after waiting this many seconds for one table with --follow')
+    parser.add_argument('--throttle', action='store_true',
+                        help='Adapt batch size and pace to the load on the shared database server')
+    parser.add_argument('--target-latency', type=float, default=DEFAULT_TARGET_LATENCY * 1000,
+                        help='Commit latency in ms above which --throttle backs off (default: {:g})'.format(
+                            DEFAULT_TARGET_LATENCY * 1000))
+    parser.add_argument('--max-active', type=int,
+                        help='With --throttle, back off while more other sessions than this are active')
+    parser.add_argument('--max-replication-lag', type=float,
+                        help='With --throttle, back off while a replica lags more than this many seconds')
+    parser.add_argument('--batch-id', help='Tag the new rows with this import batch id (default: a new id per run)')
+    parser.add_argument('--rollback', metavar='BATCH', help='Delete the rows inserted by import batch BATCH and exit')
+    parser.add_argument('--list-batches', action='store_true', help='List the recorded import batches and exit')
     args = parser.parse_args()
 
+    migrator = None
     try:
         migrator = StorageboxMigration(
             storagebox_path=args.storagebox_path,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            sample_size=args.sample_size,
+            progress_file=args.progress_file,
+            id_map_dir=args.id_map_dir,
+            batch_size=args.batch_size,
+            commit_interval=args.commit_interval,
+            bulk_load=args.bulk_load,
+            rebuild_workers=args.rebuild_workers,
+            backend=args.backend,
+            rejects_dir=args.rejects_dir,
+            profile_dir=args.profile,
+            profile_mode=args.profile_mode,
+            legacy_db_url=args.legacy_db_url,
+            orm=args.orm,
+            force=args.force,
+            transfer=args.transfer,
+            transfer_workers=args.transfer_workers,
+            follow=args.follow,
+            poll_interval=args.poll_interval,
+            follow_timeout=args.follow_timeout,
+            throttle=args.throttle,
+            target_latency=args.target_latency / 1000.0,
+            max_active=args.max_active,
+            max_replication_lag=args.max_replication_lag,
+            batch_id=args.batch_id
         )
         
-        if args.import_only:
-            # Import only mode
-            if not args.dry_run:
-                migrator.import_from_sql()
-            else:
-                logger.info("DRY RUN: Would import data from storagebox")
+        if args.list_batches:
+            migrator.list_import_batches()
+        elif args.rollback:
+            migrator.rollback_import_batch(args.rollback)
+        elif args.import_only:
+            # Import only mode (dry run logs a sampled estimate)
+            migrator.import_from_sql()
         elif args.export_only:
             # Export only mode
             migrator.export_to_sql()
@@ -759,9 +1146,12 @@ def main():
             # Full migration (export + import if DATABASE_URL set)
             migrator.run()
         
+        migrator.close()
         logger.info("Migration completed successfully!")
         return 0
     except Exception as e:
+        if migrator is not None:
+            migrator.close('error')
         logger.error("Migration failed: {}".format(e), exc_info=True)
         return 1
 
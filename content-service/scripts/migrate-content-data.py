@@ -3,10 +3,16 @@
 Content Service Data Migration Script
 
 Migrates content data from legacy Django database to new Prisma database.
-Uses Django ORM to read legacy data and psycopg2 to write to new database.
+Reads the legacy tables through server-side cursors (or the Django ORM with
+--orm) and uses psycopg2 to write to new database.
 
 Usage:
-    python migrate-content-data.py [--dry-run] [--legacy-db-url URL] [--new-db-url URL]
+    python migrate-content-data.py [--dry-run] [--sample-size N] [--progress-file PATH]
+                                   [--id-map-dir DIR] [--rejects-dir DIR]
+                                   [--profile DIR [--profile-mode sample|cprofile]]
+                                   [--legacy-db-url URL | --orm] [--new-db-url URL]
+
+    Options are described in --help and README_MIGRATION.md.
 
 Environment Variables:
     LEGACY_DATABASE_URL - Legacy Django database connection string
@@ -17,27 +23,23 @@ import os
 import sys
 import argparse
 import logging
+from collections import deque
 from datetime import datetime
 # from typing import Dict, List, Optional, Any  # Not available in Python 3.4
 import psycopg2
 # from psycopg2.extras import execute_values  # Not used
 # from psycopg2 import sql  # Not used
 
-# Setup Django environment
-# This script should be run from speakasap-portal directory or with DJANGO_SETTINGS_MODULE set
-try:
-    import django
-    django.setup()
-except Exception as e:
-    print("Warning: Django setup failed: {}".format(e))
-    print("Make sure to run this script from speakasap-portal directory or set DJANGO_SETTINGS_MODULE")
-    sys.exit(1)
-
-from language.models import Language as LegacyLanguage
-from grammar.models import GrammarCourse as LegacyGrammarCourse, GrammarLesson as LegacyGrammarLesson
-from phonetics.models import PhoneticsCourse as LegacyPhoneticsCourse, PhoneticsLesson as LegacyPhoneticsLesson
-from songs.models import SongsCourse as LegacySongsCourse, SongsLesson as LegacySongsLesson
-from dictionary.models import Word as LegacyWord, WordTheme as LegacyWordTheme, WordThemeRelation as LegacyWordThemeRelation
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from content_migration.dedup import KeyDeduplicator, word_key
+from content_migration.estimate import DEFAULT_SAMPLE_SIZE, ThroughputEstimator
+from content_migration.idmap import IdMapping
+from content_migration.legacy import connect_legacy, django_reader
+from content_migration.profiling import MODES as PROFILE_MODES, Profiler
+from content_migration.progress import ProgressReporter
+from content_migration.rejects import RejectSink
+from content_migration.tables import TABLES, get_table
 
 # Configure logging
 logging.basicConfig(
@@ -50,12 +52,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Error messages kept for the final summary
+MAX_SUMMARY_ERRORS = 100
+
 
 class ContentDataMigrator:
     """Migrates content data from legacy Django database to new Prisma database."""
 
-    def __init__(self, legacy_db_url=None, new_db_url=None, dry_run=False):
+    def __init__(self, legacy_db_url=None, new_db_url=None, dry_run=False,
+                 sample_size=DEFAULT_SAMPLE_SIZE, progress_file=None, id_map_dir=None, rejects_dir=None,
+                 profile_dir=None, profile_mode='sample', orm=False):
         self.dry_run = dry_run
+        self.sample_size = sample_size
+        self.id_map_dir = id_map_dir
+        self.progress = ProgressReporter(progress_file, source='migrate-content-data')
+        self.rejects = RejectSink(rejects_dir)
+        self.profiler = Profiler(profile_dir, profile_mode)
         self.stats = {
             'languages': {'legacy': 0, 'new': 0},
             'grammar_courses': {'legacy': 0, 'new': 0},
@@ -68,31 +80,54 @@ class ContentDataMigrator:
             'word_themes': {'legacy': 0, 'new': 0},
             'word_theme_relations': {'legacy': 0, 'new': 0},
         }
-        self.errors = []
+        # Most recent messages only; error_count has the total
+        self.errors = deque(maxlen=MAX_SUMMARY_ERRORS)
+        self.error_count = 0
         self.start_time = datetime.now()
 
-        # Connect to new database
+        # Legacy reader: Django only in ORM mode
+        legacy_db_url = legacy_db_url or os.getenv('LEGACY_DATABASE_URL')
+        if orm:
+            self.legacy = django_reader()
+        elif legacy_db_url:
+            self.legacy = connect_legacy(legacy_db_url)
+            logger.info("Connected to legacy database")
+        else:
+            raise ValueError("LEGACY_DATABASE_URL (or --legacy-db-url) required, or --orm to read through "
+                             "the Django models")
+
+        # Connect to new database (optional in dry run, used to time sample inserts)
+        new_db_url = new_db_url or os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL')
         if not dry_run:
-            new_db_url = new_db_url or os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL')
             if not new_db_url:
                 raise ValueError("NEW_DATABASE_URL or DATABASE_URL environment variable required")
             self.new_conn = psycopg2.connect(new_db_url)
             self.new_conn.autocommit = False
             logger.info("Connected to new database")
+        elif sample_size and new_db_url:
+            self.new_conn = psycopg2.connect(new_db_url)
+            self.new_conn.autocommit = False
+            logger.info("Connected to new database (dry run: sample inserts are rolled back)")
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if hasattr(self, 'new_conn') and not self.dry_run:
+        self.rejects.close()
+        self.profiler.close()
+        self.progress.close('error' if exc_type else 'ok')
+        if hasattr(self, 'legacy'):
+            self.legacy.close()
+        if hasattr(self, 'new_conn'):
             self.new_conn.close()
             logger.info("Closed new database connection")
 
     def log_error(self, message, exception=None):
-        """Log an error and add to errors list."""
+        """Log an error and add it to the errors kept for the summary."""
         error_msg = "{}: {}".format(message, exception) if exception else message
         logger.error(error_msg)
         self.errors.append(error_msg)
+        self.error_count += 1
         if exception:
             logger.exception(exception)
 
@@ -102,8 +137,8 @@ class ContentDataMigrator:
         logger.info("Migrating Languages")
         logger.info("=" * 60)
 
-        legacy_languages = LegacyLanguage.objects.all().order_by('id')
-        self.stats['languages']['legacy'] = legacy_languages.count()
+        spec = get_table('languages')
+        self.stats['languages']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} languages in legacy database".format(self.stats['languages']['legacy']))
 
         id_mapping = {}
@@ -112,29 +147,37 @@ class ContentDataMigrator:
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            for lang in legacy_languages:
-                # Extract icon path from ImageField
-                icon_path = str(lang.icon) if lang.icon else ''
-
-                # Insert language
-                cursor.execute("""
-                    INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    lang.code,
-                    lang.machine_name,
-                    lang.name,
-                    icon_path,
-                    lang.order,
-                    lang.speaker or 'носитель'
-                ))
-                new_id = cursor.fetchone()[0]
-                id_mapping[lang.id] = new_id
-                logger.debug("Migrated language: {lang.code} (legacy_id={lang.id} -> new_id={})".format(new_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('languages', total_rows=self.stats['languages']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                for lang in profile.read(self.legacy.records(spec)):
+                    # Extract icon path from ImageField
+                    icon_path = str(lang.icon) if lang.icon else ''
+
+                    # Insert language
+                    cursor.execute("""
+                        INSERT INTO "Language" (code, "machineName", name, "iconPath", "order", speaker)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        lang.code,
+                        lang.machine_name,
+                        lang.name,
+                        icon_path,
+                        lang.order,
+                        lang.speaker or 'носитель'
+                    ))
+                    new_id = cursor.fetchone()[0]
+                    id_mapping[lang.id] = new_id
+                    progress.advance()
+                    logger.debug("Migrated language: {lang.code} (legacy_id={lang.id} -> new_id={})".format(new_id))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['languages']['new'] = len(id_mapping)
             logger.info("Successfully migrated {} languages".format(self.stats['languages']['new']))
             return id_mapping
@@ -150,8 +193,8 @@ class ContentDataMigrator:
         logger.info("Migrating Grammar Courses")
         logger.info("=" * 60)
 
-        legacy_courses = LegacyGrammarCourse.objects.all().order_by('id')
-        self.stats['grammar_courses']['legacy'] = legacy_courses.count()
+        spec = get_table('grammar_courses')
+        self.stats['grammar_courses']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} grammar courses in legacy database".format(self.stats['grammar_courses']['legacy']))
 
         id_mapping = {}
@@ -160,29 +203,37 @@ class ContentDataMigrator:
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            for course in legacy_courses:
-                if course.language_id not in language_id_mapping:
-                    logger.warning("Skipping grammar course {course.id}: language_id {} not found".format(course.language_id))
-                    continue
-
-                new_language_id = language_id_mapping[course.language_id]
-                cursor.execute("""
-                    INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    course.title,
-                    course.material_language or 'ru',
-                    course.meta_keywords or None,
-                    course.meta_description or None,
-                    new_language_id
-                ))
-                new_id = cursor.fetchone()[0]
-                id_mapping[course.id] = new_id
-                logger.debug("Migrated grammar course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('grammar_courses', total_rows=self.stats['grammar_courses']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                for course in profile.read(self.legacy.records(spec)):
+                    if course.language_id not in language_id_mapping:
+                        rejects.reject(course.id, 'missing_parent')
+                        continue
+
+                    new_language_id = language_id_mapping[course.language_id]
+                    cursor.execute("""
+                        INSERT INTO "GrammarCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        course.title,
+                        course.material_language or 'ru',
+                        course.meta_keywords or None,
+                        course.meta_description or None,
+                        new_language_id
+                    ))
+                    new_id = cursor.fetchone()[0]
+                    id_mapping[course.id] = new_id
+                    progress.advance()
+                    logger.debug("Migrated grammar course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['grammar_courses']['new'] = len(id_mapping)
             logger.info("Successfully migrated {} grammar courses".format(self.stats['grammar_courses']['new']))
             return id_mapping
@@ -198,8 +249,8 @@ class ContentDataMigrator:
         logger.info("Migrating Grammar Lessons")
         logger.info("=" * 60)
 
-        legacy_lessons = LegacyGrammarLesson.objects.all().order_by('id')
-        self.stats['grammar_lessons']['legacy'] = legacy_lessons.count()
+        spec = get_table('grammar_lessons')
+        self.stats['grammar_lessons']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} grammar lessons in legacy database".format(self.stats['grammar_lessons']['legacy']))
 
         if self.dry_run:
@@ -207,36 +258,44 @@ class ContentDataMigrator:
             return
 
         try:
-            cursor = self.new_conn.cursor()
-            migrated_count = 0
-            for lesson in legacy_lessons:
-                if lesson.course_id not in course_id_mapping:
-                    logger.warning("Skipping grammar lesson {lesson.id}: course_id {} not found".format(lesson.course_id))
-                    continue
-
-                new_course_id = course_id_mapping[lesson.course_id]
-                cursor.execute("""
-                    INSERT INTO "GrammarLesson" (
-                        title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    lesson.title,
-                    new_course_id,
-                    lesson.template,
-                    lesson.alias or None,
-                    lesson.url,
-                    lesson.section or None,
-                    lesson.teaser or None,
-                    lesson.order or 0,
-                    lesson.meta_keywords or None,
-                    lesson.meta_description or None
-                ))
-                migrated_count += 1
-                if migrated_count % 100 == 0:
-                    logger.info("Migrated {} grammar lessons...".format(migrated_count))
-
-            self.new_conn.commit()
+            progress = self.progress.table('grammar_lessons', total_rows=self.stats['grammar_lessons']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                migrated_count = 0
+                for lesson in profile.read(self.legacy.records(spec)):
+                    if lesson.course_id not in course_id_mapping:
+                        rejects.reject(lesson.id, 'missing_parent')
+                        continue
+
+                    new_course_id = course_id_mapping[lesson.course_id]
+                    cursor.execute("""
+                        INSERT INTO "GrammarLesson" (
+                            title, "courseId", template, alias, url, section, teaser, "order", "metaKeywords", "metaDescription"
+                        )
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """, (
+                        lesson.title,
+                        new_course_id,
+                        lesson.template,
+                        lesson.alias or None,
+                        lesson.url,
+                        lesson.section or None,
+                        lesson.teaser or None,
+                        lesson.order or 0,
+                        lesson.meta_keywords or None,
+                        lesson.meta_description or None
+                    ))
+                    migrated_count += 1
+                    progress.advance()
+                    if migrated_count % 100 == 0:
+                        logger.info("Migrated {} grammar lessons...".format(migrated_count))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['grammar_lessons']['new'] = migrated_count
             logger.info("Successfully migrated {} grammar lessons".format(self.stats['grammar_lessons']['new']))
 
@@ -251,8 +310,8 @@ class ContentDataMigrator:
         logger.info("Migrating Phonetics Courses")
         logger.info("=" * 60)
 
-        legacy_courses = LegacyPhoneticsCourse.objects.all().order_by('id')
-        self.stats['phonetics_courses']['legacy'] = legacy_courses.count()
+        spec = get_table('phonetics_courses')
+        self.stats['phonetics_courses']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} phonetics courses in legacy database".format(self.stats['phonetics_courses']['legacy']))
 
         id_mapping = {}
@@ -261,29 +320,37 @@ class ContentDataMigrator:
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            for course in legacy_courses:
-                if course.language_id not in language_id_mapping:
-                    logger.warning("Skipping phonetics course {course.id}: language_id {} not found".format(course.language_id))
-                    continue
-
-                new_language_id = language_id_mapping[course.language_id]
-                cursor.execute("""
-                    INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    course.title,
-                    course.material_language or 'ru',
-                    course.meta_keywords or None,
-                    course.meta_description or None,
-                    new_language_id
-                ))
-                new_id = cursor.fetchone()[0]
-                id_mapping[course.id] = new_id
-                logger.debug("Migrated phonetics course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('phonetics_courses', total_rows=self.stats['phonetics_courses']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                for course in profile.read(self.legacy.records(spec)):
+                    if course.language_id not in language_id_mapping:
+                        rejects.reject(course.id, 'missing_parent')
+                        continue
+
+                    new_language_id = language_id_mapping[course.language_id]
+                    cursor.execute("""
+                        INSERT INTO "PhoneticsCourse" (title, "materialLanguage", "metaKeywords", "metaDescription", "languageId")
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (
+                        course.title,
+                        course.material_language or 'ru',
+                        course.meta_keywords or None,
+                        course.meta_description or None,
+                        new_language_id
+                    ))
+                    new_id = cursor.fetchone()[0]
+                    id_mapping[course.id] = new_id
+                    progress.advance()
+                    logger.debug("Migrated phonetics course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['phonetics_courses']['new'] = len(id_mapping)
             logger.info("Successfully migrated {} phonetics courses".format(self.stats['phonetics_courses']['new']))
             return id_mapping
@@ -299,8 +366,8 @@ class ContentDataMigrator:
         logger.info("Migrating Phonetics Lessons")
         logger.info("=" * 60)
 
-        legacy_lessons = LegacyPhoneticsLesson.objects.all().order_by('id')
-        self.stats['phonetics_lessons']['legacy'] = legacy_lessons.count()
+        spec = get_table('phonetics_lessons')
+        self.stats['phonetics_lessons']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} phonetics lessons in legacy database".format(self.stats['phonetics_lessons']['legacy']))
 
         if self.dry_run:
@@ -308,29 +375,37 @@ class ContentDataMigrator:
             return
 
         try:
-            cursor = self.new_conn.cursor()
-            migrated_count = 0
-            for lesson in legacy_lessons:
-                if lesson.course_id not in course_id_mapping:
-                    logger.warning("Skipping phonetics lesson {lesson.id}: course_id {} not found".format(lesson.course_id))
-                    continue
-
-                new_course_id = course_id_mapping[lesson.course_id]
-                cursor.execute("""
-                    INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    lesson.title,
-                    new_course_id,
-                    lesson.order,
-                    lesson.meta_keywords or None,
-                    lesson.meta_description or None
-                ))
-                migrated_count += 1
-                if migrated_count % 100 == 0:
-                    logger.info("Migrated {} phonetics lessons...".format(migrated_count))
-
-            self.new_conn.commit()
+            progress = self.progress.table('phonetics_lessons', total_rows=self.stats['phonetics_lessons']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                migrated_count = 0
+                for lesson in profile.read(self.legacy.records(spec)):
+                    if lesson.course_id not in course_id_mapping:
+                        rejects.reject(lesson.id, 'missing_parent')
+                        continue
+
+                    new_course_id = course_id_mapping[lesson.course_id]
+                    cursor.execute("""
+                        INSERT INTO "PhoneticsLesson" (title, "courseId", "order", "metaKeywords", "metaDescription")
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, (
+                        lesson.title,
+                        new_course_id,
+                        lesson.order,
+                        lesson.meta_keywords or None,
+                        lesson.meta_description or None
+                    ))
+                    migrated_count += 1
+                    progress.advance()
+                    if migrated_count % 100 == 0:
+                        logger.info("Migrated {} phonetics lessons...".format(migrated_count))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['phonetics_lessons']['new'] = migrated_count
             logger.info("Successfully migrated {} phonetics lessons".format(self.stats['phonetics_lessons']['new']))
 
@@ -345,8 +420,8 @@ class ContentDataMigrator:
         logger.info("Migrating Songs Courses")
         logger.info("=" * 60)
 
-        legacy_courses = LegacySongsCourse.objects.all().order_by('id')
-        self.stats['songs_courses']['legacy'] = legacy_courses.count()
+        spec = get_table('songs_courses')
+        self.stats['songs_courses']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} songs courses in legacy database".format(self.stats['songs_courses']['legacy']))
 
         id_mapping = {}
@@ -355,27 +430,35 @@ class ContentDataMigrator:
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            for course in legacy_courses:
-                if course.language_id not in language_id_mapping:
-                    logger.warning("Skipping songs course {course.id}: language_id {} not found".format(course.language_id))
-                    continue
-
-                new_language_id = language_id_mapping[course.language_id]
-                cursor.execute("""
-                    INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                """, (
-                    course.title,
-                    course.material_language or 'ru',
-                    new_language_id
-                ))
-                new_id = cursor.fetchone()[0]
-                id_mapping[course.id] = new_id
-                logger.debug("Migrated songs course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('songs_courses', total_rows=self.stats['songs_courses']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                for course in profile.read(self.legacy.records(spec)):
+                    if course.language_id not in language_id_mapping:
+                        rejects.reject(course.id, 'missing_parent')
+                        continue
+
+                    new_language_id = language_id_mapping[course.language_id]
+                    cursor.execute("""
+                        INSERT INTO "SongsCourse" (title, "materialLanguage", "languageId")
+                        VALUES (%s, %s, %s)
+                        RETURNING id
+                    """, (
+                        course.title,
+                        course.material_language or 'ru',
+                        new_language_id
+                    ))
+                    new_id = cursor.fetchone()[0]
+                    id_mapping[course.id] = new_id
+                    progress.advance()
+                    logger.debug("Migrated songs course: {course.title} (legacy_id={course.id} -> new_id={})".format(new_id))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['songs_courses']['new'] = len(id_mapping)
             logger.info("Successfully migrated {} songs courses".format(self.stats['songs_courses']['new']))
             return id_mapping
@@ -391,8 +474,8 @@ class ContentDataMigrator:
         logger.info("Migrating Songs Lessons")
         logger.info("=" * 60)
 
-        legacy_lessons = LegacySongsLesson.objects.all().order_by('id')
-        self.stats['songs_lessons']['legacy'] = legacy_lessons.count()
+        spec = get_table('songs_lessons')
+        self.stats['songs_lessons']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} songs lessons in legacy database".format(self.stats['songs_lessons']['legacy']))
 
         if self.dry_run:
@@ -400,27 +483,35 @@ class ContentDataMigrator:
             return
 
         try:
-            cursor = self.new_conn.cursor()
-            migrated_count = 0
-            for lesson in legacy_lessons:
-                if lesson.course_id not in course_id_mapping:
-                    logger.warning("Skipping songs lesson {lesson.id}: course_id {} not found".format(lesson.course_id))
-                    continue
-
-                new_course_id = course_id_mapping[lesson.course_id]
-                cursor.execute("""
-                    INSERT INTO "SongsLesson" (title, "courseId", "order")
-                    VALUES (%s, %s, %s)
-                """, (
-                    lesson.title,
-                    new_course_id,
-                    lesson.order
-                ))
-                migrated_count += 1
-                if migrated_count % 100 == 0:
-                    logger.info("Migrated {} songs lessons...".format(migrated_count))
-
-            self.new_conn.commit()
+            progress = self.progress.table('songs_lessons', total_rows=self.stats['songs_lessons']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                migrated_count = 0
+                for lesson in profile.read(self.legacy.records(spec)):
+                    if lesson.course_id not in course_id_mapping:
+                        rejects.reject(lesson.id, 'missing_parent')
+                        continue
+
+                    new_course_id = course_id_mapping[lesson.course_id]
+                    cursor.execute("""
+                        INSERT INTO "SongsLesson" (title, "courseId", "order")
+                        VALUES (%s, %s, %s)
+                    """, (
+                        lesson.title,
+                        new_course_id,
+                        lesson.order
+                    ))
+                    migrated_count += 1
+                    progress.advance()
+                    if migrated_count % 100 == 0:
+                        logger.info("Migrated {} songs lessons...".format(migrated_count))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['songs_lessons']['new'] = migrated_count
             logger.info("Successfully migrated {} songs lessons".format(self.stats['songs_lessons']['new']))
 
@@ -435,50 +526,64 @@ class ContentDataMigrator:
         logger.info("Migrating Words")
         logger.info("=" * 60)
 
-        legacy_words = LegacyWord.objects.all().order_by('id')
-        self.stats['words']['legacy'] = legacy_words.count()
+        spec = get_table('words')
+        self.stats['words']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} words in legacy database".format(self.stats['words']['legacy']))
 
-        id_mapping = {}
+        id_mapping = IdMapping(self.id_map_dir)
         if self.dry_run:
             logger.info("DRY RUN: Would migrate words")
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            migrated_count = 0
-            skipped_count = 0
-            for word in legacy_words:
-                if word.language_id not in language_id_mapping:
-                    logger.warning("Skipping word {word.id}: language_id {} not found".format(word.language_id))
-                    skipped_count += 1
-                    continue
-
-                new_language_id = language_id_mapping[word.language_id]
-                try:
-                    cursor.execute("""
-                        INSERT INTO "Word" (word, transcription, translation, "languageId")
-                        VALUES (%s, %s, %s, %s)
-                        RETURNING id
-                    """, (
-                        word.word,
-                        word.transcription or None,
-                        word.translation or None,
-                        new_language_id
-                    ))
-                    new_id = cursor.fetchone()[0]
-                    id_mapping[word.id] = new_id
-                    migrated_count += 1
-                    if migrated_count % 1000 == 0:
-                        logger.info("Migrated {} words...".format(migrated_count))
-                except psycopg2.IntegrityError as e:
-                    # Unique constraint violation - word already exists
-                    skipped_count += 1
-                    logger.debug("Skipped duplicate word: {word.word} (language_id={})".format(new_language_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('words', total_rows=self.stats['words']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                migrated_count = 0
+                skipped_count = 0
+                dedup = KeyDeduplicator(self.id_map_dir)
+                for word in profile.read(self.legacy.records(spec)):
+                    if word.language_id not in language_id_mapping:
+                        rejects.reject(word.id, 'missing_parent')
+                        skipped_count += 1
+                        continue
+                    if not dedup.add(word_key(word.word, word.language_id, word.translation or None), word.id):
+                        continue
+
+                    new_language_id = language_id_mapping[word.language_id]
+                    try:
+                        cursor.execute("""
+                            INSERT INTO "Word" (word, transcription, translation, "languageId")
+                            VALUES (%s, %s, %s, %s)
+                            RETURNING id
+                        """, (
+                            word.word,
+                            word.transcription or None,
+                            word.translation or None,
+                            new_language_id
+                        ))
+                        new_id = cursor.fetchone()[0]
+                        id_mapping[word.id] = new_id
+                        progress.advance()
+                        migrated_count += 1
+                        if migrated_count % 1000 == 0:
+                            logger.info("Migrated {} words...".format(migrated_count))
+                    except psycopg2.IntegrityError as e:
+                        # Unique constraint violation - word already exists
+                        skipped_count += 1
+                        rejects.reject(word.id, e)
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            collapsed = dedup.merge_into(id_mapping)
+            progress.finish()
+            rejects.finish()
+            id_mapping.compact()
             self.stats['words']['new'] = migrated_count
-            logger.info("Successfully migrated {self.stats['words']['new']} words (skipped {} duplicates)".format(skipped_count))
+            logger.info("Successfully migrated {} words (collapsed {} duplicates, skipped {})".format(
+                self.stats['words']['new'], collapsed, skipped_count))
             return id_mapping
 
         except Exception as e:
@@ -492,32 +597,41 @@ class ContentDataMigrator:
         logger.info("Migrating Word Themes")
         logger.info("=" * 60)
 
-        legacy_themes = LegacyWordTheme.objects.all().order_by('id')
-        self.stats['word_themes']['legacy'] = legacy_themes.count()
+        spec = get_table('word_themes')
+        self.stats['word_themes']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} word themes in legacy database".format(self.stats['word_themes']['legacy']))
 
-        id_mapping = {}
+        id_mapping = IdMapping(self.id_map_dir)
         if self.dry_run:
             logger.info("DRY RUN: Would migrate word themes")
             return id_mapping
 
         try:
-            cursor = self.new_conn.cursor()
-            for theme in legacy_themes:
-                cursor.execute("""
-                    INSERT INTO "WordTheme" (name, "moduleClass", "order")
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                """, (
-                    theme.name,
-                    theme.module_class or '',
-                    theme.order or 0
-                ))
-                new_id = cursor.fetchone()[0]
-                id_mapping[theme.id] = new_id
-                logger.debug("Migrated word theme: {theme.name} (legacy_id={theme.id} -> new_id={})".format(new_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('word_themes', total_rows=self.stats['word_themes']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                for theme in profile.read(self.legacy.records(spec)):
+                    cursor.execute("""
+                        INSERT INTO "WordTheme" (name, "moduleClass", "order")
+                        VALUES (%s, %s, %s)
+                        RETURNING id
+                    """, (
+                        theme.name,
+                        theme.module_class or '',
+                        theme.order or 0
+                    ))
+                    new_id = cursor.fetchone()[0]
+                    id_mapping[theme.id] = new_id
+                    progress.advance()
+                    logger.debug("Migrated word theme: {theme.name} (legacy_id={theme.id} -> new_id={})".format(new_id))
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
+            id_mapping.compact()
             self.stats['word_themes']['new'] = len(id_mapping)
             logger.info("Successfully migrated {} word themes".format(self.stats['word_themes']['new']))
             return id_mapping
@@ -533,8 +647,8 @@ class ContentDataMigrator:
         logger.info("Migrating Word Theme Relations")
         logger.info("=" * 60)
 
-        legacy_relations = LegacyWordThemeRelation.objects.all().order_by('id')
-        self.stats['word_theme_relations']['legacy'] = legacy_relations.count()
+        spec = get_table('word_theme_relations')
+        self.stats['word_theme_relations']['legacy'] = self.legacy.count(spec)
         logger.info("Found {} word theme relations in legacy database".format(self.stats['word_theme_relations']['legacy']))
 
         if self.dry_run:
@@ -542,39 +656,47 @@ class ContentDataMigrator:
             return
 
         try:
-            cursor = self.new_conn.cursor()
-            migrated_count = 0
-            skipped_count = 0
-            for relation in legacy_relations:
-                if relation.word_id not in word_id_mapping:
-                    logger.warning("Skipping relation {relation.id}: word_id {} not found".format(relation.word_id))
-                    skipped_count += 1
-                    continue
-                if relation.theme_id not in theme_id_mapping:
-                    logger.warning("Skipping relation {relation.id}: theme_id {} not found".format(relation.theme_id))
-                    skipped_count += 1
-                    continue
-
-                new_word_id = word_id_mapping[relation.word_id]
-                new_theme_id = theme_id_mapping[relation.theme_id]
-                try:
-                    cursor.execute("""
-                        INSERT INTO "WordThemeRelation" ("wordId", "themeId", "order")
-                        VALUES (%s, %s, %s)
-                    """, (
-                        new_word_id,
-                        new_theme_id,
-                        relation.order or 0
-                    ))
-                    migrated_count += 1
-                    if migrated_count % 1000 == 0:
-                        logger.info("Migrated {} word theme relations...".format(migrated_count))
-                except psycopg2.IntegrityError as e:
-                    # Unique constraint violation - relation already exists
-                    skipped_count += 1
-                    logger.debug("Skipped duplicate relation: word_id={new_word_id}, theme_id={}".format(new_theme_id))
-
-            self.new_conn.commit()
+            progress = self.progress.table('word_theme_relations', total_rows=self.stats['word_theme_relations']['legacy'])
+            rejects = self.rejects.table(progress)
+            cursor = progress.cursor(self.new_conn.cursor())
+            with self.profiler.table(progress) as profile:
+                cursor = profile.cursor(cursor)
+                migrated_count = 0
+                skipped_count = 0
+                for relation in profile.read(self.legacy.records(spec)):
+                    new_word_id = word_id_mapping.get(relation.word_id)
+                    new_theme_id = theme_id_mapping.get(relation.theme_id)
+                    if new_word_id is None:
+                        rejects.reject(relation.id, 'missing_parent')
+                        skipped_count += 1
+                        continue
+                    if new_theme_id is None:
+                        rejects.reject(relation.id, 'missing_parent')
+                        skipped_count += 1
+                        continue
+
+                    try:
+                        cursor.execute("""
+                            INSERT INTO "WordThemeRelation" ("wordId", "themeId", "order")
+                            VALUES (%s, %s, %s)
+                        """, (
+                            new_word_id,
+                            new_theme_id,
+                            relation.order or 0
+                        ))
+                        migrated_count += 1
+                        progress.advance()
+                        if migrated_count % 1000 == 0:
+                            logger.info("Migrated {} word theme relations...".format(migrated_count))
+                    except psycopg2.IntegrityError as e:
+                        # Unique constraint violation - relation already exists
+                        skipped_count += 1
+                        rejects.reject(relation.id, e)
+
+                with profile.phase('commit'):
+                    progress.call(self.new_conn.commit)
+            progress.finish()
+            rejects.finish()
             self.stats['word_theme_relations']['new'] = migrated_count
             logger.info("Successfully migrated {self.stats['word_theme_relations']['new']} word theme relations (skipped {} duplicates)".format(skipped_count))
 
@@ -583,6 +705,23 @@ class ContentDataMigrator:
             self.log_error("Failed to migrate word theme relations", e)
             raise
 
+    def estimate_throughput(self):
+        """Sample each table through the migration transforms and log projections.
+
+        Row counts come from the dry-run pass over the legacy tables. Sample
+        inserts (if connected) run in one transaction that is rolled back.
+        """
+        estimator = ThroughputEstimator(getattr(self, 'new_conn', None), sample_size=self.sample_size)
+        try:
+            for spec in TABLES:
+                estimator.estimate_table(
+                    spec, self.stats[spec.key]['legacy'], self.legacy.rows(spec, limit=self.sample_size)
+                )
+        finally:
+            estimator.finish()
+        estimator.log_report()
+        return estimator.summary()
+
     def validate_migration(self):
         """Validate migration by comparing record counts."""
         logger.info("=" * 60)
@@ -647,8 +786,10 @@ class ContentDataMigrator:
             theme_id_mapping = self.migrate_word_themes()
             self.migrate_word_theme_relations(word_id_mapping, theme_id_mapping)
 
-            # Step 5: Validate
+            # Step 5: Validate (dry run: estimate from sampled records instead)
             validation_results = self.validate_migration()
+            if self.dry_run and self.sample_size:
+                self.estimate_throughput()
 
             # Print summary
             self.print_summary(validation_results)
@@ -667,7 +808,7 @@ class ContentDataMigrator:
 
         duration = datetime.now() - self.start_time
         logger.info("Duration: {}".format(duration))
-        logger.info("Errors: {}".format(len(self.errors)))
+        logger.info("Errors: {}".format(self.error_count))
 
         if validation_results:
             logger.info("\nValidation Results:")
@@ -676,7 +817,10 @@ class ContentDataMigrator:
                 logger.info("{status} {table_name}: legacy={result['legacy']}, new={}".format(result['new']))
 
         if self.errors:
-            logger.error("\nErrors encountered:")
+            if self.error_count > len(self.errors):
+                logger.error("\nErrors encountered (last {} of {}):".format(len(self.errors), self.error_count))
+            else:
+                logger.error("\nErrors encountered:")
             for error in self.errors:
                 logger.error("  - {}".format(error))
 
@@ -684,15 +828,35 @@ class ContentDataMigrator:
 def main():
     parser = argparse.ArgumentParser(description='Migrate content data from legacy Django to new Prisma database')
     parser.add_argument('--dry-run', action='store_true', help='Perform a dry run without writing to database')
-    parser.add_argument('--legacy-db-url', help='Legacy database URL (uses Django settings if not provided)')
+    legacy = parser.add_mutually_exclusive_group()
+    legacy.add_argument('--legacy-db-url', help='Legacy database URL (uses LEGACY_DATABASE_URL env var if not provided)')
+    legacy.add_argument('--orm', action='store_true',
+                        help='Read the legacy tables through the Django models (needs DJANGO_SETTINGS_MODULE)')
     parser.add_argument('--new-db-url', help='New database URL (uses DATABASE_URL env var if not provided)')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help='Records sampled per table for the --dry-run estimate (0 disables, default: {})'.format(
+                            DEFAULT_SAMPLE_SIZE))
+    parser.add_argument('--progress-file', help='Append per-table progress telemetry as JSON lines to this file')
+    parser.add_argument('--id-map-dir', help="Spill the word/theme id mappings to mmap'ed files in this directory")
+    parser.add_argument('--rejects-dir', help='Write rejected rows to <table>.rejects.tsv files in this directory')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Profile each table: phase timings, stacks and a summary written to DIR')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='sample',
+                        help='sample: collapsed stacks for flame graphs; cprofile: pstats dumps (default: sample)')
     args = parser.parse_args()
 
     try:
         with ContentDataMigrator(
             legacy_db_url=args.legacy_db_url,
             new_db_url=args.new_db_url,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            sample_size=args.sample_size,
+            progress_file=args.progress_file,
+            id_map_dir=args.id_map_dir,
+            rejects_dir=args.rejects_dir,
+            profile_dir=args.profile,
+            profile_mode=args.profile_mode,
+            orm=args.orm
         ) as migrator:
             migrator.run()
             logger.info("Migration completed successfully!")
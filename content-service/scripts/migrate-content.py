@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Content Data Migration (unified engine)
+
+Migrates the ten content tables from any legacy source to the new Prisma
+database through any writer, using the shared engine in
+content_migration/engine.py and the table specs in content_migration/tables.py.
+
+Usage:
+    python3 migrate-content.py --source files|django|legacy-db --sink savepoint|pipeline|copy|psql
+                               [--storagebox-path PATH] [--legacy-db-url URL] [--database-url URL]
+                               [--schema PATH] [--batch-size N] [--commit-interval N]
+                               [--bulk-load [--rebuild-workers N]] [--progress-file PATH]
+                               [--id-map-dir DIR] [--rejects-dir DIR]
+                               [--profile DIR [--profile-mode sample|cprofile]] [--force]
+                               [--languages CODES] [--shadow]
+                               [--throttle [--target-latency MS] [--max-active N] [--max-replication-lag S]]
+                               [--batch-id ID]
+    python3 migrate-content.py --rollback BATCH | --list-batches [--sink psql] [--database-url URL]
+
+    Sources:
+      files      storagebox export files in <storagebox>/content-migration
+      django     legacy Django models (run from the speakasap-portal checkout
+                 with DJANGO_SETTINGS_MODULE set)
+      legacy-db  legacy PostgreSQL database at --legacy-db-url, read through
+                 server-side cursors without Django
+
+    Sinks:
+      savepoint  psycopg2, savepoint per batch, one round trip per row
+      pipeline   psycopg 3 pipeline mode, one round trip per batch
+      copy       pre-allocated ids and COPY per batch
+      psql       psql subprocesses with a prepared INSERT per batch
+
+    The table specs are checked against --schema (default:
+    ../prisma/schema.prisma) before anything is written. Options are
+    described in --help, README_MIGRATION.md and STORAGEBOX_MIGRATION_GUIDE.md.
+
+Environment Variables:
+    STORAGEBOX_PATH - Path to storagebox mount (default: /srv/storagebox)
+    LEGACY_DATABASE_URL - Legacy database connection string (legacy-db source)
+    DATABASE_URL - New Prisma database connection string (or NEW_DATABASE_URL)
+"""
+
+import os
+import sys
+import argparse
+import logging
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from content_migration.batching import DEFAULT_BATCH_SIZE, DEFAULT_COMMIT_INTERVAL
+from content_migration.bulkload import (
+    DEFAULT_REBUILD_WORKERS, BulkLoad, default_state_path, psql_runners, psycopg2_runners
+)
+from content_migration.engine import (
+    SINKS, SOURCES, CursorSink, FileSource, MigrationEngine, PsqlSink, ReaderSource, psql_runner
+)
+from content_migration.importbatch import ImportBatch, list_batches, rollback as rollback_batch
+from content_migration.legacy import connect_legacy, django_reader
+from content_migration.manifest import ImportState
+from content_migration.partition import LanguagePartition, parse_languages
+from content_migration.profiling import MODES as PROFILE_MODES, Profiler
+from content_migration.progress import ProgressReporter
+from content_migration.rejects import RejectSink
+from content_migration.schema import DEFAULT_SCHEMA_PATH, load_schema
+from content_migration.shadow import LIVE_SCHEMA, SHADOW_SCHEMA, ShadowSchema, migration_statements, shadow_url
+from content_migration.tables import TABLES
+from content_migration.throttle import DEFAULT_TARGET_LATENCY, AdaptiveThrottle, server_probe
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def connect(url, psycopg3=False):
+    """Open a connection with autocommit off (psycopg 3 for the pipeline sink)."""
+    if psycopg3:
+        import psycopg
+        return psycopg.connect(url, autocommit=False)
+    import psycopg2
+    conn = psycopg2.connect(url)
+    conn.autocommit = False
+    return conn
+
+
+def build_source(args, partition=None):
+    """Source for --source, and the legacy reader to close afterwards (or None)."""
+    if args.source == 'files':
+        directory = os.path.join(args.storagebox_path, 'content-migration')
+        if not os.path.isdir(directory):
+            raise ValueError("Export directory not found: {}".format(directory))
+        return FileSource(directory), None
+    if args.source == 'django':
+        reader = django_reader()
+    elif not args.legacy_db_url:
+        raise ValueError("--legacy-db-url or LEGACY_DATABASE_URL required for --source legacy-db")
+    else:
+        reader = connect_legacy(args.legacy_db_url)
+    return ReaderSource(reader, partition), reader
+
+
+def build_runners(args, database_url):
+    """(query, execute) runners on database_url, over the --sink's driver."""
+    if args.sink == 'psql':
+        return psql_runners(psql_runner(database_url))
+    return psycopg2_runners(lambda: connect(database_url, psycopg3=args.sink == 'pipeline'))
+
+
+def build_throttle(args):
+    """AdaptiveThrottle for --throttle (None without it)."""
+    if not args.throttle:
+        return None
+    query, _ = build_runners(args, args.database_url)
+    return AdaptiveThrottle(target_latency=args.target_latency / 1000.0, probe=server_probe(query),
+                            max_active=args.max_active, max_lag=args.max_replication_lag)
+
+
+def build_sink(args, database_url, models, throttle=None):
+    """Sink for --sink, and the (query, execute) runners for --bulk-load.
+
+    Every table's new ids are returned, for the import batch.
+    """
+    if args.sink == 'psql':
+        run = psql_runner(database_url)
+        return PsqlSink(run, batch_size=args.batch_size, models=models, throttle=throttle), psql_runners(run)
+    conn = connect(database_url, psycopg3=args.sink == 'pipeline')
+    sink = CursorSink(conn, backend=args.sink, batch_size=args.batch_size, commit_interval=args.commit_interval,
+                      throttle=throttle, returning=True)
+    return sink, build_runners(args, database_url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate content data with the unified migration engine')
+    parser.add_argument('--source', choices=SOURCES, help='Where the legacy rows are read from')
+    parser.add_argument('--sink', choices=SINKS, default='savepoint',
+                        help='How rows are written to the new database (default: savepoint)')
+    parser.add_argument('--storagebox-path', default=os.getenv('STORAGEBOX_PATH', '/srv/storagebox'),
+                        help='Path to storagebox mount for --source files (default: /srv/storagebox)')
+    parser.add_argument('--legacy-db-url', default=os.getenv('LEGACY_DATABASE_URL'),
+                        help='Legacy database URL for --source legacy-db')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL') or os.getenv('NEW_DATABASE_URL'),
+                        help='New database URL (default: DATABASE_URL)')
+    parser.add_argument('--schema', default=DEFAULT_SCHEMA_PATH,
+                        help='Prisma schema the table specs are checked against (default: {})'.format(
+                            DEFAULT_SCHEMA_PATH))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows per batch (default: {})'.format(DEFAULT_BATCH_SIZE))
+    parser.add_argument('--commit-interval', type=int, default=DEFAULT_COMMIT_INTERVAL,
+                        help='Commit every N rows; 0 migrates in one transaction (default: {}; '
+                             'the psql sink commits every batch)'.format(DEFAULT_COMMIT_INTERVAL))
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Drop secondary indexes and foreign keys during the load and rebuild them afterwards')
+    parser.add_argument('--rebuild-workers', type=int, default=DEFAULT_REBUILD_WORKERS,
+                        help='Parallel sessions for index rebuilds in --bulk-load and --shadow mode '
+                             '(default: {})'.format(
+                            DEFAULT_REBUILD_WORKERS))
+    parser.add_argument('--progress-file', help='Append per-table progress telemetry as JSON lines to this file')
+    parser.add_argument('--id-map-dir', help="Spill the id mappings to mmap'ed files in this directory")
+    parser.add_argument('--rejects-dir', help='Write rejected rows to <table>.rejects.tsv files in this directory')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Profile each table: phase timings, stacks and a summary written to DIR')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='sample',
+                        help='sample: collapsed stacks for flame graphs; cprofile: pstats dumps (default: sample)')
+    parser.add_argument('--force', action='store_true',
+                        help='Import every table, even those already imported from the same source data')
+    parser.add_argument('--languages', metavar='CODES', type=parse_languages,
+                        help='Replace only the content of these comma separated language codes (e.g. en,de)')
+    parser.add_argument('--shadow', action='store_true',
+                        help='Load into a shadow schema and swap it in place of the live tables afterwards')
+    parser.add_argument('--throttle', action='store_true',
+                        help='Adapt batch size and pace to the load on the shared database server')
+    parser.add_argument('--target-latency', type=float, default=DEFAULT_TARGET_LATENCY * 1000,
+                        help='Commit latency in ms above which --throttle backs off (default: {:g})'.format(
+                            DEFAULT_TARGET_LATENCY * 1000))
+    parser.add_argument('--max-active', type=int,
+                        help='With --throttle, back off while more other sessions than this are active')
+    parser.add_argument('--max-replication-lag', type=float,
+                        help='With --throttle, back off while a replica lags more than this many seconds')
+    parser.add_argument('--batch-id', help='Tag the new rows with this import batch id (default: a new id per run)')
+    parser.add_argument('--rollback', metavar='BATCH', help='Delete the rows inserted by import batch BATCH and exit')
+    parser.add_argument('--list-batches', action='store_true', help='List the recorded import batches and exit')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        logger.error("DATABASE_URL or --database-url required")
+        return 1
+    if args.list_batches:
+        for line in list_batches(build_runners(args, args.database_url)[0]) or ['No import batches recorded']:
+            logger.info(line)
+        return 0
+    if args.rollback:
+        try:
+            rollback_batch(*build_runners(args, args.database_url), batch_id=args.rollback)
+        except (ValueError, RuntimeError) as e:
+            logger.error(str(e))
+            return 1
+        return 0
+    if not args.source:
+        parser.error('--source is required')
+
+    if args.shadow and (args.languages or args.bulk_load):
+        parser.error('--shadow loads every table into new tables; it cannot be combined with '
+                     '--languages or --bulk-load')
+    partition = None
+    if args.languages:
+        if args.sink == 'psql':
+            parser.error('--languages needs a cursor sink (savepoint, pipeline or copy)')
+        if args.bulk_load:
+            parser.error('--languages cannot be combined with --bulk-load')
+        partition = LanguagePartition(args.languages)
+        # The slice is deleted and re-inserted in one transaction
+        args.commit_interval = 0
+
+    models = None
+    if os.path.exists(args.schema):
+        models = load_schema(args.schema)
+    else:
+        logger.warning("Prisma schema not found at {}; table specs are not checked".format(args.schema))
+
+    logger.info("=" * 60)
+    logger.info("Migrating content data: {} -> {}".format(args.source, args.sink))
+    if partition is not None:
+        logger.info("Languages: {}".format(', '.join(partition.codes)))
+    # The batch table lives next to the live tables; a shadow load's ranges
+    # are recorded for the shadow schema and follow its tables on the swap
+    import_batch = ImportBatch(*build_runners(args, args.database_url), batch_id=args.batch_id,
+                               schema=SHADOW_SCHEMA if args.shadow else LIVE_SCHEMA)
+    logger.info("Import batch: {}".format(import_batch.batch_id))
+    logger.info("=" * 60)
+
+    reporter = ProgressReporter(args.progress_file, source='migrate-content')
+    rejects = RejectSink(args.rejects_dir)
+    profiler = Profiler(args.profile, args.profile_mode)
+    reader = sink = bulk_load = shadow = None
+    status = 'error'
+    try:
+        source, reader = build_source(args, partition)
+        sink_url = args.database_url
+        if args.shadow:
+            shadow = ShadowSchema(*build_runners(args, args.database_url), statements=migration_statements(),
+                                  workers=args.rebuild_workers)
+            shadow.create()
+            sink_url = shadow_url(args.database_url)
+        sink, (query, execute) = build_sink(args, sink_url, models, build_throttle(args))
+        if args.bulk_load:
+            database = urlparse(args.database_url).path.lstrip('/')
+            bulk_load = BulkLoad(query, execute, default_state_path(database), workers=args.rebuild_workers)
+            bulk_load.prepare()
+
+        # A partial or shadow import leaves the recorded per-table state to the next full import
+        state = None if args.force or partition is not None or shadow is not None else ImportState(query, execute)
+        engine = MigrationEngine(source, sink, reporter, rejects=rejects, profiler=profiler,
+                                 id_map_dir=args.id_map_dir, models=models, state=state, partition=partition,
+                                 import_batch=import_batch)
+        engine.run()
+        # Close the import connection first so the index rebuild does not wait on its locks
+        sink.close()
+        sink = None
+        if bulk_load is not None:
+            bulk_load.restore(analyze_tables=[spec.target for spec in TABLES])
+        if shadow is not None:
+            shadow.finish(dict((spec.target, engine.stats[spec.key]['succeeded']) for spec in TABLES))
+            shadow.swap()
+
+        logger.info("=" * 60)
+        logger.info("Migration Summary")
+        logger.info("=" * 60)
+        for spec in TABLES:
+            stats = engine.stats.get(spec.key, {})
+            logger.info("{}: migrated={}, rejected={}, skipped={}, collapsed={}".format(
+                spec.key, stats.get('succeeded', 0), stats.get('failed', 0), stats.get('skipped', 0),
+                stats.get('collapsed', 0)))
+        logger.info("Import batch {}: undo with --rollback {}".format(import_batch.batch_id, import_batch.batch_id))
+        status = 'ok'
+        return 0
+    except Exception as e:
+        logger.error("Migration failed: {}".format(e), exc_info=True)
+        try:
+            import_batch.flush()
+            logger.info("Rows committed so far are tagged with import batch {}; undo with --rollback {}".format(
+                import_batch.batch_id, import_batch.batch_id))
+        except Exception as flush_error:
+            logger.error("Could not record import batch {}: {}".format(import_batch.batch_id, flush_error))
+        if bulk_load is not None and bulk_load.prepared:
+            try:
+                bulk_load.restore()
+            except Exception as restore_error:
+                logger.error("Could not restore indexes and foreign keys: {}".format(restore_error))
+        return 1
+    finally:
+        if sink is not None:
+            sink.close()
+        if reader is not None:
+            reader.close()
+        rejects.close()
+        profiler.close()
+        reporter.close(status)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Tests for content_migration.copyload."""
+
+import unittest
+
+from content_migration.copyload import _Statement, copy_value
+
+
+class CopyValueTest(unittest.TestCase):
+
+    def test_null_and_bool(self):
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value(True), 't')
+        self.assertEqual(copy_value(False), 'f')
+
+    def test_numbers(self):
+        self.assertEqual(copy_value(42), '42')
+        self.assertEqual(copy_value(0), '0')
+
+    def test_escapes(self):
+        self.assertEqual(copy_value('a\tb\nc\rd'), 'a\\tb\\nc\\rd')
+        # The backslash is escaped first, so escapes are not doubled
+        self.assertEqual(copy_value('C:\\dir\t'), 'C:\\\\dir\\t')
+
+    def test_plain_text(self):
+        self.assertEqual(copy_value('słowo'), 'słowo')
+
+
+class StatementTest(unittest.TestCase):
+
+    def test_returning_id_copies_the_id(self):
+        statement = _Statement('INSERT INTO "Word" (word, "languageId") VALUES (%s, %s) RETURNING id')
+        self.assertEqual(statement.table, '"Word"')
+        self.assertEqual(statement.columns, ['word', '"languageId"'])
+        self.assertTrue(statement.returns_id)
+        self.assertEqual(statement.copy_sql, 'COPY "Word" (id, word, "languageId") FROM STDIN')
+        self.assertEqual(statement.insert_sql,
+                         'INSERT INTO "Word" (id, word, "languageId") VALUES (%s, %s, %s) RETURNING id')
+
+    def test_without_returning_keeps_the_serial_default(self):
+        statement = _Statement('''
+            INSERT INTO "WordThemeRelation" ("wordId", "themeId")
+            VALUES (%s, %s);
+        ''')
+        self.assertFalse(statement.returns_id)
+        self.assertEqual(statement.copy_sql, 'COPY "WordThemeRelation" ("wordId", "themeId") FROM STDIN')
+        self.assertEqual(statement.insert_sql,
+                         'INSERT INTO "WordThemeRelation" ("wordId", "themeId") VALUES (%s, %s)')
+
+    def test_rejects_other_statements(self):
+        with self.assertRaises(ValueError):
+            _Statement('UPDATE "Word" SET word = %s')
+        with self.assertRaises(ValueError):
+            _Statement('INSERT INTO "Word" (word, "languageId") VALUES (%s, 1)')
+
+
+if __name__ == '__main__':
+    unittest.main()
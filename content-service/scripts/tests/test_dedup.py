@@ -0,0 +1,62 @@
+"""Tests for content_migration.dedup."""
+
+import unittest
+
+from content_migration.dedup import KeyDeduplicator, key_hash, word_key
+from content_migration.idmap import IdMapping
+
+
+class KeyDeduplicatorTest(unittest.TestCase):
+
+    def test_repeats_are_collapsed_onto_the_first_row(self):
+        dedup = KeyDeduplicator()
+        self.assertTrue(dedup.add(word_key('kot', 1, 'cat'), 10))
+        self.assertTrue(dedup.add(word_key('kot', 2, 'cat'), 11))
+        self.assertFalse(dedup.add(word_key('kot', 1, 'cat'), 12))
+        self.assertFalse(dedup.add(word_key('kot', 1, 'cat'), 13))
+        self.assertEqual(len(dedup), 2)
+        self.assertEqual(dedup.duplicates, 2)
+        self.assertEqual(list(dedup.collapsed.items()), [(12, 10), (13, 10)])
+
+    def test_null_part_never_collides(self):
+        dedup = KeyDeduplicator()
+        self.assertTrue(dedup.add(word_key('kot', 1, None), 1))
+        self.assertTrue(dedup.add(word_key('kot', 1, None), 2))
+        self.assertEqual(dedup.duplicates, 0)
+
+    def test_growth_keeps_every_key(self):
+        dedup = KeyDeduplicator()
+        for legacy_id in range(5000):
+            self.assertTrue(dedup.add(word_key('w{}'.format(legacy_id), 1, 't'), legacy_id))
+        for legacy_id in range(5000):
+            self.assertFalse(dedup.add(word_key('w{}'.format(legacy_id), 1, 't'), legacy_id + 5000))
+        self.assertEqual(len(dedup), 5000)
+        self.assertEqual(dedup.duplicates, 5000)
+
+    def test_merge_into_maps_repeats_to_survivor_ids(self):
+        dedup = KeyDeduplicator()
+        dedup.add(word_key('a', 1, 'x'), 1)
+        dedup.add(word_key('b', 1, 'x'), 2)
+        dedup.add(word_key('a', 1, 'x'), 3)
+        dedup.add(word_key('b', 1, 'x'), 4)
+        id_mapping = IdMapping()
+        # The survivor of 'b' was not imported
+        id_mapping[1] = 100
+        self.assertEqual(dedup.merge_into(id_mapping), 1)
+        self.assertEqual(list(id_mapping.items()), [(1, 100), (3, 100)])
+
+    def test_add_hash_matches_add(self):
+        keys = [word_key('w{}'.format(n % 7), 1, 't') for n in range(30)]
+        by_key, by_hash = KeyDeduplicator(), KeyDeduplicator()
+        for legacy_id, key in enumerate(keys, 1):
+            self.assertEqual(by_key.add(key, legacy_id), by_hash.add_hash(key_hash(key), legacy_id))
+        self.assertEqual(list(by_key.collapsed.items()), list(by_hash.collapsed.items()))
+
+    def test_key_hash_is_stable_and_non_zero(self):
+        self.assertEqual(key_hash(('a', 1, 'b')), key_hash(('a', '1', 'b')))
+        self.assertNotEqual(key_hash(('a', 1, 'b')), key_hash(('a', 1, 'c')))
+        self.assertNotEqual(key_hash(('',)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
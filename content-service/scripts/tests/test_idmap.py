@@ -0,0 +1,114 @@
+"""Tests for content_migration.idmap."""
+
+import shutil
+import tempfile
+import unittest
+
+from content_migration import idmap
+from content_migration.idmap import IdMapping
+
+
+class IdMappingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def _round_trip(self, pairs, spill_dir=None):
+        mapping = IdMapping(spill_dir)
+        for key, value in pairs:
+            mapping[key] = value
+        self._assert_mapping(mapping, dict(pairs))
+        return mapping
+
+    def _assert_mapping(self, mapping, expected):
+        for _ in range(2):
+            mapping.compact()
+            self.assertEqual(list(mapping.items()), sorted(expected.items()))
+            self.assertEqual(len(mapping), len(expected))
+            for key, value in expected.items():
+                self.assertEqual(mapping[key], value)
+            self.assertNotIn(-5, mapping)
+            self.assertIsNone(mapping.get(10 ** 9))
+
+    def test_dense(self):
+        mapping = self._round_trip([(key, key * 10) for key in range(100, 200)])
+        self.assertIsNotNone(mapping._dense)
+
+    def test_sparse(self):
+        mapping = self._round_trip([(1, 2), (1000, 3), (50000, 4)])
+        self.assertIsNone(mapping._dense)
+
+    def test_dense_spilled(self):
+        mapping = self._round_trip([(key, key + 1) for key in range(50)], self.spill_dir)
+        self.assertIsNotNone(mapping._mmap)
+        mapping.close()
+
+    def test_sparse_spilled(self):
+        mapping = self._round_trip([(1, 2), (1000, 3), (50000, 4)], self.spill_dir)
+        self.assertIsNotNone(mapping._mmap)
+        mapping.close()
+
+    def test_out_of_order_last_assignment_wins(self):
+        self._round_trip([(5, 1), (3, 2), (5, 3), (4, 4), (3, 5)])
+
+    def test_assignment_after_spill(self):
+        mapping = IdMapping(self.spill_dir)
+        mapping.extend([1, 1000], [2, 3])
+        mapping.compact()
+        mapping[7] = 9
+        mapping[1000] = 4
+        self.assertEqual(list(mapping.items()), [(1, 2), (7, 9), (1000, 4)])
+        mapping.close()
+
+    def test_dense_assignment_in_place(self):
+        mapping = IdMapping(self.spill_dir)
+        mapping.extend([1, 2, 4], [10, 20, 40])
+        mapping.compact()
+        spilled = mapping._mmap
+        mapping[3] = 30
+        mapping[1] = 11
+        self.assertIs(mapping._mmap, spilled)
+        self.assertEqual(list(mapping.items()), [(1, 11), (2, 20), (3, 30), (4, 40)])
+        mapping.close()
+
+    def test_pending_assignments_keep_order(self):
+        mapping = IdMapping(self.spill_dir)
+        mapping.extend([1, 2], [10, 20])
+        mapping.compact()
+        mapping[500] = 1
+        mapping[2] = 21
+        mapping[500] = 2
+        self.assertEqual(list(mapping.items()), [(1, 10), (2, 21), (500, 2)])
+        mapping.close()
+
+    def test_merge_runs(self):
+        original = idmap.RUN_SIZE
+        idmap.RUN_SIZE = 4
+        try:
+            keys = list(range(0, 60, 3)) + list(range(1, 60, 3)) + [30, 31, 2]
+            values = list(range(len(keys)))
+            mapping = IdMapping()
+            mapping.extend(keys, values)
+            self._assert_mapping(mapping, dict(zip(keys, values)))
+        finally:
+            idmap.RUN_SIZE = original
+
+    def test_extend_out_of_order(self):
+        mapping = IdMapping()
+        mapping.extend([10, 20], [1, 2])
+        mapping.extend([15, 5], [3, 4])
+        self.assertEqual(list(mapping.items()), [(5, 4), (10, 1), (15, 3), (20, 2)])
+
+    def test_empty(self):
+        mapping = IdMapping(self.spill_dir)
+        mapping.compact()
+        self.assertEqual(len(mapping), 0)
+        self.assertFalse(mapping)
+        self.assertIsNone(mapping.get(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Tests for content_migration.importbatch."""
+
+import unittest
+
+from content_migration.importbatch import (
+    BATCH_TABLE, ImportBatch, id_ranges, insert_table, move_schemas_sql, rollback_sql
+)
+from content_migration.tables import TABLES
+
+
+class IdRangesTest(unittest.TestCase):
+
+    def test_runs_of_consecutive_ids(self):
+        self.assertEqual(id_ranges([7, 5, 6, 9, 12, 11]), [(5, 7), (9, 9), (11, 12)])
+
+    def test_duplicates_and_empty(self):
+        self.assertEqual(id_ranges([3, 3, 4, 4]), [(3, 4)])
+        self.assertEqual(id_ranges([]), [])
+
+
+class ImportBatchTest(unittest.TestCase):
+
+    def test_insert_table(self):
+        self.assertEqual(insert_table('\n  INSERT INTO "Word" (word) VALUES ($1) RETURNING id'), 'Word')
+        with self.assertRaises(ValueError):
+            insert_table('UPDATE "Word" SET word = 1')
+
+    def test_flush_writes_ranges_once_per_threshold(self):
+        statements = []
+        batch = ImportBatch(lambda sql: '', statements.append, batch_id='b1', flush_ids=3)
+        recorded = []
+        on_success = batch.recorder('Word', lambda key, new_id: recorded.append((key, new_id)))
+        for key, new_id in ((1, 5), (2, 6), (3, None), (4, 7), (5, 9)):
+            on_success(key, new_id)
+        self.assertEqual(len(recorded), 5)
+        # The table is created with the first flush, at the third recorded id
+        self.assertEqual(len(statements), 2)
+        self.assertIn("('b1', 'public', 'Word', 5, 7)", statements[1])
+        batch.flush()
+        self.assertIn("('b1', 'public', 'Word', 9, 9)", statements[2])
+        batch.flush()
+        self.assertEqual(len(statements), 3)
+
+    def test_rollback_deletes_children_first(self):
+        statements = rollback_sql('b1')
+        self.assertEqual(len(statements), len(TABLES) + 1)
+        targets = [statement.split('"')[3] for statement in statements[:-1]]
+        self.assertEqual(targets, [spec.target for spec in reversed(TABLES)])
+        self.assertIn(BATCH_TABLE, statements[-1])
+
+    def test_rollback_is_schema_qualified(self):
+        statements = rollback_sql('b1', schemas=['content_shadow'])
+        for statement in statements[:-1]:
+            self.assertTrue(statement.startswith('DELETE FROM "content_shadow".'))
+            self.assertIn("batch.schema_name = 'content_shadow'", statement)
+
+    def test_shadow_batches_follow_the_swap(self):
+        statement = move_schemas_sql([('content_previous', None), ('public', 'content_previous'),
+                                      ('content_shadow', 'public')])
+        self.assertIn("DELETE FROM \"{}\" WHERE schema_name IN ('content_previous')".format(BATCH_TABLE), statement)
+        self.assertIn("WHEN 'public' THEN 'content_previous' WHEN 'content_shadow' THEN 'public'", statement)
+
+
+if __name__ == '__main__':
+    unittest.main()
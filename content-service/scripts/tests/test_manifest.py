@@ -0,0 +1,108 @@
+"""Tests for content_migration.manifest."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from content_migration.manifest import ExportManifest, Fingerprint, ImportState
+from content_migration.tables import TABLES, get_table
+
+
+class FakeState(object):
+    """query/execute pair over recorded imports (target '10:10') and current targets."""
+
+    def __init__(self, imported, targets):
+        self.imported = imported
+        self.targets = targets
+
+    def query(self, sql):
+        if 'json_object_agg' in sql:
+            return json.dumps(dict((key, [fingerprint, '10:10']) for key, fingerprint in self.imported.items()))
+        for key, target in self.targets.items():
+            if '"{}"'.format(get_table(key).target) in sql:
+                return target
+        raise AssertionError(sql)
+
+    def execute(self, sql):
+        pass
+
+
+class ImportStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manifest = ExportManifest()
+        for spec in TABLES:
+            self.manifest.tables[spec.key] = {'fingerprint': '10:10:{}'.format(spec.key)}
+        self.targets = dict((spec.key, '10:10') for spec in TABLES)
+
+    def _skipped(self, imported):
+        fake = FakeState(imported, self.targets)
+        return ImportState(fake.query, fake.execute).skipped(self.manifest, TABLES)
+
+    def test_everything_current_is_skipped(self):
+        imported = dict((spec.key, '10:10:{}'.format(spec.key)) for spec in TABLES)
+        self.assertEqual(self._skipped(imported), set(spec.key for spec in TABLES))
+
+    def test_changed_parent_keeps_its_children(self):
+        imported = dict((spec.key, '10:10:{}'.format(spec.key)) for spec in TABLES)
+        imported['words'] = 'changed'
+        skipped = self._skipped(imported)
+        self.assertNotIn('words', skipped)
+        # A re-imported child needs the id mapping of its parents
+        self.assertNotIn('languages', skipped)
+        self.assertIn('word_themes', skipped)
+
+    def test_changed_target_is_not_skipped(self):
+        imported = dict((spec.key, '10:10:{}'.format(spec.key)) for spec in TABLES)
+        self.targets['word_theme_relations'] = '11:11'
+        self.assertNotIn('word_theme_relations', self._skipped(imported))
+
+    def test_nothing_imported(self):
+        self.assertEqual(self._skipped({}), set())
+
+
+class ExportManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spec = get_table('words')
+        self.path = os.path.join(self.directory, self.spec.filename)
+        with open(self.path, 'w') as f:
+            f.write('1,a\n')
+        self.fingerprint = Fingerprint(1, 1, '42')
+        self.manifest = ExportManifest()
+        self.manifest.record(self.spec, self.fingerprint, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unchanged(self):
+        self.assertTrue(self.manifest.unchanged(self.spec, self.fingerprint, self.directory))
+
+    def test_changed_fingerprint(self):
+        self.assertFalse(self.manifest.unchanged(self.spec, Fingerprint(2, 2, '42'), self.directory))
+
+    def test_changed_file(self):
+        with open(self.path, 'a') as f:
+            f.write('2,b\n')
+        self.assertFalse(self.manifest.unchanged(self.spec, self.fingerprint, self.directory))
+
+    def test_unpublished(self):
+        self.manifest.expect(self.spec, self.fingerprint)
+        self.assertFalse(self.manifest.unchanged(self.spec, self.fingerprint, self.directory))
+
+    def test_round_trip(self):
+        self.manifest.save(self.directory)
+        loaded = ExportManifest.load(self.directory)
+        self.assertEqual(loaded.fingerprint('words'), '1:1:42')
+        self.assertTrue(loaded.unchanged(self.spec, self.fingerprint, self.directory))
+
+    def test_fingerprint_parse(self):
+        self.assertEqual(Fingerprint.parse('3:7:-12\n'), Fingerprint(3, 7, '-12'))
+        self.assertEqual(str(Fingerprint(3, 7, '-12')), '3:7:-12')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for content_migration.parsecache."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from content_migration.parsecache import ParseCache, parse_lines
+from content_migration.reader import ExportFile
+
+
+def _parse(line):
+    fields = line.split(',')
+    return fields if len(fields) == 3 else None
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ParseCache(os.path.join(self.directory, 'cache'))
+        self.path = os.path.join(self.directory, 'words.sql')
+        lines = ['-- export', 'short'] + ['{},słowo{},1'.format(i, i) for i in range(50)]
+        with open(self.path, 'wb') as f:
+            f.write('\n'.join(lines).encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _rows(self, start=0, end=None):
+        with ExportFile(self.path) as export:
+            # A hit yields the raw line as a callable reading it from the export
+            return [(offset, line() if callable(line) else line, row)
+                    for offset, line, row in self.cache.rows(export, _parse, start, end)]
+
+    def _parsed(self, start=0, end=None):
+        with ExportFile(self.path) as export:
+            return list(parse_lines(export, _parse, start, end))
+
+    def test_miss_then_hit_yields_the_parsed_rows(self):
+        self.assertFalse(self.cache.prepare(self.path))
+        expected = self._parsed()
+        self.assertEqual(len(expected), 50)
+        self.assertEqual(self._rows(), expected)
+        self.assertTrue(self.cache.prepare(self.path))
+        self.assertEqual(self._rows(), expected)
+
+    def test_hit_serves_sub_ranges(self):
+        self._rows()
+        with ExportFile(self.path) as export:
+            ranges = export.shard_ranges(3)
+        for start, end in ranges:
+            self.assertEqual(self._rows(start, end), self._parsed(start, end))
+
+    def test_shard_parts_are_assembled(self):
+        with ExportFile(self.path) as export:
+            ranges = export.shard_ranges(3)
+        for start, end in ranges:
+            self._rows(start, end)
+        self.assertFalse(os.path.exists(self.cache.cache_path(self.path)))
+        self.assertTrue(self.cache.assemble(self.path, ranges))
+        self.assertEqual(self._rows(), self._parsed())
+        self.assertEqual([name for name in os.listdir(self.cache.directory) if name.endswith('.part')], [])
+
+    def test_incomplete_shards_are_not_assembled(self):
+        with ExportFile(self.path) as export:
+            ranges = export.shard_ranges(3)
+        self._rows(*ranges[0])
+        self.assertFalse(self.cache.assemble(self.path, ranges))
+
+    def test_changed_export_gets_a_new_cache(self):
+        self._rows()
+        old = self.cache.cache_path(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'\n99,nowe,2')
+        cache = ParseCache(self.cache.directory)
+        self.assertNotEqual(cache.cache_path(self.path), old)
+        with ExportFile(self.path) as export:
+            self.assertEqual(list(cache.rows(export, _parse))[-1][2], ['99', 'nowe', '2'])
+        self.assertFalse(os.path.exists(old))
+
+    def test_registered_digest_keys_the_cache(self):
+        self.cache.register(self.path, 'sha256:aa')
+        first = self.cache.cache_path(self.path)
+        self._rows()
+        self.assertTrue(os.path.exists(first))
+        cache = ParseCache(self.cache.directory)
+        cache.register(self.path, 'sha256:bb')
+        self.assertNotEqual(cache.cache_path(self.path), first)
+        self.assertNotEqual(ParseCache(self.cache.directory).cache_path(self.path), first)
+
+    def test_hit_reads_lines_on_demand(self):
+        self._rows()
+        with ExportFile(self.path) as export:
+            rows = list(self.cache.rows(export, _parse))
+            self.assertTrue(all(callable(line) for _, line, _ in rows))
+            self.assertEqual(rows[0][1](), '0,słowo0,1'.encode('utf-8'))
+
+    def test_row_with_nul_is_not_cached(self):
+        with open(self.path, 'ab') as f:
+            f.write(b'\n7,a\x00b,1')
+        self.assertEqual(len(self._rows()), 51)
+        self.assertFalse(os.path.exists(self.cache.cache_path(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
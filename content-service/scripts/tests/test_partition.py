@@ -0,0 +1,61 @@
+"""Tests for content_migration.partition."""
+
+import unittest
+
+from content_migration.partition import LanguagePartition, parse_languages
+from content_migration.tables import TABLES, get_table
+
+
+class LanguagePartitionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.partition = LanguagePartition(['en', "d'e"])
+
+    def test_parse_languages(self):
+        self.assertEqual(parse_languages(' en, de ,'), ['en', 'de'])
+        with self.assertRaises(ValueError):
+            parse_languages(' , ')
+
+    def test_tables_leave_out_word_themes(self):
+        keys = [spec.key for spec in self.partition.tables(TABLES)]
+        self.assertNotIn('word_themes', keys)
+        self.assertEqual(keys[0], 'languages')
+        self.assertEqual(keys[-1], 'word_theme_relations')
+
+    def test_legacy_where(self):
+        self.assertEqual(self.partition.legacy_where(get_table('languages')),
+                         '"code" IN (\'en\', \'d\'\'e\')')
+        self.assertEqual(
+            self.partition.legacy_where(get_table('grammar_lessons')),
+            '"course_id" IN (SELECT "id" FROM "grammar_grammarcourse" WHERE '
+            '"language_id" IN (SELECT "id" FROM "language_language" WHERE "code" IN (\'en\', \'d\'\'e\')))')
+
+    def test_target_where(self):
+        self.assertEqual(
+            self.partition.target_where(get_table('word_theme_relations')),
+            '"wordId" IN (SELECT "id" FROM "Word" WHERE '
+            '"languageId" IN (SELECT "id" FROM "Language" WHERE "code" IN (\'en\', \'d\'\'e\')))')
+
+    def test_delete_sql_children_first(self):
+        statements = self.partition.delete_sql(TABLES)
+        keys = [spec.key for spec, _ in statements]
+        self.assertEqual(keys[0], 'word_theme_relations')
+        self.assertEqual(keys[-1], 'languages')
+        self.assertLess(keys.index('grammar_lessons'), keys.index('grammar_courses'))
+        self.assertEqual(statements[-1][1], 'DELETE FROM "Language" WHERE "code" IN (\'en\', \'d\'\'e\')')
+
+    def test_row_filter_follows_parents(self):
+        keep_language = self.partition.row_filter(get_table('languages'))
+        self.assertTrue(keep_language(['1', 'en', 'english', 'English', '', '1', '']))
+        self.assertFalse(keep_language(['2', 'fr', 'french', 'French', '', '2', '']))
+        keep_word = self.partition.row_filter(get_table('words'))
+        self.assertTrue(keep_word(['10', 'cat', '', 'kot', '1']))
+        self.assertFalse(keep_word(['11', 'chat', '', 'kot', '2']))
+        keep_relation = self.partition.row_filter(get_table('word_theme_relations'))
+        self.assertTrue(keep_relation(['100', '10', '5', '1']))
+        self.assertFalse(keep_relation(['101', '11', '5', '1']))
+        self.assertEqual(self.partition.missing_codes(), ["d'e"])
+
+
+if __name__ == '__main__':
+    unittest.main()
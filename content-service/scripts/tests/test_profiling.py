@@ -0,0 +1,56 @@
+"""Tests for content_migration.profiling."""
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from content_migration.batching import PreparedPsqlBatch
+from content_migration.profiling import Profiler
+from content_migration.progress import ProgressReporter
+
+
+def _psql(script):
+    """Fake psql run: 20ms of which psql reports 1ms per statement as server time."""
+    time.sleep(0.02)
+    rows = script.count('EXECUTE')
+    stdout = ''.join('{}|{}\nTime: 1.000 ms\n'.format(100 + position, position) for position in range(rows))
+    return stdout, ''
+
+
+class PsqlPhasesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_psql_writes_split_into_format_spawn_and_server(self):
+        profiler = Profiler(self.directory)
+        progress = ProgressReporter().table('words')
+        scripts = []
+        imported = []
+
+        def run(script):
+            scripts.append(script)
+            return _psql(script)
+
+        with profiler.table(progress) as profile:
+            batch = profile.batch(PreparedPsqlBatch(run, 'INSERT INTO "Word" (word) VALUES ($1)', batch_size=5,
+                                                    on_success=lambda key, new_id: imported.append(key)))
+            for key in range(10):
+                batch.execute(('word{}'.format(key),), key)
+            batch.finish()
+
+        self.assertEqual(imported, list(range(10)))
+        self.assertIn('\\timing on', scripts[0])
+        phases = progress.phases
+        self.assertAlmostEqual(phases['server'], 0.01, places=6)
+        self.assertGreater(phases['spawn'], 0.02)
+        self.assertIn('format', phases)
+        self.assertIn('server', profiler.summary_lines()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Tests for content_migration.reader."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from content_migration.reader import ExportFile
+
+
+class ExportFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _export(self, content):
+        path = os.path.join(self.directory, 'words.sql')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_lines_skip_comments_and_blanks(self):
+        path = self._export(b'-- header\n1,a\n\n  2,b  \n-- note\n3,c')
+        with ExportFile(path) as export:
+            self.assertEqual(list(export.lines()), [b'1,a', b'2,b', b'3,c'])
+            self.assertEqual(len(export), 3)
+
+    def test_shard_ranges_cover_the_file_on_line_starts(self):
+        content = b'-- header\n' + b''.join('{},word{}\n'.format(i, i).encode('ascii') for i in range(103))
+        path = self._export(content)
+        with ExportFile(path) as export:
+            ranges = export.shard_ranges(4)
+            self.assertEqual(len(ranges), 4)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], export.size)
+            for previous, current in zip(ranges, ranges[1:]):
+                self.assertEqual(previous[1], current[0])
+                self.assertEqual(content[current[0] - 1:current[0]], b'\n')
+            counts = [len(list(export.lines(start, end))) for start, end in ranges]
+            self.assertEqual(sum(counts), 103)
+            self.assertLessEqual(max(counts) - min(counts), 1)
+
+    def test_shard_ranges_of_a_small_or_empty_file(self):
+        with ExportFile(self._export(b'1,a\n')) as export:
+            self.assertEqual(export.shard_ranges(4), [(0, 4)])
+        with ExportFile(self._export(b'')) as export:
+            self.assertEqual(export.shard_ranges(4), [(0, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests for content_migration.shadow."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from content_migration.shadow import DEFAULT_MIGRATIONS_DIR, migration_statements, shadow_url
+
+
+class MigrationStatementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _migration(self, name, text):
+        os.makedirs(os.path.join(self.directory, name))
+        with open(os.path.join(self.directory, name, 'migration.sql'), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_statements_in_migration_order(self):
+        self._migration('20240102_second', 'ALTER TABLE "Word" ADD COLUMN "note" TEXT;\n')
+        self._migration('20240101_init', '-- CreateTable\nCREATE TABLE "Word" (\n    "id" SERIAL,\n    "word" TEXT\n);\n\n'
+                                         'CREATE INDEX "Word_word_idx" ON "Word"("word");\n')
+        self.assertEqual(migration_statements(self.directory), [
+            'CREATE TABLE "Word" (\n    "id" SERIAL,\n    "word" TEXT\n)',
+            'CREATE INDEX "Word_word_idx" ON "Word"("word")',
+            'ALTER TABLE "Word" ADD COLUMN "note" TEXT',
+        ])
+
+    def test_no_migrations(self):
+        with self.assertRaises(ValueError):
+            migration_statements(self.directory)
+
+    def test_repository_migrations(self):
+        if not os.path.isdir(DEFAULT_MIGRATIONS_DIR):
+            self.skipTest('no Prisma migrations in this checkout')
+        statements = migration_statements()
+        self.assertTrue(any(statement.startswith('CREATE TABLE') for statement in statements))
+
+
+class ShadowUrlTest(unittest.TestCase):
+
+    def test_adds_options(self):
+        self.assertEqual(shadow_url('postgresql://u:p@h:5432/db'),
+                         'postgresql://u:p@h:5432/db?options=-c%20search_path%3Dcontent_shadow')
+
+    def test_appends_to_query(self):
+        self.assertEqual(shadow_url('postgresql://h/db?sslmode=require', 'other'),
+                         'postgresql://h/db?sslmode=require&options=-c%20search_path%3Dother')
+
+    def test_extends_existing_options(self):
+        self.assertEqual(shadow_url('postgresql://h/db?options=-c%20work_mem%3D64MB&sslmode=disable'),
+                         'postgresql://h/db?options=-c%20work_mem%3D64MB%20-c%20search_path%3Dcontent_shadow'
+                         '&sslmode=disable')
+
+
+if __name__ == '__main__':
+    unittest.main()
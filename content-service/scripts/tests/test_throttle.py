@@ -0,0 +1,58 @@
+"""Tests for content_migration.throttle."""
+
+import unittest
+
+from content_migration.throttle import AdaptiveThrottle, server_probe
+
+
+class AdaptiveThrottleTest(unittest.TestCase):
+
+    def test_idle_server_grows_towards_batch_seconds(self):
+        throttle = AdaptiveThrottle(batch_seconds=1.0, max_batch_size=5000)
+        throttle.observe_commit(0.01)
+        self.assertEqual(throttle.observe_batch(0.1, 100, 100), 200)
+        # 1ms per row: a one second batch holds 1000 rows
+        self.assertEqual(throttle.observe_batch(1.6, 1600, 1600), 1000)
+        self.assertEqual(throttle.pause, 0.0)
+
+    def test_slow_commits_back_off(self):
+        throttle = AdaptiveThrottle(target_latency=0.05, min_batch_size=50, max_pause=1.0)
+        throttle.observe_commit(0.5)
+        self.assertEqual(throttle.observe_batch(0.1, 1000, 1000), 500)
+        self.assertTrue(throttle.busy)
+        self.assertEqual(throttle.pause, 0.05)
+        sizes = [throttle.observe_batch(0.1, 100, 100) for _ in range(10)]
+        self.assertEqual(sizes[-1], 50)
+        self.assertEqual(throttle.pause, 1.0)
+
+    def test_recovery_halves_the_pause(self):
+        throttle = AdaptiveThrottle(target_latency=0.05)
+        throttle.observe_commit(1.0)
+        for _ in range(3):
+            throttle.observe_batch(0.1, 100, 100)
+        self.assertEqual(throttle.pause, 0.2)
+        throttle.commit_latency = None
+        throttle.observe_commit(0.01)
+        throttle.observe_batch(0.1, 100, 100)
+        self.assertFalse(throttle.busy)
+        self.assertEqual(throttle.pause, 0.1)
+
+    def test_probe_marks_the_server_busy(self):
+        throttle = AdaptiveThrottle(probe=lambda: (12, 0.0), max_active=8)
+        self.assertEqual(throttle.observe_batch(0.1, 100, 400), 200)
+        self.assertTrue(throttle.busy)
+
+    def test_failing_probe_keeps_the_last_state(self):
+        def probe():
+            raise RuntimeError('connection lost')
+        throttle = AdaptiveThrottle(probe=probe, max_lag=5)
+        self.assertEqual(throttle.observe_batch(0.1, 100, 400), 800)
+        self.assertFalse(throttle.busy)
+
+    def test_server_probe(self):
+        probe = server_probe(lambda sql: ' 3:0.25\n')
+        self.assertEqual(probe(), (3, 0.25))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for content_migration.transfer."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from content_migration.transfer import (
+    MAX_CHUNK_SIZE, DeltaTransfer, Publisher, iter_chunks, load_index, materialize, stored_size)
+
+
+def _write_rows(path, rows, seed=1):
+    generator = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write('{},{},{}\n'.format(row, generator.random(), 'słowo' * generator.randint(1, 20)))
+
+
+class TransferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local = os.path.join(self.directory, 'export')
+        self.storagebox = os.path.join(self.directory, 'storagebox')
+        os.makedirs(self.local)
+        os.makedirs(self.storagebox)
+        self.path = os.path.join(self.local, 'words.sql')
+        _write_rows(self.path, range(20000))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chunks_cover_the_file(self):
+        chunks = list(iter_chunks(self.path))
+        self.assertGreater(len(chunks), 1)
+        offset = 0
+        for chunk_offset, length, _ in chunks:
+            self.assertEqual(chunk_offset, offset)
+            self.assertLessEqual(length, MAX_CHUNK_SIZE)
+            offset += length
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_edit_changes_few_chunks(self):
+        before = set(digest for _, _, digest in iter_chunks(self.path))
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        lines[10000] = '10000,edited\n'
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        after = set(digest for _, _, digest in iter_chunks(self.path))
+        self.assertLessEqual(len(after - before), 2)
+
+    def test_push_writes_only_new_chunks(self):
+        transfer = DeltaTransfer(self.storagebox)
+        written, size = transfer.push(self.path)
+        self.assertEqual(written, size)
+        self.assertEqual(stored_size(self.storagebox, 'words.sql'), size)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('20000,new\n')
+        written, size = DeltaTransfer(self.storagebox).push(self.path)
+        self.assertLess(written, size // 10)
+
+    def test_prune_keeps_the_previous_run_for_one_run(self):
+        chunk_sets = []
+        for run in range(3):
+            _write_rows(self.path, range(2000), seed=run)
+            publisher = Publisher(self.storagebox, 'delta')
+            publisher.publish(self.path)
+            publisher.finish()
+            chunk_sets.append(set(digest for digest, _ in load_index(self.storagebox, 'words.sql')['chunks']))
+        transfer = DeltaTransfer(self.storagebox)
+        previous = chunk_sets[1] - chunk_sets[2]
+        older = chunk_sets[0] - chunk_sets[1] - chunk_sets[2]
+        self.assertTrue(previous and older)
+        self.assertTrue(all(os.path.exists(transfer.chunk_path(digest)) for digest in previous))
+        self.assertFalse(any(os.path.exists(transfer.chunk_path(digest)) for digest in older))
+
+    def test_materialize_round_trip(self):
+        Publisher(self.storagebox, 'delta').publish(self.path)
+        with open(os.path.join(self.storagebox, 'manifest.json'), 'w') as f:
+            f.write('{}')
+        target_dir = os.path.join(self.directory, 'import')
+        self.assertEqual(materialize(self.storagebox, ['words.sql'], target_dir), target_dir)
+        with open(self.path, 'rb') as f, open(os.path.join(target_dir, 'words.sql'), 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertTrue(os.path.exists(os.path.join(target_dir, 'manifest.json')))
+        # A reassembled file that matches its index is kept
+        self.assertEqual(materialize(self.storagebox, ['words.sql'], target_dir), target_dir)
+        self.assertEqual([name for name in os.listdir(target_dir) if '.tmp' in name], [])
+
+    def test_materialize_plain_files_in_place(self):
+        Publisher(self.storagebox).publish(self.path)
+        self.assertIsNone(load_index(self.storagebox, 'words.sql'))
+        self.assertEqual(materialize(self.storagebox, ['words.sql']), self.storagebox)
+
+    def test_materialize_rejects_a_corrupt_chunk(self):
+        Publisher(self.storagebox, 'delta').publish(self.path)
+        digest = load_index(self.storagebox, 'words.sql')['chunks'][0][0]
+        with open(DeltaTransfer(self.storagebox).chunk_path(digest), 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(ValueError):
+            materialize(self.storagebox, ['words.sql'], os.path.join(self.directory, 'import'))
+
+
+if __name__ == '__main__':
+    unittest.main()